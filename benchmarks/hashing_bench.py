@@ -0,0 +1,74 @@
+# coding: utf-8
+"""
+Throughput of asset hashing against file count and file size.
+
+Compares the serial 8 KiB reads (former behaviour) with concurrent hashing by `compute_digests`.
+Files are read from the page cache after the first pass, so numbers show CPU bound throughput.
+
+    python -m benchmarks.hashing_bench [--workers N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from pathlib import Path
+
+from mf.assets import RawAsset, compute_digests, _calc_md5_, DEFAULT_HASH_WORKERS
+
+MB = 1024 * 1024
+
+CASES = [
+    # (number of files, size of a file)
+    (2000, 16 * 1024),
+    (200, 1 * MB),
+    (32, 16 * MB),
+    (4, 128 * MB),
+]
+
+
+def _make_files(root: Path, count: int, size: int):
+    block = os.urandom(min(size, MB))
+    files = []
+    for i in range(count):
+        f = root / f'{count}-{size}-{i}.bin'
+        with open(f, 'wb') as out:
+            left = size
+            while left > 0:
+                out.write(block[:left])
+                left -= len(block)
+        files.append(f)
+    return files
+
+
+def _measure(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=DEFAULT_HASH_WORKERS)
+    args = parser.parse_args()
+
+    print(f"{'files':>6} {'size':>10} {'serial MB/s':>12} {'parallel MB/s':>14} {'speedup':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for count, size in CASES:
+            files = _make_files(Path(tmp), count, size)
+            total_mb = count * size / MB
+
+            serial = _measure(lambda: [_calc_md5_(f, chunk_size=8192) for f in files])
+            parallel = _measure(lambda: compute_digests([RawAsset(f) for f in files], workers=args.workers))
+
+            print(f'{count:>6} {size:>10} {total_mb / serial:>12.1f} {total_mb / parallel:>14.1f} '
+                  f'{serial / parallel:>7.2f}x')
+
+            for f in files:
+                f.unlink()
+
+
+if __name__ == '__main__':
+    main()
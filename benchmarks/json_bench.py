@@ -0,0 +1,54 @@
+# coding: utf-8
+"""
+Encoding and decoding of manifests and listings by the stdlib json and orjson codecs (mf.serialization).
+
+    python -m benchmarks.json_bench [--repeat N]
+"""
+
+import argparse
+import io
+import os
+import time
+
+from unittest import mock
+
+from benchmarks.manifest_bench import _make_manifest
+from mf import serialization
+from mf.index import ManifestIndex
+
+CASES = [1000, 10000, 100000]
+
+
+def _measure(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'branches':>8} {'operation':>10} {'json ms':>10} {'orjson ms':>10}")
+
+    for branches in CASES:
+        manifest = _make_manifest(branches)
+        encoded = serialization.dumps(manifest)
+        rows = ManifestIndex(manifest).lookup()
+
+        cases = [
+            ('dumps', lambda: serialization.dumps(manifest)),
+            ('loads', lambda: serialization.loads(encoded)),
+            ('list', lambda: serialization.write_json_lines(rows, io.BytesIO())),
+        ]
+        for name, fn in cases:
+            with mock.patch.dict(os.environ, {'MF_JSON_CODEC': serialization.CODEC_JSON}):
+                stdlib = _measure(fn, args.repeat)
+            fast = _measure(fn, args.repeat) if serialization.codec() == serialization.CODEC_ORJSON else 0
+            print(f'{branches:>8} {name:>10} {stdlib:>10.2f} {fast:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
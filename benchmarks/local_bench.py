@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+End to end `put` and `get` against a local `file://` bucket (mf.local.StorageLocal), no GCS needed.
+
+Measures publishing and downloading a project of many files, and builds of several branches
+publishing into one manifest concurrently (compare-and-set conflicts are retried).
+
+    python -m benchmarks.local_bench [--files N] [--size BYTES] [--branches N]
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from mf.config import BuildInfo, Project
+from mf.manifest import Manifest
+from mf.transfer import download_binaries
+
+
+def _make_project(root: Path, bucket: str, files: int, size: int) -> Project:
+    block = os.urandom(size)
+    for i in range(files):
+        f = root / 'src' / f'{i % 16:02d}' / f'file-{i:05d}.bin'
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(block[i % size:] + block[:i % size])
+
+    return Project({
+        'bucket': bucket,
+        'repository': 'repo',
+        'components': {'app': {'type': 'bin', 'assets': [{'glob': './src/**/*.bin'}]}}
+    }, root_dir=root)
+
+
+def _build(branch: str) -> BuildInfo:
+    return BuildInfo(git_sha=f'{abs(hash(branch)):040x}'[:40], git_branch=branch, build_id=branch,
+                     date=datetime.datetime(2020, 1, 1))
+
+
+def _measure(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=64 * 1024)
+    parser.add_argument('--branches', type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / 'bucket').mkdir()
+        bucket = f'file://{root / "bucket"}'
+        project = _make_project(root / 'project', bucket, args.files, args.size)
+        mb = args.files * args.size / 1024 / 1024
+
+        put = _measure(lambda: Manifest(bucket, 'repo').update(_build('dev'), project))
+        print(f'put {args.files} files ({mb:.0f} MiB): {put:.2f}s')
+
+        reput = _measure(lambda: Manifest(bucket, 'repo').update(_build('dev'), project))
+        print(f'put again, nothing uploaded: {reput:.2f}s')
+
+        manifest = Manifest(bucket, 'repo')
+        binaries = manifest.search(branch_name='dev')
+        get = _measure(lambda: download_binaries(manifest, binaries, root / 'out'))
+        print(f'get {len(binaries)} files: {get:.2f}s')
+
+        # the same assets are published by every branch, only the manifest is contended
+        small = _make_project(root / 'small', bucket, 4, 1024)
+        with mock.patch('mf.manifest.backoff_delay', return_value=0):
+            def _publish(branch):
+                m = Manifest(bucket, 'repo')
+                m.update(_build(branch), small)
+                return m.update_stats.conflicts
+
+            with ThreadPoolExecutor(max_workers=args.branches) as pool:
+                started = time.perf_counter()
+                conflicts = sum(pool.map(_publish, [f'feature-{i}' for i in range(args.branches)]))
+                elapsed = time.perf_counter() - started
+        print(f'{args.branches} concurrent branches: {elapsed:.2f}s, {conflicts} conflicts retried')
+
+
+if __name__ == '__main__':
+    main()
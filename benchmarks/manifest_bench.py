@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Time and peak memory of reading and merging a manifest against the number of branches.
+
+Compares the former `copy.deepcopy` of the whole manifest with the read-only view of `Manifest.content`
+and the copy-on-write merge of `_apply_branch_entry`. Memory is the peak of python allocations (tracemalloc).
+
+    python -m benchmarks.manifest_bench [--repeat N]
+"""
+
+import argparse
+import copy
+import time
+import tracemalloc
+
+from mf.manifest import _apply_branch_entry
+from mf.views import ReadOnlyDict
+
+CASES = [1000, 10000, 100000]
+
+
+def _make_manifest(branches: int) -> dict:
+    return {'@spec': 1, '@ns': dict((f'feature-{b:06d}', {
+        '@last_success': {
+            '@built_at': '2020-01-01T00:00:00+00:00',
+            '@rev': f'{b:040x}',
+            '@build_id': str(b),
+            '@include': {
+                'app': {
+                    '@type': 'jar',
+                    '@metadata': {},
+                    '@binaries': [
+                        {'@md5': 'AAAAAAAAAAAAAAAAAAAAAA==', '@ref': f'gs://bucket/repo/feature-{b:06d}/app.jar'},
+                        {'@md5': 'BBBBBBBBBBBBBBBBBBBBBB==', '@ref': f'gs://bucket/repo/feature-{b:06d}/app.cfg'},
+                    ]
+                }
+            }
+        }
+    }) for b in range(branches))}
+
+
+def _deepcopy_merge(manifest: dict, branch: str, entry: dict) -> dict:
+    merged = copy.deepcopy(manifest)
+    merged['@ns'][branch] = copy.deepcopy(entry)
+    return merged
+
+
+def _measure(fn, repeat: int):
+    """
+    :return: (ms per call, peak KiB of one call)
+    """
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    entry = _make_manifest(1)['@ns']['feature-000000']
+
+    print(f"{'branches':>8} {'operation':>10} {'deepcopy ms':>12} {'KiB':>10} {'cow ms':>10} {'KiB':>8}")
+
+    for branches in CASES:
+        manifest = _make_manifest(branches)
+
+        cases = [
+            ('content', lambda: copy.deepcopy(manifest), lambda: ReadOnlyDict(manifest)),
+            ('merge', lambda: _deepcopy_merge(manifest, 'dev', entry), lambda: _apply_branch_entry(manifest, 'dev', entry)),
+        ]
+        for name, former, current in cases:
+            former_ms, former_kib = _measure(former, args.repeat)
+            current_ms, current_kib = _measure(current, args.repeat)
+            print(f'{branches:>8} {name:>10} {former_ms:>12.2f} {former_kib:>10.0f} {current_ms:>10.3f} {current_kib:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
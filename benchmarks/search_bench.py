@@ -0,0 +1,99 @@
+# coding: utf-8
+"""
+Latency of `Manifest.search` against the number of branches and apps in a manifest.
+
+Compares the former jsonpath based search (needs `pip install jsonpath-ng`) with the index built by
+`ManifestIndex`. The index is built once per fetched manifest, its build time is reported separately.
+
+    python -m benchmarks.search_bench [--repeat N]
+"""
+
+import argparse
+import time
+
+from mf.index import ManifestIndex
+
+CASES = [
+    # (number of branches, number of apps)
+    (10, 10),
+    (100, 20),
+    (500, 50),
+]
+
+
+def _make_manifest(branches: int, apps: int) -> dict:
+    ns = dict()
+    for b in range(branches):
+        ns[f'feature-{b:04d}'] = {
+            '@last_success': {
+                '@built_at': '2020-01-01T00:00:00+00:00',
+                '@rev': f'{b:040x}',
+                '@build_id': str(b),
+                '@include': dict((f'app-{a:03d}', {
+                    '@type': 'jar',
+                    '@metadata': {},
+                    '@binaries': [{'@md5': 'AAAA==', '@ref': f'gs://bucket/repo/{b}/{a}/app.jar'}],
+                }) for a in range(apps)),
+            }
+        }
+    return {'@spec': 1, '@ns': ns}
+
+
+def _jsonpath_search(content: dict, branch_name: str = '*', app_name: str = '*'):
+    from jsonpath_ng import parse
+    from jsonpath_ng.jsonpath import Fields
+
+    acc = []
+    for branch in parse(f'$.@ns.{branch_name}').find(content):
+        for build in Fields('@last_success').find(branch.value):
+            for app in Fields('@include').child(Fields(app_name)).find(build.value):
+                acc.extend([{
+                    'branch': str(branch.path),
+                    'app': str(app.path),
+                    'built_at': str(build.value['@built_at']),
+                    'commit': str(build.value['@rev']),
+                    'url': str(bin['@ref']),
+                } for bin in app.value.get('@binaries', []) if '@ref' in bin])
+    return sorted(acc, key=lambda d: (d['branch'], d['app']))
+
+
+def _measure(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        import jsonpath_ng  # noqa: F401
+        has_jsonpath = True
+    except ImportError:
+        has_jsonpath = False
+        print('jsonpath-ng is not installed, only the index is measured')
+
+    print(f"{'branches':>8} {'apps':>5} {'query':>12} {'jsonpath ms':>12} {'index ms':>9} {'build ms':>9}")
+
+    for branches, apps in CASES:
+        content = _make_manifest(branches, apps)
+        build = _measure(lambda: ManifestIndex(content), args.repeat)
+        index = ManifestIndex(content)
+
+        queries = [
+            ('all', '*', '*'),
+            ('branch', f'feature-{branches // 2:04d}', '*'),
+            ('app', '*', 'app-001'),
+        ]
+        for name, branch, app in queries:
+            indexed = _measure(lambda: index.lookup(branch, app), args.repeat)
+            legacy = _measure(lambda: _jsonpath_search(content, branch, app), args.repeat) if has_jsonpath else 0
+
+            print(f'{branches:>8} {apps:>5} {name:>12} {legacy:>12.2f} {indexed:>9.3f} {build:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# coding: utf-8
+"""
+Cold start of the CLI: cumulative import time of `mf.main` reported by `python -X importtime`.
+
+The best of several runs is compared with a budget, the script exits with 1 if the budget is exceeded,
+so it can guard CI against heavy modules imported at module level again.
+
+    python -m benchmarks.startup_bench [--budget-ms 100] [--runs 5]
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def _import_times(module: str):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True)
+    times = dict()
+    for line in out.stderr.decode('utf-8').splitlines():
+        m = _LINE.match(line)
+        if m:
+            # cumulative microseconds, only the first import of a module is reported
+            times[m.group(4)] = int(m.group(2))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='mf.main')
+    parser.add_argument('--budget-ms', type=float, default=100)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [_import_times(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda t: t[args.module])
+    total_ms = best[args.module] / 1000
+
+    print(f'slowest imports of {args.module} (cumulative ms):')
+    for name, us in sorted(best.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f'{us / 1000:>10.1f}  {name}')
+
+    print(f'\n{args.module}: {total_ms:.1f} ms, budget {args.budget_ms:.1f} ms')
+    if total_ms > args.budget_ms:
+        print('startup budget exceeded', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
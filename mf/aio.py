@@ -0,0 +1,396 @@
+# coding: utf-8
+"""
+Async engine: GCS storage served by coroutines of one event loop over a shared pool of connections.
+
+Transfers of `builds put` and `builds get` run as tasks of the loop (see `mf.transfer._run_all_async`),
+so hundreds of them are in flight without a thread each. The rest of the tool stays synchronous:
+every `StorageBase` method runs its coroutine on the loop and waits for it.
+"""
+
+import asyncio
+import datetime
+import mimetypes
+import os
+import threading
+import warnings
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from mf import serialization
+from mf.cache import ManifestCache
+from mf.log import LOGGER
+from mf.manifest import StorageBase, StoredObject, MANIFEST_NAME, COMPOSITE_MD5_KEY, TOUCHED_KEY, \
+    _multipart_body, _versioning_disabled_message
+from mf.transfer import DEFAULT_PARALLELISM
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:  # optional, pip install mfutil[async]
+    aiohttp = None
+
+GCS_ENDPOINT = 'https://storage.googleapis.com'
+
+_SCOPES = ['https://www.googleapis.com/auth/devstorage.read_write']
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class _ErrorResponse:
+    """
+    Failed response of `cas_blob`, the same fields as `requests.Response` of the sync storage.
+    """
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+
+
+class AsyncStorageGCS(StorageBase):
+    """
+    GCS storage by the JSON API over aiohttp. Coroutines `*_async` are run by transfers of the async engine,
+    sync methods run them on a private event loop thread, so it's a drop-in `StorageBase`.
+
+    Composite uploads of large files are made by the sync engine only, here every file is one stream.
+    """
+
+    is_async = True
+
+    def __init__(self, bucket, semantic_name, cache: Optional[ManifestCache] = None,
+                 pool_size: int = DEFAULT_PARALLELISM, endpoint: str = GCS_ENDPOINT):
+        """
+        :param pool_size: max number of open connections shared by all transfers
+        :param endpoint: GCS endpoint, for tests
+        """
+        if aiohttp is None:
+            raise RuntimeError('async engine needs aiohttp, pip install mfutil[async]')
+
+        self._bucket_name = bucket
+        self._semantic_name = semantic_name
+        self._cache = cache
+        self._pool_size = pool_size
+        self._endpoint = endpoint.rstrip('/')
+        self._credentials = None
+        self._bucket_checked = False
+
+        # created on the loop
+        self._session: Optional['aiohttp.ClientSession'] = None
+        self._auth_lock: Optional[asyncio.Lock] = None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    def run(self, coro):
+        """
+        Run a coroutine on the event loop of the storage and wait for its result.
+        The loop is started on first use, it must not be called from the loop itself.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='mf-aio', daemon=True)
+                self._thread.start()
+
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        with self._loop_lock:
+            if self._loop is None:
+                return
+            loop, self._loop = self._loop, None
+
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+
+    def fetch_manifest(self, name: str = MANIFEST_NAME, create: bool = True) -> Tuple[str, int, Optional[dict]]:
+        return self.run(self.fetch_manifest_async(name, create))
+
+    def cas_blob(self, data: bytes, generation: int, bucket_name: str, blob_name: str,
+                 content_encoding: Optional[str] = None) -> Tuple[bool, Optional[_ErrorResponse]]:
+        return self.run(self.cas_blob_async(data, generation, bucket_name, blob_name, content_encoding))
+
+    def upload(self, bucket, key, file, md5: Optional[str] = None, crc32c: Optional[str] = None):
+        self.run(self.upload_async(bucket, key, file, md5, crc32c))
+
+    def download(self, bucket, key, file, start=0):
+        self.run(self.download_async(bucket, key, file, start))
+
+    def fetch_md5s(self, bucket, keys: Iterable[str]) -> Dict[str, str]:
+        return self.run(self.fetch_md5s_async(bucket, keys))
+
+    def touch_objects(self, bucket, keys: List[str]) -> List[str]:
+        return self.run(self.touch_objects_async(bucket, keys))
+
+    def list_objects(self, bucket, prefix: str) -> Iterator[StoredObject]:
+        """
+        Objects under the prefix, one page is requested on the loop at a time while iterating.
+        """
+        page_token = None
+        while True:
+            objects, page_token = self.run(self.list_objects_page_async(bucket, prefix, page_token))
+            yield from objects
+            if not page_token:
+                return
+
+    def delete_objects(self, bucket, keys: List[str]):
+        self.run(self.delete_objects_async(bucket, keys))
+
+    def _object_url(self, bucket: str, key: str = None, upload: bool = False, list_: bool = False) -> 'yarl.URL':
+        url = f"{self._endpoint}{'/upload' if upload else ''}/storage/v1/b/{quote(bucket, safe='')}"
+        if key is not None:
+            url += f"/o/{quote(key, safe='')}"
+        elif upload or list_:
+            url += '/o'
+        # keys are quoted already, '/' of a key must stay %2F
+        return yarl.URL(url, encoded=True)
+
+    async def _request(self, method: str, url: 'yarl.URL', headers: Optional[dict] = None, **kwargs):
+        """
+        Authorized request by the shared session, use as `async with`.
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self._pool_size),
+                                                  auto_decompress=False)
+            self._auth_lock = asyncio.Lock()
+
+        async with self._auth_lock:
+            if self._credentials is None or not self._credentials.valid:
+                # token requests are rare and blocking, they don't hold the loop
+                await asyncio.get_event_loop().run_in_executor(None, self._refresh_credentials)
+
+        headers = dict(headers or {}, Authorization=f'Bearer {self._credentials.token}')
+        return self._session.request(method, url, headers=headers, **kwargs)
+
+    def _refresh_credentials(self):
+        import google.auth
+        import google.auth.transport.requests
+
+        if self._credentials is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self._credentials, _ = google.auth.default(scopes=_SCOPES)
+        self._credentials.refresh(google.auth.transport.requests.Request())
+
+    async def _check_bucket(self):
+        """
+        Validate the bucket before the first write, as the sync storage does.
+        """
+        if self._bucket_checked:
+            return
+
+        async with await self._request('GET', self._object_url(self._bucket_name),
+                                       params={'fields': 'name,versioning'}) as resp:
+            if resp.status == 404:
+                LOGGER.error("bucket %s not exists", self._bucket_name)
+                raise RuntimeError('not_found')
+            await _raise_for_status(resp)
+            bucket = await resp.json(content_type=None)
+
+        if not bucket.get('versioning', {}).get('enabled'):
+            raise RuntimeError(_versioning_disabled_message(self._bucket_name))
+        self._bucket_checked = True
+
+    async def _object_meta(self, bucket: str, key: str, fields: str) -> Optional[dict]:
+        async with await self._request('GET', self._object_url(bucket, key), params={'fields': fields}) as resp:
+            if resp.status == 404:
+                return None
+            await _raise_for_status(resp)
+            return await resp.json(content_type=None)
+
+    async def fetch_manifest_async(self, name: str = MANIFEST_NAME, create: bool = True) \
+            -> Tuple[str, int, Optional[dict]]:
+        key = f'{self._semantic_name}/{name}'
+        meta = await self._object_meta(self._bucket_name, key, 'generation')
+
+        if meta is None and not create:
+            # generation 0 makes the first cas_blob create the object
+            return key, 0, None
+
+        if meta is None:
+            LOGGER.warning(f'{name} not exists by  gs://{self._bucket_name}/{key}, create empty')
+            ok, err = await self.cas_blob_async(serialization.dumps({"@spec": 1, "@ns": {}}), 0,
+                                                self._bucket_name, key)
+            if not ok and err is not None:
+                LOGGER.error("Could not create manifest %s", err.text)
+                raise Exception("creating %s failed" % key)
+            meta = await self._object_meta(self._bucket_name, key, 'generation')
+
+        generation = int(meta['generation'])
+        json_ = self._cache.get(self._bucket_name, key, generation) if self._cache is not None else None
+
+        if json_ is None:
+            # the body of the same generation, stored bytes as is
+            async with await self._request('GET', self._object_url(self._bucket_name, key),
+                                           params={'alt': 'media', 'generation': str(generation)},
+                                           headers={'Accept-Encoding': 'gzip'}) as resp:
+                await _raise_for_status(resp)
+                data = await resp.read()
+            json_ = serialization.loads(serialization.gunzip_if_compressed(data))
+            if self._cache is not None:
+                self._cache.put(self._bucket_name, key, generation, json_)
+
+        LOGGER.debug('Fetching manifest -- gs://%s/%s#%d', self._bucket_name, key, generation)
+        return key, generation, json_
+
+    async def cas_blob_async(self, data: bytes, generation: int, bucket_name: str, blob_name: str,
+                             content_encoding: Optional[str] = None) -> Tuple[bool, Optional[_ErrorResponse]]:
+        """
+        Compare-and-set by `x-goog-if-generation-match`, see `StorageGCS.cas_blob`.
+        """
+        await self._check_bucket()
+
+        headers = {'x-goog-if-generation-match': str(generation)}
+        if content_encoding is None:
+            params = {'uploadType': 'media', 'name': blob_name}
+            body = data
+        else:
+            params = {'uploadType': 'multipart'}
+            body, headers['Content-Type'] = _multipart_body({
+                'name': blob_name,
+                'contentType': 'application/json',
+                'contentEncoding': content_encoding
+            }, data)
+
+        async with await self._request('POST', self._object_url(bucket_name, upload=True), params=params,
+                                       data=body, headers=headers) as resp:
+            if resp.status == 200:
+                return True, None
+            elif resp.status == 412:
+                return False, None
+            else:
+                return False, _ErrorResponse(resp.status, await resp.text())
+
+    async def upload_async(self, bucket, key, file, md5: Optional[str] = None, crc32c: Optional[str] = None):
+        """
+        Upload by one streamed request, file reads run in the default executor.
+        :raises IOError: if md5 of the uploaded object doesn't match
+        """
+        await self._check_bucket()
+
+        if not hasattr(file, 'read'):
+            with open(str(file), 'rb') as f:
+                return await self.upload_async(bucket, key, f, md5, crc32c)
+
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        content_type, _ = mimetypes.guess_type(str(getattr(file, 'name', '')))
+        loop = asyncio.get_event_loop()
+
+        async def _chunks():
+            chunk = await loop.run_in_executor(None, file.read, _CHUNK_SIZE)
+            while chunk:
+                yield chunk
+                chunk = await loop.run_in_executor(None, file.read, _CHUNK_SIZE)
+
+        headers = {'Content-Type': content_type or 'application/octet-stream', 'Content-Length': str(size)}
+        async with await self._request('POST', self._object_url(bucket, upload=True),
+                                       params={'uploadType': 'media', 'name': key},
+                                       data=_chunks(), headers=headers) as resp:
+            await _raise_for_status(resp)
+            uploaded = await resp.json(content_type=None)
+
+        if md5 is not None and uploaded.get('md5Hash') != md5:
+            raise IOError(f"md5 of uploaded gs://{bucket}/{key} [{uploaded.get('md5Hash')}] doesn't match {md5}")
+
+    async def download_async(self, bucket, key, file, start=0):
+        """
+        Download object into file. With `start` > 0 the download is resumed by a range request.
+        File open and writes run in the default executor, so disk writes don't hold the loop.
+        """
+        loop = asyncio.get_event_loop()
+        headers = {'Range': f'bytes={start}-'} if start else {}
+        async with await self._request('GET', self._object_url(bucket, key), params={'alt': 'media'},
+                                       headers=headers) as resp:
+            if resp.status == 416:
+                # the file has been downloaded completely already
+                LOGGER.debug("nothing to resume for gs://%s/%s from %d", bucket, key, start)
+                return
+            await _raise_for_status(resp)
+
+            # a server ignoring the range sends the whole object
+            f = await loop.run_in_executor(None, open, str(file), 'ab' if start and resp.status == 206 else 'wb')
+            try:
+                async for chunk in resp.content.iter_chunked(_CHUNK_SIZE):
+                    await loop.run_in_executor(None, f.write, chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+
+    async def fetch_md5s_async(self, bucket, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Metadata of objects by concurrent requests, bounded by the pool of connections.
+        """
+        async def _md5(key):
+            meta = await self._object_meta(bucket, key, 'md5Hash,metadata')
+            if meta is None:
+                return key, None
+            return key, meta.get('md5Hash') or (meta.get('metadata') or {}).get(COMPOSITE_MD5_KEY)
+
+        results = await asyncio.gather(*[_md5(key) for key in keys])
+        return dict((key, md5) for key, md5 in results if md5)
+
+    async def touch_objects_async(self, bucket, keys: List[str]) -> List[str]:
+        """
+        Patch custom metadata of objects by concurrent requests, see `StorageGCS.touch_objects`.
+        """
+        touched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        async def _touch(key):
+            async with await self._request('PATCH', self._object_url(bucket, key), params={'fields': 'updated'},
+                                           json={'metadata': {TOUCHED_KEY: touched_at}}) as resp:
+                if resp.status == 404:
+                    return key
+                await _raise_for_status(resp)
+
+        return [key for key in await asyncio.gather(*[_touch(key) for key in keys]) if key is not None]
+
+    async def list_objects_page_async(self, bucket, prefix: str, page_token: Optional[str] = None) \
+            -> Tuple[List[StoredObject], Optional[str]]:
+        """
+        One page of up to 1000 objects under the prefix, only the fields of `StoredObject` are fetched.
+        :return: (objects, token of the next page or None)
+        """
+        params = {'prefix': prefix, 'fields': 'items(name,size,updated),nextPageToken'}
+        if page_token:
+            params['pageToken'] = page_token
+
+        async with await self._request('GET', self._object_url(bucket, list_=True), params=params) as resp:
+            await _raise_for_status(resp)
+            page = await resp.json(content_type=None)
+
+        objects = [StoredObject(item['name'], int(item.get('size') or 0), _parse_timestamp(item.get('updated')))
+                   for item in page.get('items', [])]
+        return objects, page.get('nextPageToken')
+
+    async def delete_objects_async(self, bucket, keys: List[str]):
+        """
+        Delete objects by concurrent requests, bounded by the pool of connections.
+        Objects deleted meanwhile are ignored, the first other failure is raised.
+        """
+        async def _delete(key):
+            async with await self._request('DELETE', self._object_url(bucket, key)) as resp:
+                if resp.status != 404:
+                    await _raise_for_status(resp)
+
+        await asyncio.gather(*[_delete(key) for key in keys])
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    """
+    RFC 3339 time of the JSON API, always UTC with milliseconds: 2020-01-10T05:01:01.123Z
+    """
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=datetime.timezone.utc)
+
+
+async def _raise_for_status(resp: 'aiohttp.ClientResponse'):
+    if resp.status >= 400:
+        text = await resp.text()
+        raise IOError(f'{resp.method} {resp.url} failed [{resp.status}] {text}')
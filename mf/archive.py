@@ -0,0 +1,339 @@
+# coding: utf-8
+
+import io
+import os
+import struct
+import tarfile
+import tempfile
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+#
+# Supported archive formats, see "archive" of an asset in the config file.
+#
+ARCHIVE_ZIP_STORED = 'zip-stored'
+ARCHIVE_ZIP_DEFLATE = 'zip-deflate'
+ARCHIVE_TAR_GZ = 'tar.gz'
+ARCHIVE_TAR_ZST = 'tar.zst'
+
+ARCHIVE_FORMATS = [ARCHIVE_ZIP_STORED, ARCHIVE_ZIP_DEFLATE, ARCHIVE_TAR_GZ, ARCHIVE_TAR_ZST]
+
+_EXTENSIONS = {
+    ARCHIVE_ZIP_STORED: '.zip',
+    ARCHIVE_ZIP_DEFLATE: '.zip',
+    ARCHIVE_TAR_GZ: '.tar.gz',
+    ARCHIVE_TAR_ZST: '.tar.zst',
+}
+
+_DEFAULT_LEVELS = {
+    ARCHIVE_ZIP_DEFLATE: 6,
+    ARCHIVE_TAR_GZ: 6,
+    ARCHIVE_TAR_ZST: 3,
+}
+
+# zlib accepts 0..9, zstandard up to 22
+_MAX_LEVELS = {
+    ARCHIVE_ZIP_DEFLATE: 9,
+    ARCHIVE_TAR_GZ: 9,
+    ARCHIVE_TAR_ZST: 22,
+}
+
+#
+# Inputs which are compressed already. Zip archives store them as is, recompression costs a lot and saves nothing.
+#
+STORED_SUFFIXES = {
+    '.jar', '.war', '.ear', '.zip', '.whl', '.egg',
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.snappy', '.7z',
+    '.parquet', '.orc',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4',
+}
+
+#
+# Number of threads compressing members of one archive.
+#
+DEFAULT_COMPRESS_WORKERS = os.cpu_count() or 1
+
+_CHUNK_SIZE = 1024 * 1024
+
+# compressed members are kept in memory up to this size, larger ones go to temp files
+_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# max bytes of prepared zip members kept in memory ahead of the writer, regardless of the number of workers
+_ZIP_WINDOW_MAX_BYTES = 4 * _SPOOL_MAX_SIZE
+
+# tar.gz stream is compressed by blocks of this size in parallel
+_GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+
+#
+# Fixed attributes of members, so unchanged inputs always give byte identical archives
+# (and the same digest and object name) regardless of filesystem timestamps and permissions.
+#
+_ZIP_DOS_DATE = (0 << 9) | (1 << 5) | 1  # 1980-01-01
+_ZIP_DOS_TIME = 0
+_ZIP_FILE_MODE = 0o100644
+_ZIP_CREATE_SYSTEM_UNIX = 3
+_TAR_FILE_MODE = 0o644
+
+# (name in archive, file)
+Member = Tuple[str, Path]
+
+
+def extension(archive: str) -> str:
+    return _EXTENSIONS[archive]
+
+
+def check_level(archive: str, level: Optional[int]):
+    """
+    :raises ValueError: if the compression level is out of the range of the format
+    """
+    if level is None or archive not in _MAX_LEVELS:
+        return
+    if not 0 <= level <= _MAX_LEVELS[archive]:
+        raise ValueError(f'compression level of {archive} must be within 0..{_MAX_LEVELS[archive]}, got {level}')
+
+
+def write_archive(archive: str, members: List[Member], out, level: Optional[int] = None,
+                  workers: int = DEFAULT_COMPRESS_WORKERS):
+    """
+    Write archive sequentially into `out`, it never seeks back.
+    Members are compressed in parallel and written in the given order.
+
+    :param archive: one of ARCHIVE_FORMATS
+    :param members: members in the order they are written
+    :param out: writable binary stream
+    :param level: compression level, default of the format if None
+    :param workers: number of threads compressing members
+    :raises ValueError: if the level is out of the range of the format
+    """
+    check_level(archive, level)
+    level = _DEFAULT_LEVELS.get(archive) if level is None else level
+    workers = max(1, workers)
+
+    if archive == ARCHIVE_ZIP_STORED:
+        _write_zip(members, out, level=None, workers=workers)
+    elif archive == ARCHIVE_ZIP_DEFLATE:
+        _write_zip(members, out, level=level, workers=workers)
+    elif archive == ARCHIVE_TAR_GZ:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            gz = _ParallelGzipWriter(out, level, pool, window=workers * 2)
+            _write_tar(members, gz)
+            gz.close()
+    elif archive == ARCHIVE_TAR_ZST:
+        try:
+            import zstandard
+        except ImportError:  # optional, pip install mfutil[zstd]
+            raise RuntimeError(f'{ARCHIVE_TAR_ZST} archives require zstandard package, pip install mfutil[zstd]')
+        cctx = zstandard.ZstdCompressor(level=level, threads=workers)
+        with cctx.stream_writer(out, closefd=False) as zst:
+            _write_tar(members, zst)
+    else:
+        raise ValueError(f'unknown archive format {archive}')
+
+
+def _ordered_map(pool: ThreadPoolExecutor, fn, items: Iterable[Tuple[tuple, int]], max_bytes: int):
+    """
+    Like `pool.map`, but keeps results of at most `max_bytes` in flight to bound memory.
+    Every item is (arguments, bytes its result holds), one item is submitted at least.
+    """
+    pending = deque()
+    in_flight = 0
+    for args, size in items:
+        while pending and in_flight + size > max_bytes:
+            result, done_size = pending.popleft()
+            in_flight -= done_size
+            yield result.result()
+        pending.append((pool.submit(fn, *args), size))
+        in_flight += size
+    while pending:
+        yield pending.popleft()[0].result()
+
+
+class _ZipMember:
+
+    def __init__(self, name: str, path: Path, deflated: bool, crc: int, size: int, compressed_size: int, data):
+        self.name = name
+        self.path = path
+        self.deflated = deflated
+        self.crc = crc
+        self.size = size
+        self.compressed_size = compressed_size
+        # (compressed) data, None if the file is copied as is
+        self.data = data
+
+
+def _is_stored(path: Path, level: Optional[int]) -> bool:
+    return level is None or path.suffix.lower() in STORED_SUFFIXES
+
+
+def _zip_member_bytes(path: Path, level: Optional[int]) -> int:
+    """
+    Max bytes of a prepared member kept in memory, large stored files are not read ahead.
+    """
+    size = path.stat().st_size
+    if _is_stored(path, level) and size > _SPOOL_MAX_SIZE:
+        return 0
+    return min(size, _SPOOL_MAX_SIZE)
+
+
+def _prepare_zip_member(name: str, path: Path, level: Optional[int]) -> _ZipMember:
+    crc, size = 0, 0
+
+    if _is_stored(path, level):
+        if path.stat().st_size <= _SPOOL_MAX_SIZE:
+            with open(path, 'rb') as f:
+                data = f.read()
+            return _ZipMember(name, path, False, zlib.crc32(data), len(data), len(data), io.BytesIO(data))
+
+        # large files are not kept in memory, CRC of the local header is computed by a pass of its own
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        return _ZipMember(name, path, False, crc, size, size, None)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data.write(compressor.compress(chunk))
+    data.write(compressor.flush())
+    compressed_size = data.tell()
+    data.seek(0)
+    return _ZipMember(name, path, True, crc, size, compressed_size, data)
+
+
+def _write_zip(members: List[Member], out, level: Optional[int], workers: int):
+    """
+    Minimal zip writer: sizes and CRC of every member are known before its local header is written,
+    so the archive is produced strictly sequentially, without data descriptors (streaming readers such as
+    Java `ZipInputStream` don't accept them for stored members).
+    """
+    offset = 0
+    central = []
+
+    def emit(data: bytes):
+        nonlocal offset
+        out.write(data)
+        offset += len(data)
+
+    items = (((n, p, level), _zip_member_bytes(p, level)) for n, p in members)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for m in _ordered_map(pool, _prepare_zip_member, items, max_bytes=_ZIP_WINDOW_MAX_BYTES):
+            header_offset = offset
+            name = m.name.encode('utf-8')
+            flags = 0 if _is_ascii(m.name) else 0x800
+            method = 8 if m.deflated else 0
+
+            zip64 = m.size >= 0xFFFFFFFF or m.compressed_size >= 0xFFFFFFFF
+            extra = struct.pack('<HHQQ', 0x0001, 16, m.size, m.compressed_size) if zip64 else b''
+            version = 45 if zip64 else 20
+
+            emit(struct.pack('<4s2B4HL2L2H', b'PK\003\004', version, 0, flags, method,
+                             _ZIP_DOS_TIME, _ZIP_DOS_DATE, m.crc,
+                             0xFFFFFFFF if zip64 else m.compressed_size,
+                             0xFFFFFFFF if zip64 else m.size,
+                             len(name), len(extra)) + name + extra)
+
+            with (m.data or open(m.path, 'rb')) as src:
+                written = 0
+                for chunk in iter(lambda: src.read(_CHUNK_SIZE), b''):
+                    emit(chunk)
+                    written += len(chunk)
+            if written != m.compressed_size:
+                raise RuntimeError(f'{m.path} has been changed while archiving')
+
+            central.append((m, name, flags, method, header_offset))
+
+    cd_offset = offset
+    for m, name, flags, method, header_offset in central:
+        zip64_fields = []
+        if m.size >= 0xFFFFFFFF or m.compressed_size >= 0xFFFFFFFF:
+            zip64_fields += [m.size, m.compressed_size]
+        if header_offset >= 0xFFFFFFFF:
+            zip64_fields.append(header_offset)
+        extra = struct.pack('<HH%dQ' % len(zip64_fields), 0x0001, 8 * len(zip64_fields), *zip64_fields) \
+            if zip64_fields else b''
+        version = 45 if zip64_fields else 20
+        sizes_in_extra = len(zip64_fields) >= 2
+
+        emit(struct.pack('<4s4B4HL2L5H2L', b'PK\001\002', version, _ZIP_CREATE_SYSTEM_UNIX, version, 0,
+                         flags, method, _ZIP_DOS_TIME, _ZIP_DOS_DATE, m.crc,
+                         0xFFFFFFFF if sizes_in_extra else m.compressed_size,
+                         0xFFFFFFFF if sizes_in_extra else m.size,
+                         len(name), len(extra), 0, 0, 0, _ZIP_FILE_MODE << 16,
+                         min(header_offset, 0xFFFFFFFF)) + name + extra)
+
+    cd_size = offset - cd_offset
+    count = len(central)
+
+    if count >= 0xFFFF or cd_size >= 0xFFFFFFFF or cd_offset >= 0xFFFFFFFF:
+        zip64_end_offset = offset
+        emit(struct.pack('<4sQ2H2L4Q', b'PK\006\006', 44, 45, 45, 0, 0, count, count, cd_size, cd_offset))
+        emit(struct.pack('<4sLQL', b'PK\006\007', 0, zip64_end_offset, 1))
+
+    emit(struct.pack('<4s4H2LH', b'PK\005\006', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                     min(cd_size, 0xFFFFFFFF), min(cd_offset, 0xFFFFFFFF), 0))
+
+
+def _is_ascii(s: str) -> bool:
+    try:
+        s.encode('ascii')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _write_tar(members: List[Member], out):
+    with tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+        for name, path in members:
+            info = tarfile.TarInfo(name)
+            info.size = path.stat().st_size
+            info.mode = _TAR_FILE_MODE
+            info.mtime = 0
+            with open(path, 'rb') as f:
+                tar.addfile(info, f)
+
+
+def _gzip_block(block: bytes, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+class _ParallelGzipWriter:
+    """
+    gzip stream compressed by independent blocks in parallel. Every block is a separate gzip member,
+    any gzip reader decompresses concatenated members as one stream (same as `pigz --independent`).
+    """
+
+    def __init__(self, out, level: int, pool: ThreadPoolExecutor, window: int):
+        self._out = out
+        self._level = level
+        self._pool = pool
+        self._window = window
+        self._buf = bytearray()
+        self._pending = deque()
+
+    def write(self, data) -> int:
+        self._buf += data
+        while len(self._buf) >= _GZIP_BLOCK_SIZE:
+            self._submit(bytes(self._buf[:_GZIP_BLOCK_SIZE]))
+            del self._buf[:_GZIP_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self._pending.append(self._pool.submit(_gzip_block, block, self._level))
+        while len(self._pending) > self._window:
+            self._out.write(self._pending.popleft().result())
+
+    def close(self):
+        if self._buf:
+            self._submit(bytes(self._buf))
+            self._buf = bytearray()
+        while self._pending:
+            self._out.write(self._pending.popleft().result())
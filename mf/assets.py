@@ -1,18 +1,45 @@
 # coding: utf-8
 
+import atexit
 import hashlib
 import base64
+import io
 import tempfile
+import threading
 import os
 
-from typing import Tuple
+from typing import Tuple, Optional, BinaryIO
 
-from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, Generator
 from pathlib import Path
 
+from mf.archive import ARCHIVE_ZIP_STORED, write_archive, extension
+from mf.discovery import discover
+
 _data_holder_attr = '_lazy_properties'
 
+#
+# Size of a read buffer for hashing, can be overridden by MF_HASH_CHUNK_SIZE env variable.
+# hashlib releases the GIL for large buffers, so bigger chunks let several threads hash at once.
+#
+HASH_CHUNK_SIZE = int(os.environ.get('MF_HASH_CHUNK_SIZE', 1024 * 1024))
+
+#
+# Number of threads hashing assets concurrently.
+#
+DEFAULT_HASH_WORKERS = os.cpu_count() or 1
+
+#
+# Archives up to this size are built in memory, larger ones spill to a temp file.
+# Can be overridden by MF_SPOOL_MAX_SIZE env variable.
+#
+SPOOL_MAX_SIZE = int(os.environ.get('MF_SPOOL_MAX_SIZE', 16 * 1024 * 1024))
+
+# temp files of the process, removed by `cleanup_temp_files`
+_temp_files = set()
+_temp_files_lock = threading.Lock()
+
 
 # noinspection PyPep8Naming
 class lazy_property(object):
@@ -58,6 +85,27 @@ class AssetBase:
     def filename(self) -> str:
         raise NotImplemented('filename')
 
+    @property
+    def md5_hex(self) -> str:
+        return self._md5_[1]
+
+    @property
+    def crc32c(self) -> Optional[str]:
+        """
+        Base64 encoded CRC32C, same as GCS metadata "Hash (crc32c)". None if it was not computed.
+        """
+        return None
+
+    @property
+    def size(self) -> int:
+        return self.path.stat().st_size
+
+    def open(self) -> BinaryIO:
+        """
+        Open content of the asset for reading.
+        """
+        return open(self.path, 'rb')
+
     @lazy_property
     def _md5_(self) -> Tuple[str, str]:
         return _calc_md5_(self.path)
@@ -65,9 +113,16 @@ class AssetBase:
 
 class RawAsset(AssetBase):
 
-    def __init__(self, file: Path, **kwargs):
+    def __init__(self, file: Path, hash_cache=None, **kwargs):
         super().__init__(**kwargs)
         self._file: Path = file
+        self._hash_cache = hash_cache
+
+    @lazy_property
+    def _md5_(self) -> Tuple[str, str]:
+        if self._hash_cache is None:
+            return _calc_md5_(self.path)
+        return self._hash_cache.digests(self.path, _calc_md5_)
 
     @property
     def md5(self):
@@ -84,68 +139,280 @@ class RawAsset(AssetBase):
 
 class ZipAsset(AssetBase):
 
-    def __init__(self, files: Iterable[Path], **kwargs):
+    def __init__(self, files: Iterable[Path], archive: str = ARCHIVE_ZIP_STORED, level: Optional[int] = None,
+                 **kwargs):
         super().__init__(**kwargs)
-        self._files = list(files)
-        sorted(self._files, key=lambda p: p.name)
+        self._archive = archive
+        self._level = level
+
+        files = set(Path(f).absolute() for f in files if Path(f).is_file())
+
+        # keep the structure of file the same as glob discovered
+        common_root_dir = Path(os.path.commonpath([str(f.parent) for f in files])) if files else None
+
+        # (name in archive, file) in deterministic order
+        self._members = sorted((f.relative_to(common_root_dir).as_posix(), f) for f in files)
+
+    @lazy_property
+    def __tarball__(self) -> '_Spool':
+        spool = _Spool(SPOOL_MAX_SIZE)
+        out = _DigestWriter(spool)
+        write_archive(self._archive, self._members, out, level=self._level)
+        spool.close()
+
+        # digests are computed from the bytes as they are written, the archive is never read back
+        self._written_digests = out.digests()
+        return spool
 
     @lazy_property
-    def __tarball__(self) -> Path:
-        with tempfile.NamedTemporaryFile(delete=False, prefix='tarball') as nf:
-            with ZipFile(nf, 'w') as zf:
-                # keep the structure of file the same as glob discovered
-                common_root_dir = Path(os.path.commonpath([str(x.absolute()) for x in self._files]))
-                for f in self._files:
-                    # noinspection PyTypeChecker
-                    relative = os.path.relpath(f, start=common_root_dir)
-                    zf.write(f, relative)
-            return Path(nf.name)
+    def _md5_(self) -> Tuple[str, str]:
+        self.__tarball__
+        return self._written_digests[:2]
 
     @lazy_property
     def md5(self) -> str:
         return self._md5_[0]
 
+    @property
+    def crc32c(self) -> Optional[str]:
+        self.__tarball__
+        return self._written_digests[2]
+
     @property
     def path(self) -> Path:
-        return self.__tarball__
+        return self.__tarball__.path
+
+    @property
+    def size(self) -> int:
+        return self.__tarball__.size
+
+    def open(self) -> BinaryIO:
+        return self.__tarball__.open()
 
     @property
     def filename(self) -> str:
-        return f'{self._md5_[1]}.zip'
+        return f'{self._md5_[1]}{extension(self._archive)}'
 
 
 class ComponentBase:
 
-    def __init__(self, name, _json, root_dir=Path().absolute()):
+    def __init__(self, name, _json, root_dir=Path().absolute(), hash_cache=None, discovered=None):
+        """
+        :param discovered: files found for every asset entry, see `mf.discovery.discover`.
+                           If None, the component walks the file system by itself.
+        """
         self.name = name
         self.type: str = str(_json['type'])
         self._assets: Iterable[dict] = _json['assets']
 
         self._dir: Path = root_dir
+        self._hash_cache = hash_cache
+        self._discovered = discovered
+
+    @property
+    def patterns(self):
+        """
+        (glob, exclude globs) of every asset entry.
+        """
+        return [(asset['glob'], asset.get('exclude', [])) for asset in self._assets]
 
     @property
     def assets(self):
-        for asset in self._assets:
-            glob_ptn = asset['glob']
-            is_zip = asset.get('zip', False)
+        discovered = self._discovered
+        if discovered is None:
+            discovered = discover(self._dir, self.patterns)
+
+        for asset, files in zip(self._assets, discovered):
+            # "zip": true is a shortcut for "archive": "zip-stored"
+            archive = asset.get('archive') or (ARCHIVE_ZIP_STORED if asset.get('zip', False) else None)
 
-            if is_zip:
-                yield ZipAsset(files=[Path(p) for p in self._dir.glob(glob_ptn)])
+            if archive:
+                yield ZipAsset(files=files, archive=archive, level=asset.get('level'))
             else:
-                for file in self._dir.glob(glob_ptn):
-                    yield RawAsset(file=Path(file))
+                for file in files:
+                    yield RawAsset(file=file, hash_cache=self._hash_cache)
 
 
-def _calc_md5_(path, chunk_size=8192) -> Tuple[str, str]:
+class _Spool:
+    """
+    Write-once buffer kept in memory up to `max_size` bytes, spilled to a temp file past it.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._buf = io.BytesIO()
+        self._data: Optional[bytes] = None
+        self._file = None
+        self._path: Optional[Path] = None
+        self.size = 0
+
+    def write(self, data) -> int:
+        if self._path is None and self.size + len(data) > self._max_size:
+            self._spill()
+
+        target = self._file if self._file is not None else self._buf
+        target.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._path is None:
+            self._data = self._buf.getvalue()
+        self._buf = None
+
+    def _spill(self):
+        self._file = tempfile.NamedTemporaryFile(delete=False, prefix='tarball')
+        self._path = Path(self._file.name)
+        register_temp_file(self._path)
+
+        if self._buf is not None:
+            self._file.write(self._buf.getbuffer())
+            self._buf = None
+        elif self._data is not None:
+            self._file.write(self._data)
+            self._file.close()
+            self._file = None
+            self._data = None
+
+    @property
+    def path(self) -> Path:
+        """
+        Path of the content on disk, in-memory content is spilled to a temp file first.
+        """
+        if self._path is None:
+            self._spill()
+        return self._path
+
+    def open(self) -> BinaryIO:
+        if self._data is not None:
+            # shares the bytes, no copy
+            return io.BytesIO(self._data)
+        return open(self._path, 'rb')
+
+
+def register_temp_file(path: Path):
+    with _temp_files_lock:
+        _temp_files.add(path)
+
+
+def cleanup_temp_files():
+    """
+    Remove every temp file created by this process so far.
+    """
+    with _temp_files_lock:
+        paths = list(_temp_files)
+        _temp_files.clear()
+
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+atexit.register(cleanup_temp_files)
+
+
+def _new_crc32c():
+    """
+    CRC32C checksum, None if google-crc32c is not installed. Imported on first use to keep CLI startup fast.
+    """
+    try:
+        import google_crc32c
+    except ImportError:  # optional, pip install mfutil[crc32c]
+        return None
+    return google_crc32c.Checksum()
+
+
+class _DigestWriter:
+    """
+    Write-only stream which hashes every byte on its way to the underlying file.
+    Archives are written strictly sequentially, so the digests match the file content.
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._md5 = hashlib.md5()
+        self._crc32c = _new_crc32c()
+        self._written = 0
+
+    def write(self, data) -> int:
+        self._fp.write(data)
+        self._md5.update(data)
+        if self._crc32c is not None:
+            self._crc32c.update(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._written
+
+    def flush(self):
+        self._fp.flush()
+
+    def digests(self) -> Tuple[str, str, Optional[str]]:
+        """
+        :return: (base64 md5, hex md5, base64 crc32c or None if google-crc32c is not installed)
+        """
+        crc32c = base64.b64encode(self._crc32c.digest()).decode('utf-8') if self._crc32c is not None else None
+        return base64.b64encode(self._md5.digest()).decode('utf-8'), self._md5.hexdigest(), crc32c
+
+
+def compute_digests(assets: Iterable[AssetBase], workers: int = DEFAULT_HASH_WORKERS):
+    """
+    Compute digests of assets concurrently.
+    Results are kept by assets themselves, so following `md5` calls are free.
+
+    :param assets: assets to hash
+    :param workers: number of threads
+    """
+    if workers <= 1:
+        for asset in assets:
+            asset.md5
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(lambda asset: asset.md5, assets):
+            pass
+
+
+def _calc_md5_(path, chunk_size=None) -> Tuple[str, str]:
     """
      Base64 encoded MD5 hash of a file.
      Same as GCS metadata label "Hash (md5)"
     """
-    with open(path, "rb") as f:
+    with open(path, "rb", buffering=0) as f:
+        # small files don't need a full size buffer
+        buf = memoryview(bytearray(min(chunk_size or HASH_CHUNK_SIZE, os.fstat(f.fileno()).st_size + 1)))
+
         file_hash = hashlib.md5()
-        chunk = f.read(chunk_size)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(chunk_size)
+        n = f.readinto(buf)
+        while n:
+            file_hash.update(buf[:n])
+            n = f.readinto(buf)
 
         return base64.b64encode(file_hash.digest()).decode('utf-8'), file_hash.hexdigest()
+
+
+def _calc_crc32c_(path, chunk_size=None) -> Optional[str]:
+    """
+    Base64 encoded CRC32C of a file, same as GCS metadata "Hash (crc32c)".
+    None if google-crc32c is not installed.
+    """
+    checksum = _new_crc32c()
+    if checksum is None:
+        return None
+
+    with open(path, "rb") as f:
+        chunk = f.read(chunk_size or HASH_CHUNK_SIZE)
+        while chunk:
+            checksum.update(chunk)
+            chunk = f.read(chunk_size or HASH_CHUNK_SIZE)
+
+    return base64.b64encode(checksum.digest()).decode('utf-8')
@@ -0,0 +1,287 @@
+# coding: utf-8
+
+import base64
+import hashlib
+import marshal
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from mf.log import LOGGER
+
+#
+# Default directory (relative to project root) for local caches.
+#
+DEFAULT_CACHE_DIR = '.mf-cache'
+
+#
+# Entries not used for this period are evicted.
+#
+HASH_CACHE_MAX_AGE_SEC = 30 * 24 * 3600
+
+#
+# Files modified that recently are not cached: a write within the same mtime tick
+# would not be noticed on the next run.
+#
+_RACY_MTIME_SEC = 2
+
+
+class HashCache:
+    """
+    Persistent cache of file digests, keyed by (path, size, mtime_ns, inode).
+
+    Stored as a small SQLite database, so several processes may share one workspace.
+    An entry is replaced as soon as the file changes, entries which were not used
+    for `max_age` seconds are evicted on `close`.
+    """
+
+    def __init__(self, cache_dir: Path, max_age: int = HASH_CACHE_MAX_AGE_SEC):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # autocommit, every statement is a short transaction and never blocks other processes for long
+        self._db = sqlite3.connect(str(cache_dir / 'hashes.sqlite'), timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE IF NOT EXISTS digests ('
+                         ' path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER,'
+                         ' md5 TEXT, md5_hex TEXT, used_at INTEGER)')
+
+    def digests(self, path: Path, compute: Callable[[Path], Tuple[str, str]]) -> Tuple[str, str]:
+        """
+        Cached digests of a file, computes and remembers them on a miss.
+
+        :param path: file
+        :param compute: function to calculate digests of the file
+        :return: (base64 md5, hex md5)
+        """
+        path = Path(path).absolute()
+        st = path.stat()
+        key = (str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+        cached = self._get(key)
+        if cached is not None:
+            LOGGER.debug("hash cache hit %s", path)
+            return cached
+
+        value = compute(path)
+
+        if time.time() - st.st_mtime_ns / 1e9 > _RACY_MTIME_SEC:
+            self._put(key, value)
+        return value
+
+    def _get(self, key) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            row = self._db.execute('SELECT md5, md5_hex FROM digests '
+                                   'WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?', key).fetchone()
+            if row is not None:
+                self._db.execute('UPDATE digests SET used_at = ? WHERE path = ?', (int(time.time()), key[0]))
+        return None if row is None else (row[0], row[1])
+
+    def _put(self, key, value: Tuple[str, str]):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             key + value + (int(time.time()),))
+
+    def close(self):
+        """
+        Evict stale entries.
+        """
+        with self._lock:
+            evicted = self._db.execute('DELETE FROM digests WHERE used_at < ?',
+                                       (int(time.time()) - self._max_age,)).rowcount
+            self._db.close()
+        LOGGER.debug("hash cache closed, %d stale entries evicted", evicted)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#
+# Default directory of the manifest cache, shared by all projects of a user.
+#
+DEFAULT_MANIFEST_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'mfutil'
+
+
+class ManifestCache:
+    """
+    Parsed manifests by (bucket, key) together with their generation.
+
+    A cached manifest is used only while the generation of the remote object is the same, so a repeated
+    read of an unchanged manifest costs one metadata request instead of a download and `json.loads`.
+    Files are written by `marshal` (JSON types only, no code is loaded) and replaced atomically,
+    they are remembered in memory as well for repeated reads within one process.
+    """
+
+    def __init__(self, cache_dir: Path = DEFAULT_MANIFEST_CACHE_DIR):
+        self._dir = cache_dir
+        self._memo: Dict[Tuple[str, str], Tuple[int, Any]] = dict()
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self._dir / (hashlib.sha1(f'{bucket}/{key}'.encode('utf-8')).hexdigest() + '.manifest')
+
+    def get(self, bucket: str, key: str, generation: int) -> Optional[Any]:
+        """
+        :return: parsed manifest, None if it's not cached or the cached one has another generation
+        """
+        memo = self._memo.get((bucket, key))
+        if memo is not None and memo[0] == generation:
+            return memo[1]
+
+        try:
+            with open(str(self._path(bucket, key)), 'rb') as f:
+                version, cached_generation, content = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError) as e:
+            # truncated file or written by another python version
+            LOGGER.debug("manifest cache entry of %s/%s is broken: %s", bucket, key, e)
+            return None
+
+        if version != marshal.version or cached_generation != generation:
+            return None
+
+        LOGGER.debug("manifest cache hit %s/%s#%d", bucket, key, generation)
+        self._memo[(bucket, key)] = (generation, content)
+        return content
+
+    def put(self, bucket: str, key: str, generation: int, content: Any):
+        self._memo[(bucket, key)] = (generation, content)
+
+        path = self._path(bucket, key)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp), 'wb') as f:
+                marshal.dump((marshal.version, generation, content), f)
+            os.replace(str(tmp), str(path))
+        except OSError as e:
+            # the cache is an optimization only, a read-only home directory must not break commands
+            LOGGER.debug("manifest cache is not written: %s", e)
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+
+#
+# Default max size of the shared artifact cache, can be overridden by --cache-size / MF_CACHE_SIZE.
+#
+ARTIFACT_CACHE_MAX_SIZE = 10 * 1024 ** 3
+
+_USED_SUFFIX = '.used'
+
+
+class ArtifactCache:
+    """
+    Shared local cache of downloaded binaries, indexed by md5 from the manifest.
+
+    Files are stored as `{cache_dir}/{md5 hex}` and hard linked into destinations (copied when
+    a hard link is not possible). Use of a file is recorded by mtime of an empty `{md5 hex}.used`
+    sidecar, the inode is shared with destinations and is never touched. Least recently used files
+    are evicted by `evict` when the total size exceeds `max_size` bytes.
+    Several processes may share one cache directory.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = ARTIFACT_CACHE_MAX_SIZE):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._dir = cache_dir
+        self._max_size = max_size
+        self._lock = threading.Lock()
+
+    def _path(self, md5: str) -> Path:
+        return self._dir / base64.b64decode(md5).hex()
+
+    def _used_path(self, md5: str) -> Path:
+        return self._dir / f'{base64.b64decode(md5).hex()}{_USED_SUFFIX}'
+
+    def fetch(self, md5: str, target: Path) -> bool:
+        """
+        Put the cached file with the md5 into target.
+
+        :return: False if there is no such file in the cache
+        """
+        cached = self._path(md5)
+        try:
+            _link_or_copy(cached, target)
+        except FileNotFoundError:
+            return False
+        self._used_path(md5).touch()
+
+        LOGGER.debug("artifact cache hit %s", md5)
+        return True
+
+    def store(self, md5: str, file: Path):
+        """
+        Add a file (already verified to have the md5) into the cache.
+        The cache may exceed its max size until the next `evict`.
+        """
+        cached = self._path(md5)
+        if not cached.exists():
+            _link_or_copy(file, cached)
+        self._used_path(md5).touch()
+
+    def discard(self, md5: str):
+        for path in [self._path(md5), self._used_path(md5)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache fits into max size.
+        It scans the whole cache directory, so it's called once per `builds get`, not per file.
+        """
+        with self._lock:
+            files = dict()
+            used = dict()
+            for entry in os.scandir(str(self._dir)):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(_USED_SUFFIX):
+                    used[entry.name[:-len(_USED_SUFFIX)]] = st.st_mtime
+                else:
+                    files[entry.name] = st
+
+            entries = sorted((used.get(name, st.st_mtime), st.st_size, name) for name, st in files.items())
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in entries:
+                if total <= self._max_size:
+                    break
+                for path in [self._dir / name, self._dir / f'{name}{_USED_SUFFIX}']:
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                LOGGER.debug("artifact cache evicted %s", name)
+                total -= size
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """
+    Atomically replace dst by a hard link to src (or by a copy if a link is not possible).
+    dst stays untouched if src doesn't exist.
+    """
+    tmp = dst.with_name(f'{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        os.link(str(src), str(tmp))
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # other file system or hard links are not supported
+        shutil.copyfile(str(src), str(tmp))
+    os.replace(str(tmp), str(dst))
@@ -4,19 +4,41 @@ import datetime
 import json
 
 from mf.log import LOGGER
-from mf.assets import ComponentBase
+from mf.archive import ARCHIVE_FORMATS, check_level
+from mf.assets import ComponentBase, lazy_property
+from mf.discovery import discover
 from pathlib import Path
 from typing import Union, Optional
 
 from slugify import slugify
 
-from jsonschema import validate
-
 #
 # Default configuration file name.
 #
 DEFAULT_CONFIG_FILE_NAME = ".mf.json"
 
+#
+# Layouts of uploaded blobs:
+#  - branch: {repository}/{branch}/{sha}/{component}/{filename}, every build stores its own copy
+#  - cas: {repository}/cas/{md5 hex}, content addressed, unchanged files are stored once for all branches
+#
+BLOB_LAYOUT_BRANCH = 'branch'
+BLOB_LAYOUT_CAS = 'cas'
+
+#
+# Layouts of the manifest:
+#  - single: {repository}/manifest.json keeps last builds of all branches
+#  - sharded: {repository}/manifests/{branch}.json per branch, {repository}/manifest.json lists branches only
+#
+MANIFEST_LAYOUT_SINGLE = 'single'
+MANIFEST_LAYOUT_SHARDED = 'sharded'
+
+#
+# Content encoding of written manifests, readers accept both.
+#
+MANIFEST_COMPRESSION_NONE = 'none'
+MANIFEST_COMPRESSION_GZIP = 'gzip'
+
 #
 # This is a jsonschema for config file
 # see: https://json-schema.org/understanding-json-schema/index.html
@@ -27,6 +49,15 @@ _SCHEMA = {
     "properties": {
         "bucket": {"type": "string"},
         "repository": {"type": "string"},
+        "blob_layout": {"type": "string", "enum": [BLOB_LAYOUT_BRANCH, BLOB_LAYOUT_CAS]},
+        "ignore_dirs": {"type": "array", "items": {"type": "string"}},
+        "manifest": {
+            "type": "object",
+            "properties": {
+                "layout": {"type": "string", "enum": [MANIFEST_LAYOUT_SINGLE, MANIFEST_LAYOUT_SHARDED]},
+                "compression": {"type": "string", "enum": [MANIFEST_COMPRESSION_NONE, MANIFEST_COMPRESSION_GZIP]},
+            }
+        },
         "components": {
             "type": "object",
             "propertyNames": {
@@ -45,7 +76,10 @@ _SCHEMA = {
                             "type": "object",
                             "properties": {
                                 "glob": {"type": "string"},
+                                "exclude": {"type": "array", "items": {"type": "string"}},
                                 "zip": {"type": "boolean"},
+                                "archive": {"type": "string", "enum": ARCHIVE_FORMATS},
+                                "level": {"type": "integer", "minimum": 0, "maximum": 22},
                             }
                         }
                     },
@@ -72,9 +106,28 @@ class Project:
         self._cfg = cfg
         self._root_dir = root_dir
 
+        # optional persistent cache of file digests, see mf.cache.HashCache
+        self.hash_cache = None
+
     @property
     def components(self):
-        return [ComponentBase(name, json, self._root_dir) for name, json in self._cfg['components'].items()]
+        return [ComponentBase(name, json, self._root_dir, hash_cache=self.hash_cache, discovered=discovered)
+                for (name, json), discovered in zip(self._cfg['components'].items(), self._discovered)]
+
+    @lazy_property
+    def _discovered(self):
+        """
+        Files of every asset of every component, found by a single walk over the project.
+        """
+        components = [ComponentBase(name, json, self._root_dir) for name, json in self._cfg['components'].items()]
+        found = discover(self._root_dir, [p for c in components for p in c.patterns],
+                         ignore_dirs=self._cfg.get('ignore_dirs', []))
+
+        result = []
+        for c in components:
+            result.append(found[:len(c.patterns)])
+            found = found[len(c.patterns):]
+        return result
 
     @property
     def bucket(self):
@@ -84,6 +137,18 @@ class Project:
     def repository(self):
         return self._cfg['repository']
 
+    @property
+    def blob_layout(self):
+        return self._cfg.get('blob_layout', BLOB_LAYOUT_BRANCH)
+
+    @property
+    def manifest_layout(self):
+        return self._cfg.get('manifest', {}).get('layout', MANIFEST_LAYOUT_SINGLE)
+
+    @property
+    def manifest_compression(self):
+        return self._cfg.get('manifest', {}).get('compression', MANIFEST_COMPRESSION_NONE)
+
     def __repr__(self):
         return 'Conf{\n%s\n}' % (',\n'.join(['\t{}={}'.format(a, b) for a, b in self._cfg.items()]))
 
@@ -91,8 +156,12 @@ class Project:
 def read_config(root: Path, mf_file: Optional[Union[Path, bytes, str, dict]] = None) -> Optional[Project]:
 
     def _load_json(data):
+        # jsonschema is slow to import, commands run without a config file don't need it
+        from jsonschema import validate
+
         json_ = json.load(data) if hasattr(data, 'read') else json.loads(data)
         validate(instance=json_, schema=_SCHEMA)
+        _check_levels(json_)
         assert len(json_) > 0, 'json is an empty object'
         return json_
 
@@ -114,6 +183,21 @@ def read_config(root: Path, mf_file: Optional[Union[Path, bytes, str, dict]] = N
         return file
 
 
+def _check_levels(cfg: dict):
+    """
+    The schema allows levels of every format, the range depends on the archive format of an asset.
+    """
+    from jsonschema.exceptions import ValidationError
+
+    for name, component in cfg.get('components', {}).items():
+        for asset in component['assets']:
+            try:
+                # zip-stored and raw assets ignore the level
+                check_level(asset.get('archive'), asset.get('level'))
+            except ValueError as e:
+                raise ValidationError(f"component {name}, asset {asset.get('glob')}: {e}")
+
+
 class BuildInfo(object):
 
     def __init__(self, git_sha: str, git_branch: str, build_id: str,
@@ -0,0 +1,154 @@
+# coding: utf-8
+
+import os
+import re
+
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+from mf.cache import DEFAULT_CACHE_DIR
+
+#
+# Directories which are never descended into while discovering assets,
+# extended by "ignore_dirs" of the config file.
+#
+DEFAULT_IGNORE_DIRS = frozenset(['.git', DEFAULT_CACHE_DIR])
+
+_WILDCARDS = re.compile(r'[*?\[]')
+
+
+def _translate_segment(segment: str) -> str:
+    """
+    Regex for one path segment of a glob, wildcards never match '/'.
+    """
+    i, n, res = 0, len(segment), ''
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '[':
+            j = i
+            if j < n and segment[j] in '!^':
+                j += 1
+            if j < n and segment[j] == ']':
+                j += 1
+            while j < n and segment[j] != ']':
+                j += 1
+            if j >= n:
+                res += re.escape(c)
+            else:
+                chars = segment[i:j]
+                i = j + 1
+                negate = chars[0] in '!^'
+                if negate:
+                    chars = chars[1:]
+                # '[' and set operators are literal in a glob, but nested sets and operators of a regex
+                chars = re.sub(r'([\\\[&~|])', r'\\\1', chars)
+                res += f"[{'^' if negate else ''}{chars}]"
+        else:
+            res += re.escape(c)
+    return res
+
+
+def _translate(segments: Sequence[str]) -> str:
+    res = ''
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            # any number of directories, at the end -- any file below
+            res += '(?:[^/]+/)*[^/]+' if last else '(?:[^/]+/)*'
+        else:
+            res += _translate_segment(segment) + ('' if last else '/')
+    return res + r'\Z'
+
+
+def _segments(glob: str) -> List[str]:
+    return [s for s in glob.replace('\\', '/').split('/') if s not in ('', '.')]
+
+
+class _Pattern:
+    """
+    Compiled glob: literal directory prefix (the base) and a regex for the rest of a path.
+    """
+
+    def __init__(self, root_dir: Path, glob: str, exclude: Iterable[str]):
+        segments = _segments(glob)
+
+        literal = 0
+        while literal < len(segments) and not _WILDCARDS.search(segments[literal]):
+            literal += 1
+
+        if literal == len(segments):
+            # no wildcards at all, resolved directly without walking
+            self.literal: Optional[Path] = root_dir.joinpath(*segments)
+            self.base = self.literal.parent
+        else:
+            self.literal = None
+            self.base = root_dir.joinpath(*segments[:literal])
+            self.regex = re.compile(_translate(segments[literal:]))
+
+        self.base_key = os.path.normpath(os.path.abspath(str(self.base)))
+        self._prefix = self.base_key.rstrip(os.sep) + os.sep
+        self._root_key = os.path.normpath(os.path.abspath(str(root_dir)))
+        self._exclude = [re.compile(_translate(_segments(e))) for e in exclude]
+
+    def relative(self, full: str) -> Optional[str]:
+        """
+        Path relative to the base in posix form, None if the file is not under the base.
+        """
+        if not full.startswith(self._prefix):
+            return None
+        return full[len(self._prefix):].replace(os.sep, '/')
+
+    def excluded(self, full: str) -> bool:
+        if not self._exclude:
+            return False
+        rel = os.path.relpath(full, self._root_key).replace(os.sep, '/')
+        return any(e.match(rel) for e in self._exclude)
+
+
+def discover(root_dir: Path, patterns: Sequence[Tuple[str, Iterable[str]]],
+             ignore_dirs: Iterable[str] = ()) -> List[List[Path]]:
+    """
+    Find files of all patterns by one walk over the file system.
+
+    Patterns have `Path.glob` syntax relative to `root_dir`, but only files are matched.
+    Patterns without wildcards are checked directly, the rest share a single walk which starts
+    from their literal prefixes and never descends into ignored directories.
+
+    :param root_dir: directory patterns are relative to
+    :param patterns: (glob, exclude globs) pairs
+    :param ignore_dirs: names of directories to skip, in addition to DEFAULT_IGNORE_DIRS
+    :return: sorted files for every pattern, in the same order as patterns
+    """
+    compiled = [_Pattern(root_dir, glob, exclude) for glob, exclude in patterns]
+    results: List[Set[Path]] = [set() for _ in compiled]
+    ignore = DEFAULT_IGNORE_DIRS.union(ignore_dirs)
+
+    walking = []
+    for i, p in enumerate(compiled):
+        if p.literal is None:
+            walking.append(i)
+        elif p.literal.is_file() and not p.excluded(os.path.abspath(str(p.literal))):
+            results[i].add(p.literal)
+
+    # nested bases are covered by the walk of their ancestor
+    bases = set(compiled[i].base_key for i in walking)
+    tops = sorted(b for b in bases if not any(o != b and b.startswith(o.rstrip(os.sep) + os.sep) for o in bases))
+
+    for top in tops:
+        for dir_path, dir_names, file_names in os.walk(top):
+            dir_names[:] = sorted(d for d in dir_names if d not in ignore)
+
+            for name in file_names:
+                full = os.path.join(dir_path, name)
+                for i in walking:
+                    p = compiled[i]
+                    rel = p.relative(full)
+                    if rel is not None and p.regex.match(rel) and not p.excluded(full):
+                        results[i].add(p.base / rel)
+
+    return [sorted(r) for r in results]
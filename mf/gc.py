@@ -0,0 +1,113 @@
+# coding: utf-8
+
+import datetime
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from mf.log import LOGGER
+from mf.manifest import Manifest, MANIFEST_NAME, SHARDS_DIR, object_url
+from mf.transfer import DEFAULT_PARALLELISM, TransferError
+
+#
+# Objects younger than the grace period are never deleted: a running `builds put` uploads its assets,
+# or touches the reused ones, before it publishes them in the manifest. Can be overridden by --grace-hours option.
+#
+GC_GRACE_PERIOD = datetime.timedelta(days=7)
+
+#
+# Number of keys deleted by one task, GCS batch requests of up to 100 deletions each.
+#
+GC_DELETE_CHUNK = 1000
+
+
+class GcStats:
+    """
+    Counters of one garbage collection, reported at the end of `builds gc`.
+    """
+
+    def __init__(self):
+        self.listed = 0
+        self.referenced = 0
+        self.recent = 0
+        self.deleted = 0
+        self.deleted_bytes = 0
+
+    def __repr__(self):
+        return (f'listed={self.listed}, referenced={self.referenced}, recent={self.recent}, '
+                f'deleted={self.deleted} ({self.deleted_bytes} bytes)')
+
+
+def collect_garbage(manifest: Manifest, grace: datetime.timedelta = GC_GRACE_PERIOD, dry_run: bool = False,
+                    parallelism: int = DEFAULT_PARALLELISM, now: Optional[datetime.datetime] = None) -> GcStats:
+    """
+    Delete objects of the repository which are referenced by no branch of the manifest.
+
+    The listing is streamed page by page and unreferenced objects are deleted by chunks while listing,
+    so only the referenced keys and the chunks in flight are kept in memory.
+    Manifests themselves and objects younger than `grace` are kept.
+
+    :param manifest: fetched manifest of the repository
+    :param grace: min age of deleted objects
+    :param dry_run: count objects and bytes to be deleted without deleting them
+    :param parallelism: max number of concurrent chunk deletions
+    :param now: current time, for tests
+    :raises TransferError: if any chunk failed, the rest is deleted anyway
+    """
+    storage = manifest.storage
+    bucket = manifest.bucket
+    prefix = f'{manifest.repo_name}/'
+    manifests = (f'{prefix}{MANIFEST_NAME}', f'{prefix}{SHARDS_DIR}/')
+    threshold = (now or datetime.datetime.now(datetime.timezone.utc)) - grace
+
+    referenced = manifest.references()
+    LOGGER.info("%d objects referenced by %d branches", len(referenced), len(manifest.branches))
+
+    stats = GcStats()
+    errors = []
+    # at most `parallelism` chunks are pending besides the running ones
+    slots = threading.BoundedSemaphore(max(1, parallelism) * 2)
+
+    def _delete(chunk: List[str]):
+        try:
+            storage.delete_objects(bucket, chunk)
+        except Exception as e:
+            LOGGER.error("Deleting failed [%s...] %s", chunk[0], e)
+            errors.append((chunk[0], e))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as pool:
+        chunk = []
+        for obj in storage.list_objects(bucket, prefix):
+            stats.listed += 1
+            if obj.key in referenced or obj.key.startswith(manifests):
+                stats.referenced += 1
+                continue
+            if obj.updated is not None and obj.updated > threshold:
+                stats.recent += 1
+                continue
+
+            LOGGER.debug("%s %s (%d bytes)", 'Unreferenced' if dry_run else 'Deleting',
+                         object_url(bucket, obj.key), obj.size)
+            stats.deleted += 1
+            stats.deleted_bytes += obj.size
+            if dry_run:
+                continue
+
+            chunk.append(obj.key)
+            if len(chunk) >= GC_DELETE_CHUNK:
+                slots.acquire()
+                pool.submit(_delete, chunk)
+                chunk = []
+
+        if chunk:
+            slots.acquire()
+            pool.submit(_delete, chunk)
+
+    if errors:
+        raise TransferError(errors)
+
+    LOGGER.info("Garbage collection done: %s", stats)
+    return stats
@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import bisect
+import fnmatch
+import re
+
+from typing import Dict, List, Optional
+
+from slugify import slugify
+
+_WILDCARDS = re.compile(r'([*?]|\[[^\]]*\])')
+
+
+def slugify_pattern(pattern: str) -> str:
+    """
+    Slugify literal parts of a branch pattern, keep wildcards as is.
+    """
+    parts = _WILDCARDS.split(pattern)
+    if len(parts) == 1:
+        return slugify(pattern)
+
+    res = ''
+    for i, part in enumerate(parts):
+        if i % 2 == 1 or not part:
+            res += part
+            continue
+        slug = slugify(part)
+        # slugify strips separators at the edges, they are meaningful next to a wildcard
+        lead = '-' if i > 0 and not part[0].isalnum() else ''
+        trail = '-' if i < len(parts) - 1 and not part[-1].isalnum() else ''
+        res += lead + slug + trail if slug else lead or trail
+    return res
+
+
+class _Matcher:
+    """
+    Lookup of names by exact value, prefix (`name*`) or any fnmatch wildcard.
+    """
+
+    def __init__(self, pattern: Optional[str]):
+        self.pattern = pattern
+        self.exact = pattern is not None and not _WILDCARDS.search(pattern)
+        self.prefix = None
+        if pattern is not None and pattern.endswith('*') and not _WILDCARDS.search(pattern[:-1]):
+            self.prefix = pattern[:-1]
+
+    def select(self, sorted_names: List[str]) -> List[str]:
+        if self.pattern is None or self.pattern == '*':
+            return sorted_names
+        if self.exact:
+            i = bisect.bisect_left(sorted_names, self.pattern)
+            return sorted_names[i:i + 1] if i < len(sorted_names) and sorted_names[i] == self.pattern else []
+        if self.prefix is not None:
+            i = bisect.bisect_left(sorted_names, self.prefix)
+            j = i
+            while j < len(sorted_names) and sorted_names[j].startswith(self.prefix):
+                j += 1
+            return sorted_names[i:j]
+        return [n for n in sorted_names if fnmatch.fnmatchcase(n, self.pattern)]
+
+
+def select(pattern: Optional[str], sorted_names: List[str]) -> List[str]:
+    """
+    Names matching the pattern (exact name, `prefix*` or fnmatch wildcards), all of them if pattern is None.
+    """
+    return _Matcher(pattern).select(sorted_names)
+
+
+def _row(branch, app, build: dict, bin: dict) -> dict:
+    row = {
+        'branch': str(branch),
+        'app': str(app),
+        'built_at': str(build['@built_at']),
+        'commit': str(build['@rev']),
+        'url': str(bin['@ref']),
+        'md5': str(bin.get('@md5', '')),
+    }
+    # the name of a content-addressed blob is its digest, the original one is kept in the manifest
+    if '@filename' in bin:
+        row['filename'] = str(bin['@filename'])
+    return row
+
+
+class ManifestIndex:
+    """
+    Flattened branch -> app -> binaries view of a manifest, built once per fetched manifest.
+    """
+
+    def __init__(self, content: dict):
+        self._apps: Dict[str, Dict[str, List[dict]]] = dict()
+
+        for branch, branch_value in content.get('@ns', {}).items():
+            build = branch_value.get('@last_success') if isinstance(branch_value, dict) else None
+            if not build:
+                continue
+
+            apps = dict()
+            for app, app_value in build.get('@include', {}).items():
+                apps[app] = [_row(branch, app, build, bin)
+                             for bin in app_value.get('@binaries', []) if '@ref' in bin]
+
+            self._apps[branch] = apps
+
+        self._branches = sorted(self._apps)
+        self._sorted_apps = dict((b, sorted(apps)) for b, apps in self._apps.items())
+
+    def lookup(self, branch: Optional[str] = None, app: Optional[str] = None, with_md5: bool = False) -> List[dict]:
+        """
+        Binaries sorted by branch and app name, binaries of an app keep the manifest order.
+
+        :param branch: branch name or pattern (`*`, `?`, `[...]`), all branches if None
+        :param app: app name or pattern, all apps if None
+        :param with_md5: include md5 of binaries (to verify downloads), it's not a listed field by default
+        :return: copies of the rows, callers are free to modify them
+        """
+        app_matcher = _Matcher(app)
+
+        acc = []
+        for b in _Matcher(branch).select(self._branches):
+            apps = self._apps[b]
+            for a in app_matcher.select(self._sorted_apps[b]):
+                for row in apps[a]:
+                    row = dict(row)
+                    if not with_md5:
+                        del row['md5']
+                    acc.append(row)
+        return acc
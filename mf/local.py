@@ -0,0 +1,294 @@
+# coding: utf-8
+
+import datetime
+import hashlib
+import base64
+import os
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse, unquote
+
+from mf import serialization
+from mf.assets import _calc_md5_
+from mf.log import LOGGER
+from mf.manifest import StorageBase, StoredObject, MANIFEST_NAME
+
+try:
+    import fcntl
+except ImportError:  # not POSIX, objects are locked within the process only
+    fcntl = None
+
+#
+# Metadata of objects (generation, md5) mirrors the tree of objects under this directory of the root.
+#
+META_DIR = '.mf-meta'
+
+# temp files are renamed into place, they are never listed
+_TMP_MARK = '.mf-tmp-'
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# lock of metadata of the bucket, under META_DIR
+_LOCK_NAME = '.lock'
+
+
+class StorageLocal(StorageBase):
+    """
+    Storage in a local directory, selected by `file:///path/to/root` bucket.
+
+    Every object is a file `{root}/{key}`, its generation and md5 are kept in `{root}/.mf-meta/{key}.json`.
+    Writes go to temp files renamed into place, so readers never see a partial object.
+    Data is written without a lock, only the check of the generation and the renames are made under
+    an exclusive lock of the bucket (`{root}/.mf-meta/.lock`). It makes `cas_blob` a real compare-and-set
+    between processes sharing the directory, while uploads of different objects still run in parallel.
+    """
+
+    def __init__(self, bucket, semantic_name):
+        self._bucket = bucket
+        self._semantic_name = semantic_name
+        self._locks: Dict[str, threading.Lock] = dict()
+        self._locks_lock = threading.Lock()
+
+    def _path(self, bucket, key) -> Path:
+        return bucket_root(bucket) / key
+
+    def _meta_path(self, bucket, key) -> Path:
+        return bucket_root(bucket) / META_DIR / f'{key}.json'
+
+    def _read_meta(self, bucket, key) -> dict:
+        try:
+            return serialization.loads(self._meta_path(bucket, key).read_bytes())
+        except FileNotFoundError:
+            if self._path(bucket, key).is_file():
+                # put into the directory by other means, it's the first generation
+                return {'generation': 1}
+            return {'generation': 0}
+
+    @contextmanager
+    def _locked(self, bucket, exclusive: bool):
+        """
+        Lock metadata of the bucket by flock of `{root}/.mf-meta/.lock` for other processes, and by a lock
+        of the bucket for threads of this process (flock of another descriptor of the same file doesn't
+        exclude them). One lock file per bucket, it's never removed.
+        """
+        with self._locks_lock:
+            thread_lock = self._locks.setdefault(bucket, threading.Lock())
+
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+
+            lock_path = bucket_root(bucket) / META_DIR / _LOCK_NAME
+            lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(lock_path), 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _check_root(self, bucket):
+        root = bucket_root(bucket)
+        if not root.is_dir():
+            LOGGER.error("bucket %s not exists", bucket)
+            raise RuntimeError('not_found')
+
+    def _write_temp(self, bucket, key, data: Iterable[bytes], expected_md5: Optional[str] = None) \
+            -> Tuple[Path, dict]:
+        """
+        Write the object into a temp file next to it, it's renamed into place by `_commit`.
+        :param expected_md5: the temp file is removed if written data doesn't match it
+        :return: (temp file, md5 and size of written data)
+        :raises IOError: on md5 mismatch
+        """
+        path = self._path(bucket, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}{_TMP_MARK}{uuid.uuid4().hex[:8]}')
+
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            with open(str(tmp), 'wb') as f:
+                for chunk in data:
+                    f.write(chunk)
+                    md5.update(chunk)
+                    size += len(chunk)
+
+            actual_md5 = base64.b64encode(md5.digest()).decode('utf-8')
+            if expected_md5 is not None and actual_md5 != expected_md5:
+                raise IOError(f"md5 of uploaded {path} [{actual_md5}] doesn't match {expected_md5}")
+        except BaseException:
+            _unlink(tmp)
+            raise
+        return tmp, {'md5': actual_md5, 'size': size}
+
+    def _commit(self, bucket, key, tmp: Path, meta: dict):
+        """
+        Rename the temp file of the object and a temp file of its metadata into place one right after
+        the other, so the object is never left with metadata of its previous content.
+        Must be called under the exclusive lock of the bucket.
+        """
+        meta_path = self._meta_path(bucket, key)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        meta_tmp = meta_path.with_name(f'{meta_path.name}{_TMP_MARK}{uuid.uuid4().hex[:8]}')
+        try:
+            meta_tmp.write_bytes(serialization.dumps(meta))
+            os.replace(str(tmp), str(self._path(bucket, key)))
+            os.replace(str(meta_tmp), str(meta_path))
+        finally:
+            _unlink(tmp)
+            _unlink(meta_tmp)
+
+    def fetch_manifest(self, name: str = MANIFEST_NAME, create: bool = True) -> Tuple[str, int, Optional[dict]]:
+        key = f'{self._semantic_name}/{name}'
+
+        with self._locked(self._bucket, exclusive=False):
+            generation = self._read_meta(self._bucket, key)['generation']
+            data = self._path(self._bucket, key).read_bytes() if generation else None
+
+        if data is None and not create:
+            return key, 0, None
+
+        if data is None:
+            LOGGER.warning(f'{name} not exists by {self._bucket}/{key}, create empty')
+            self.cas_blob(serialization.dumps({"@spec": 1, "@ns": {}}), generation=0,
+                          bucket_name=self._bucket, blob_name=key)
+            # created by this or a concurrent call
+            return self.fetch_manifest(name, create=False)
+
+        LOGGER.debug('Fetching manifest -- %s/%s#%d', self._bucket, key, generation)
+        return key, generation, serialization.loads(serialization.gunzip_if_compressed(data))
+
+    def cas_blob(self, data: bytes, generation: int, bucket_name: str, blob_name: str,
+                 content_encoding: Optional[str] = None) -> Tuple[bool, None]:
+        """
+        Replace the object if its generation is still `generation`, 0 if it must not exist.
+        New generations are microseconds since the epoch as in GCS, and always grow.
+
+        :return: (true, None) - if update success; (false, None) - on conflict
+        """
+        self._check_root(bucket_name)
+        tmp, written = self._write_temp(bucket_name, blob_name, [data])
+
+        with self._locked(bucket_name, exclusive=True):
+            current = self._read_meta(bucket_name, blob_name)['generation']
+            if current != generation:
+                _unlink(tmp)
+                return False, None
+
+            self._commit(bucket_name, blob_name, tmp, dict(written, **{
+                'generation': max(current + 1, int(time.time() * 1000000)),
+                'content_encoding': content_encoding
+            }))
+            return True, None
+
+    def upload(self, bucket, key, file, md5: Optional[str] = None, crc32c: Optional[str] = None):
+        self._check_root(bucket)
+
+        def _chunks(f):
+            chunk = f.read(_COPY_CHUNK_SIZE)
+            while chunk:
+                yield chunk
+                chunk = f.read(_COPY_CHUNK_SIZE)
+
+        if hasattr(file, 'read'):
+            file.seek(0)
+            tmp, written = self._write_temp(bucket, key, _chunks(file), expected_md5=md5)
+        else:
+            with open(str(file), 'rb') as f:
+                tmp, written = self._write_temp(bucket, key, _chunks(f), expected_md5=md5)
+
+        with self._locked(bucket, exclusive=True):
+            generation = self._read_meta(bucket, key)['generation']
+            self._commit(bucket, key, tmp, dict(written, generation=max(generation + 1, int(time.time() * 1000000))))
+
+    def download(self, bucket, key, file, start=0):
+        with open(str(self._path(bucket, key)), 'rb') as src, open(str(file), 'ab' if start else 'wb') as dst:
+            src.seek(start)
+            chunk = src.read(_COPY_CHUNK_SIZE)
+            while chunk:
+                dst.write(chunk)
+                chunk = src.read(_COPY_CHUNK_SIZE)
+
+    def fetch_md5s(self, bucket, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Md5 of existing objects from their metadata. It's computed from the file when there's none or
+        the file size differs from the one recorded (the file was replaced by other means).
+        """
+        md5s = dict()
+        for key in keys:
+            path = self._path(bucket, key)
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            meta = self._read_meta(bucket, key)
+            md5 = meta.get('md5') if meta.get('size') == size else None
+            md5s[key] = md5 or _calc_md5_(path)[0]
+        return md5s
+
+    def touch_objects(self, bucket, keys: List[str]) -> List[str]:
+        """
+        Set modification time of the files to now, it's the update time listed for `builds gc`.
+        """
+        missing = []
+        for key in keys:
+            try:
+                os.utime(str(self._path(bucket, key)))
+            except FileNotFoundError:
+                missing.append(key)
+        return missing
+
+    def list_objects(self, bucket, prefix: str) -> Iterator[StoredObject]:
+        """
+        Objects under the prefix sorted by name within a directory, directories are scanned one at a time.
+        """
+        root = bucket_root(bucket)
+        # the prefix may end in the middle of a name, the directory of its last part is scanned
+        base = root / prefix.rsplit('/', 1)[0] if '/' in prefix else root
+
+        def _walk(directory: Path) -> Iterator[StoredObject]:
+            try:
+                entries = sorted(os.scandir(str(directory)), key=lambda e: e.name)
+            except FileNotFoundError:
+                return
+            for entry in entries:
+                if _TMP_MARK in entry.name or (directory == root and entry.name == META_DIR):
+                    continue
+                key = Path(entry.path).relative_to(root).as_posix()
+                if entry.is_dir(follow_symlinks=False):
+                    if key.startswith(prefix) or prefix.startswith(f'{key}/'):
+                        yield from _walk(Path(entry.path))
+                elif key.startswith(prefix):
+                    st = entry.stat()
+                    yield StoredObject(key, st.st_size,
+                                       datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc))
+
+        yield from _walk(base)
+
+    def delete_objects(self, bucket, keys: List[str]):
+        with self._locked(bucket, exclusive=True):
+            for key in keys:
+                _unlink(self._path(bucket, key))
+                _unlink(self._meta_path(bucket, key))
+
+
+def _unlink(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def bucket_root(bucket: str) -> Path:
+    """
+    Directory of `file:///path/to/root` bucket.
+    """
+    parsed = urlparse(bucket)
+    return Path(unquote(parsed.netloc + parsed.path))
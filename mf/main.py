@@ -9,11 +9,19 @@ import sys
 from pathlib import Path
 
 from mf.config import read_config
-from mf.manifest import BuildInfo, Manifest
+from mf.manifest import BuildInfo, Manifest, CAS_ATTEMPTS, ENGINE_THREADS, ENGINE_ASYNC
+from mf.serialization import write_json_lines
+from mf.snapshot import BuildSnapshot
+from mf.assets import cleanup_temp_files
+from mf.gc import GC_GRACE_PERIOD, collect_garbage
+from mf.cache import HashCache, ArtifactCache, ManifestCache, DEFAULT_CACHE_DIR, ARTIFACT_CACHE_MAX_SIZE, \
+    DEFAULT_MANIFEST_CACHE_DIR
 from mf.log import LOGGER
+from mf.transfer import DEFAULT_PARALLELISM, download_binaries
 
 PROJECT_OPT = 'project'
 FORMAT_OPT = 'format'
+MANIFEST_CACHE_OPT = 'manifest_cache'
 
 
 def main():
@@ -26,8 +34,11 @@ def main():
               help='Output format')
 @click.option('--config', default=None, help='Configuration file', type=click.Path())
 @click.option('--debug', is_flag=True, help='Enable debugging', default=False)
+@click.option('--manifest-cache-dir', type=click.Path(file_okay=False), default=str(DEFAULT_MANIFEST_CACHE_DIR),
+              envvar='MF_MANIFEST_CACHE_DIR', help='Directory of fetched manifests, reused while they are unchanged')
+@click.option('--no-manifest-cache', is_flag=True, default=False, help='Always download the manifest')
 @click.pass_context
-def cli(ctx, format, config, debug):
+def cli(ctx, format, config, debug, manifest_cache_dir, no_manifest_cache):
     ctx.ensure_object(dict)
 
     LOGGER.setLevel(logging.INFO)
@@ -40,6 +51,7 @@ def cli(ctx, format, config, debug):
     ctx.obj['root_dir'] = root_dir
     ctx.obj[PROJECT_OPT] = read_config(root_dir, mf_file=Path(config) if config else None)
     ctx.obj[FORMAT_OPT] = format
+    ctx.obj[MANIFEST_CACHE_OPT] = None if no_manifest_cache else ManifestCache(Path(manifest_cache_dir))
 
 
 @cli.group()
@@ -57,8 +69,22 @@ def builds():
 @click.option('--build_id', required=True, help='Current build id')
 @click.option('-nu', '--no-upload', is_flag=True, default=False,
               help='Should this tool upload artifacts?')
+@click.option('-p', '--parallelism', type=click.IntRange(min=1), default=DEFAULT_PARALLELISM,
+              envvar='MF_PARALLELISM', show_default=True, help='Number of concurrent uploads')
+@click.option('--no-hash-cache', is_flag=True, default=False,
+              help=f'Do not use persistent cache of file hashes ({DEFAULT_CACHE_DIR})')
+@click.option('--cas-attempts', type=click.IntRange(min=1), default=CAS_ATTEMPTS, envvar='MF_CAS_ATTEMPTS',
+              show_default=True, help='Max attempts to update the manifest modified concurrently by other builds')
+@click.option('--snapshot', type=click.Path(dir_okay=False),
+              help='Write discovered assets and their digests into the file, e.g. with --no-upload')
+@click.option('--from-snapshot', type=click.Path(exists=True, dir_okay=False),
+              help='Publish assets of the snapshot written by --snapshot instead of discovering them')
+@click.option('--engine', type=click.Choice([ENGINE_THREADS, ENGINE_ASYNC]), default=ENGINE_THREADS,
+              envvar='MF_ENGINE', show_default=True,
+              help='Transfers by a pool of threads, or by one event loop (pip install mfutil[async])')
 @click.pass_context
-def put(ctx, git_branch, git_commit, build_id, no_upload):
+def put(ctx, git_branch, git_commit, build_id, no_upload, parallelism, no_hash_cache, cas_attempts,
+        snapshot, from_snapshot, engine):
     """
     Scan current folder for .mf.json file that contains description of current repository.
     Based on configuration upload all found binaries into gcs and update manifest.json with information about success build.
@@ -87,8 +113,34 @@ def put(ctx, git_branch, git_commit, build_id, no_upload):
                            build_id=build_id,
                            date=datetime.datetime.utcnow())
 
-    actual_manifest = Manifest(project.bucket, project.repository)
-    new = actual_manifest.update(build_info, project, upload=not no_upload)
+    if not no_hash_cache and not from_snapshot:
+        project.hash_cache = HashCache(root_dir / DEFAULT_CACHE_DIR)
+
+    actual_manifest = None
+    try:
+        if from_snapshot:
+            build_snapshot = BuildSnapshot.load(Path(from_snapshot))
+        else:
+            build_snapshot = BuildSnapshot.capture(project)
+
+        if snapshot:
+            build_snapshot.dump(Path(snapshot))
+
+        actual_manifest = Manifest(project.bucket, project.repository,
+                                   manifest_cache=ctx.obj[MANIFEST_CACHE_OPT],
+                                   compression=project.manifest_compression,
+                                   engine=engine, parallelism=parallelism)
+        new = actual_manifest.update(build_info, project, upload=not no_upload, parallelism=parallelism,
+                                     max_attempts=cas_attempts, snapshot=build_snapshot)
+    finally:
+        if project.hash_cache is not None:
+            project.hash_cache.close()
+        cleanup_temp_files()
+        if actual_manifest is not None:
+            actual_manifest.storage.close()
+            if actual_manifest.update_stats.attempts:
+                LOGGER.info("manifest update: %s", actual_manifest.update_stats)
+
     if no_upload:
         click.echo(json.dumps(new, indent=4))
 
@@ -99,9 +151,9 @@ def put(ctx, git_branch, git_commit, build_id, no_upload):
 @click.option('--repo', help='Current repository name, a.k.a. semantic name')
 @click.option('--app', help='Specific repository\'s application name. Expects that repository can '
                             'have more then one application inside.')
-@click.option('--branch', help='Git branch name')
+@click.option('--branch', help='Git branch name or wildcard pattern (feature/*)')
 @click.option('-if', '--include-fields',
-              help='Include only this fields (comma separated lost). Available: branch,app,commit,url')
+              help='Include only this fields (comma separated lost). Available: branch,app,built_at,commit,url,filename (cas blobs),md5')
 def list(ctx, bucket, repo, app, branch, include_fields):
     """
     Listing for all latest build binaries (sorted by: branch, app name, time).
@@ -121,22 +173,23 @@ def list(ctx, bucket, repo, app, branch, include_fields):
                    'Please specify --bucket and --repo parameters or --config file path', err=True)
         return 1
 
-    manifest = Manifest(project.bucket, project.repository)
-    binaries_list = manifest.search(branch_name=branch, app_name=app)
+    manifest = Manifest(project.bucket, project.repository,
+                        manifest_cache=ctx.obj[MANIFEST_CACHE_OPT])
+    keys = set(str(include_fields).split(',')) if include_fields else None
+    # md5 is listed only when it's asked for explicitly
+    binaries_list = manifest.search(branch_name=branch, app_name=app, with_md5=keys is not None and 'md5' in keys)
 
     if len(binaries_list) == 0:
         click.echo('no builds found...')
 
-    if include_fields:
-        keys = set(str(include_fields).split(','))
+    if keys is not None:
         fields_filter = lambda d: dict(filter(lambda kv: kv[0] in keys, d.items()))
     else:
         fields_filter = lambda d: d
 
     format_ = ctx.obj[FORMAT_OPT]
     if format_ == 'json':
-        for d in binaries_list:
-            click.echo(json.dumps(fields_filter(d)))
+        write_json_lines((fields_filter(d) for d in binaries_list), click.get_binary_stream('stdout'))
 
     elif format_ == 'csv':
         w = csv.DictWriter(sys.stdout,
@@ -161,10 +214,22 @@ def list(ctx, bucket, repo, app, branch, include_fields):
 @click.option('--app', help='Specific repository\'s application name. Expects that repository can '
                             'have more then one application inside.')
 @click.option('--branch', help='Last build artifacts for branch name', required=True)
+@click.option('-p', '--parallelism', type=click.IntRange(min=1), default=DEFAULT_PARALLELISM,
+              envvar='MF_PARALLELISM', show_default=True, help='Number of concurrent downloads')
+@click.option('--cache-dir', type=click.Path(file_okay=False), envvar='MF_CACHE_DIR',
+              help='Shared local cache of downloaded binaries')
+@click.option('--cache-size', type=click.IntRange(min=0), default=ARTIFACT_CACHE_MAX_SIZE, envvar='MF_CACHE_SIZE',
+              show_default=True, help='Max size of the cache in bytes, least recently used files are evicted')
+@click.option('--engine', type=click.Choice([ENGINE_THREADS, ENGINE_ASYNC]), default=ENGINE_THREADS,
+              envvar='MF_ENGINE', show_default=True,
+              help='Transfers by a pool of threads, or by one event loop (pip install mfutil[async])')
 @click.argument('destination', type=click.Path(exists=True, file_okay=False))
-def get(ctx, bucket, repo, app, branch, destination):
+def get(ctx, bucket, repo, app, branch, parallelism, cache_dir, cache_size, engine, destination):
     """
     Download all found binaries.
+
+    Files are downloaded concurrently under temp names and renamed once their md5 is verified.
+    A failed run continues from where it stopped.
     """
 
     ctx.ensure_object(dict)
@@ -175,16 +240,85 @@ def get(ctx, bucket, repo, app, branch, destination):
                    'Please specify --bucket and --repo parameters or --config file path', err=True)
         return 1
 
-    manifest = Manifest(project.bucket, project.repository)
-    binaries_list = manifest.search(branch_name=branch, app_name=app)
+    manifest = Manifest(project.bucket, project.repository,
+                        manifest_cache=ctx.obj[MANIFEST_CACHE_OPT], engine=engine, parallelism=parallelism)
+    try:
+        binaries_list = manifest.search(branch_name=branch, app_name=app, with_md5=True)
+
+        cache = ArtifactCache(Path(cache_dir), max_size=cache_size) if cache_dir else None
+        download_binaries(manifest, binaries_list, destination, parallelism=parallelism, cache=cache)
+    finally:
+        manifest.storage.close()
+
+
+@builds.command()
+@click.pass_context
+@click.option('--bucket', help='Root GCS bucket for all artifacts')
+@click.option('--repo', help='Current repository name, a.k.a. semantic name')
+@click.option('--grace-hours', type=click.IntRange(min=0), default=int(GC_GRACE_PERIOD.total_seconds() // 3600),
+              show_default=True, help='Objects modified within this period are kept')
+@click.option('--dry-run', is_flag=True, default=False, help='Report unreferenced objects without deleting them')
+@click.option('-p', '--parallelism', type=click.IntRange(min=1), default=DEFAULT_PARALLELISM,
+              envvar='MF_PARALLELISM', show_default=True, help='Number of concurrent batch deletions')
+def gc(ctx, bucket, repo, grace_hours, dry_run, parallelism):
+    """
+    Delete artifacts of the repository which are not referenced by the manifest.
+
+    [ mfutil builds gc --dry-run ] will report objects and bytes to be deleted
+    """
+
+    ctx.ensure_object(dict)
+    project = ctx.obj[PROJECT_OPT]
+
+    if project is None and (bucket is None or repo is None):
+        click.echo(f'Config file not found in [{ctx.obj["root_dir"]}] and --bucket not specifies.\n'
+                   'Please specify --bucket and --repo parameters or --config file path', err=True)
+        return 1
+
+    manifest = Manifest(bucket or project.bucket, repo or project.repository,
+                        manifest_cache=ctx.obj[MANIFEST_CACHE_OPT])
+    stats = collect_garbage(manifest, grace=datetime.timedelta(hours=grace_hours), dry_run=dry_run,
+                            parallelism=parallelism)
 
-    for bin in binaries_list:
-        manifest.download(bin, dest=destination)
-        LOGGER.info("Downloading... %s", bin['url'])
+    action = 'would be deleted' if dry_run else 'deleted'
+    click.echo(f'{stats.deleted} of {stats.listed} objects, {stats.deleted_bytes} bytes {action}')
 
+
+@cli.group(name='manifest')
+def manifest_group():
+    """
+    Maintenance of the repository manifest.
+    """
     pass
 
 
+@manifest_group.command()
+@click.pass_context
+@click.option('--bucket', help='Root GCS bucket for all artifacts')
+@click.option('--repo', help='Current repository name, a.k.a. semantic name')
+def migrate(ctx, bucket, repo):
+    """
+    Convert the single manifest.json of a repository into per-branch shards.
+
+    [ mfutil manifest migrate --bucket <bucket> --repo <repo> ]
+    """
+
+    ctx.ensure_object(dict)
+    project = ctx.obj[PROJECT_OPT]
+
+    if project is None and (bucket is None or repo is None):
+        click.echo(f'Config file not found in [{ctx.obj["root_dir"]}] and --bucket not specifies.\n'
+                   'Please specify --bucket and --repo parameters or --config file path', err=True)
+        return 1
+
+    manifest = Manifest(bucket or project.bucket, repo or project.repository,
+                        manifest_cache=ctx.obj[MANIFEST_CACHE_OPT],
+                        compression=project.manifest_compression if project is not None else None)
+    migrated = manifest.migrate()
+
+    click.echo(f'{migrated} branches migrated' if migrated else 'manifest is sharded already')
+
+
 def __current_dir() -> Path:
     cur = Path('.').absolute()
     LOGGER.debug(f'Set current project root dir ({cur})')
@@ -1,84 +1,236 @@
 # coding: utf-8
 
-import copy
-import json
+import mimetypes
+import os
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Tuple, Optional, Dict
+from typing import Tuple, Optional, Dict, Iterable, Iterator, List, NamedTuple, Set, Union, BinaryIO, TYPE_CHECKING
 
-import google
 import datetime
-import requests
 import warnings
-import requests.auth
 
-from jsonpath_ng import jsonpath, parse
-from slugify import slugify
-from google.cloud import storage
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
-from mf.config import Project, BuildInfo
-from mf.assets import AssetBase
+from mf.cache import ArtifactCache, ManifestCache
+from mf.config import Project, BuildInfo, BLOB_LAYOUT_CAS, MANIFEST_LAYOUT_SINGLE, MANIFEST_LAYOUT_SHARDED, \
+    MANIFEST_COMPRESSION_NONE, MANIFEST_COMPRESSION_GZIP
+from mf.assets import AssetBase, _calc_md5_, _calc_crc32c_, _new_crc32c
+from mf.index import ManifestIndex, select, slugify_pattern
+from mf import serialization
 from mf.log import LOGGER
+from mf.snapshot import BuildSnapshot
+from mf.views import ReadOnlyDict
+from mf.transfer import DEFAULT_PARALLELISM, COMPOSITE_PARALLELISM, COMPOSITE_PART_SIZE, \
+    COMPOSITE_UPLOAD_THRESHOLD, UPLOAD_PART_ATTEMPTS, FileSlice, split_parts, upload_assets, backoff_delay
+
+if TYPE_CHECKING:
+    # google.cloud.storage and requests take most of the CLI startup time, they are imported on first use
+    import requests
+    from google.cloud import storage
 
 MANIFEST_NAME = 'manifest.json'
 
+#
+# Manifests of branches in the sharded layout, {repository}/manifests/{branch}.json
+#
+SHARDS_DIR = 'manifests'
+
+#
+# Max attempts to compare-and-set a manifest modified concurrently by other builds.
+# Can be overridden by --cas-attempts option or MF_CAS_ATTEMPTS env variable.
+#
+CAS_ATTEMPTS = 10
+
+#
+# Max number of sub-requests in one GCS batch request.
+# see: https://cloud.google.com/storage/docs/json_api/v1/how-tos/batch
+#
+_GCS_BATCH_SIZE = 100
+
+#
+# Storage engines: blocking transfers run by thread pools, or coroutines of one event loop (mf.aio, aiohttp).
+# Can be selected by --engine option or MF_ENGINE env variable.
+#
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNC = 'async'
+
+#
+# Custom metadata of composite objects keeping md5 of the whole file, GCS computes crc32c only.
+#
+COMPOSITE_MD5_KEY = 'mf-md5'
+
+#
+# Custom metadata refreshed on objects reused by a build instead of uploaded, see `StorageBase.touch_objects`.
+#
+TOUCHED_KEY = 'mf-touched'
+
+
+class ManifestConflictError(Exception):
+    """
+    The manifest has been modified concurrently on every attempt to update it.
+    """
+
+
+class UpdateStats:
+    """
+    Counters of compare-and-set attempts of one update, reported at the end of `builds put`.
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.conflicts = 0
+        self.backoff_sec = 0.0
+
+    def __repr__(self):
+        return f'attempts={self.attempts}, conflicts={self.conflicts}, backoff={self.backoff_sec:.1f}s'
+
+
+class StoredObject(NamedTuple):
+    """
+    Listed object of a bucket.
+    """
+    key: str
+    size: int
+    updated: datetime.datetime
+
 
 class StorageBase:
+    # storages of the async engine (mf.aio) provide `*_async` coroutines of transfers and `run`
+    is_async = False
+
+    def close(self):
+        """
+        Release connections, the storage is not used anymore.
+        """
 
-    def fetch_manifest(self) -> Tuple[str, int, dict]:
+    def fetch_manifest(self, name: str = MANIFEST_NAME, create: bool = True) -> Tuple[str, int, Optional[dict]]:
+        """
+        :param name: object name relative to the repository
+        :param create: create an empty manifest if it doesn't exist, otherwise (key, 0, None) is returned
+        :return: (key, generation, content)
+        """
         raise NotImplemented('fetch_manifest')
 
-    def cas_blob(self, data: bytes, generation: int, bucket_name: str, blob_name: str) -> Tuple[
-        bool, Optional[requests.Response]]:
+    def cas_blob(self, data: bytes, generation: int, bucket_name: str, blob_name: str,
+                 content_encoding: Optional[str] = None) -> Tuple[bool, Optional['requests.Response']]:
         raise NotImplemented('cas_blob')
 
-    def upload(self, bucket, key, file: Path):
+    def upload(self, bucket, key, file: Union[Path, BinaryIO], md5: Optional[str] = None,
+               crc32c: Optional[str] = None):
+        """
+        :param md5: base64 encoded md5 of the file, the uploaded object is verified against it if given
+        :param crc32c: base64 encoded crc32c of the file, if it's known already
+        """
         raise NotImplemented('upload')
 
-    def download(self, bucket, key, file):
-        raise NotImplemented('upload')
+    def download(self, bucket, key, file, start=0):
+        raise NotImplemented('download')
+
+    def fetch_md5s(self, bucket, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Base64 encoded MD5 hashes of existing objects, missing objects are omitted.
+        By default nothing is known about remote objects, so everything is uploaded.
+        """
+        return {}
 
+    def touch_objects(self, bucket, keys: List[str]) -> List[str]:
+        """
+        Refresh the update time of existing objects. Objects reused by a build are not uploaded again,
+        touching them makes `builds gc` keep them for the grace period until the build is published.
+        By default nothing is reused, see `fetch_md5s`.
 
-class StorageGCS(StorageBase):
+        :return: keys of missing objects, deleted meanwhile
+        """
+        return []
+
+    def list_objects(self, bucket, prefix: str) -> Iterator[StoredObject]:
+        """
+        Objects under the prefix, fetched page by page while iterating.
+        """
+        raise NotImplementedError('list_objects')
+
+    def delete_objects(self, bucket, keys: List[str]):
+        """
+        Delete objects, already missing ones are ignored.
+        """
+        raise NotImplementedError('delete_objects')
 
-    def __init__(self, bucket, semantic_name):
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            credentials, _ = google.auth.default()
-            self._storage_client = storage.Client(credentials=credentials)
-            self._credentials = credentials
+class StorageGCS(StorageBase):
 
+    def __init__(self, bucket, semantic_name, cache: Optional[ManifestCache] = None):
+        self._bucket_name = bucket
         self._semantic_name = semantic_name
-        self._gs_bucket: storage.Bucket = self._storage_client.lookup_bucket(bucket)
+        self._cache = cache
+        self._client = None
+        self._credentials = None
+        self._bucket_checked = False
+        self._lock = threading.Lock()
+
+    @property
+    def _storage_client(self) -> 'storage.Client':
+        """
+        Client is created on first use, commands which never touch GCS don't pay for auth and imports.
+        """
+        if self._client is None:
+            import google.auth
+            from google.cloud import storage
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                credentials, _ = google.auth.default()
+                self._client = storage.Client(credentials=credentials)
+                self._credentials = credentials
+
+        return self._client
+
+    @property
+    def _gs_bucket(self) -> 'storage.Bucket':
+        # no request is made, reads of a missing bucket just find nothing
+        return self._storage_client.bucket(self._bucket_name)
+
+    def _check_bucket(self):
+        """
+        Validate the bucket before the first write, read-only commands never do it.
+        """
+        # uploads run concurrently, the bucket is looked up once
+        with self._lock:
+            if self._bucket_checked:
+                return
+
+            gs_bucket = self._storage_client.lookup_bucket(self._bucket_name)
+
+            if gs_bucket is None:
+                LOGGER.error("bucket %s not exists", self._bucket_name)
+                raise RuntimeError('not_found')
 
-        if self._gs_bucket is None:
-            LOGGER.error("bucket %s not exists", bucket)
-            raise RuntimeError('not_found')
+            if not gs_bucket.versioning_enabled:
+                raise RuntimeError(_versioning_disabled_message(gs_bucket.name))
 
-        if not self._gs_bucket.versioning_enabled:
-            msg = f"Object Versioning for bucket [ {self._gs_bucket.name} ] is not enabled. " \
-                "This can lead to a potential loss of updates while being published by multiple clients. " \
-                "Please enable it for further usage. \n" \
-                f"Simplest way is to fix it -- gsutil versioning set on gs://{self._gs_bucket.name} \n" \
-                "More information - https://cloud.google.com/storage/docs/gsutil/addlhelp/ObjectVersioningandConcurrencyControl"
-            raise RuntimeError(msg)
+            self._bucket_checked = True
 
-    def fetch_manifest(self) -> Tuple[str, str, dict]:
+    def fetch_manifest(self, name: str = MANIFEST_NAME, create: bool = True) -> Tuple[str, int, Optional[dict]]:
         """
         Fetch manifest from GS bucket. Remember blob's generation for concurrency control.
         :return:
         """
         bucket = self._gs_bucket
 
-        key = f'{self._semantic_name}/{MANIFEST_NAME}'
-        manifest_blob: storage.bucket.Blob = bucket.get_blob(key)
+        key = f'{self._semantic_name}/{name}'
+        manifest_blob: 'storage.Blob' = bucket.get_blob(key)
+
+        if not manifest_blob and not create:
+            # generation 0 makes the first cas_blob create the object
+            return key, 0, None
 
         if not manifest_blob:
-            LOGGER.warning(f'{MANIFEST_NAME} not exists by  gs://{bucket.name}/{key}, create empty')
-            empty_manifest: str = json.dumps({"@spec": 1, "@ns": {}})
+            LOGGER.warning(f'{name} not exists by  gs://{bucket.name}/{key}, create empty')
+            empty_manifest: bytes = serialization.dumps({"@spec": 1, "@ns": {}})
 
-            ok, err = self.cas_blob(empty_manifest.encode('utf-8'),
+            ok, err = self.cas_blob(empty_manifest,
                                     generation=0, bucket_name=bucket.name, blob_name=key)
 
             if ok or err is None:
@@ -88,15 +240,22 @@ class StorageGCS(StorageBase):
                 LOGGER.error("Could not create manifest %s", err.content)
                 raise Exception("creating %s failed" % key)
 
-        str_ = manifest_blob.download_as_string()
-        json_ = json.loads(str_)
+        # get_blob fetched metadata only, the body is downloaded if the cached one is outdated
+        json_ = self._cache.get(bucket.name, key, manifest_blob.generation) if self._cache is not None else None
+
+        if json_ is None:
+            # stored bytes as is, gzip encoded manifests are decompressed locally
+            str_ = manifest_blob.download_as_string(raw_download=True)
+            json_ = serialization.loads(serialization.gunzip_if_compressed(str_))
+            if self._cache is not None:
+                self._cache.put(bucket.name, key, manifest_blob.generation, json_)
 
         LOGGER.debug('Fetching manifest -- gs://%s/%s#%d', manifest_blob.bucket.name, manifest_blob.name,
                      manifest_blob.generation)
         return manifest_blob.name, manifest_blob.generation, json_
 
-    def cas_blob(self, data: bytes, generation: int, bucket_name: str, blob_name: str) -> Tuple[
-        bool, Optional[requests.Response]]:
+    def cas_blob(self, data: bytes, generation: int, bucket_name: str, blob_name: str,
+                 content_encoding: Optional[str] = None) -> Tuple[bool, Optional['requests.Response']]:
         """
         Perform analog of compare-and-set operation on GoogleStorage object.
 
@@ -107,10 +266,16 @@ class StorageGCS(StorageBase):
         :param blob_name:
         :param data: data to post
         :param generation: expected blob's generation
+        :param content_encoding: `gzip` if data is compressed, stored as the object metadata
         :return: (true, None) - if update success;
                  (false, None) - on conflict; (false, response) - on any other http error
         """
 
+        import requests
+        import requests.auth
+
+        self._check_bucket()
+
         class AuthBearer(requests.auth.AuthBase):
             def __init__(self, t):
                 self._token = t
@@ -127,8 +292,19 @@ class StorageGCS(StorageBase):
             'x-goog-if-generation-match': str(generation)
         }
 
-        resp = requests.post(link, data=data, params={'uploadType': 'media', 'name': blob_name},
-                             headers=headers, auth=AuthBearer(oauth_token))
+        if content_encoding is None:
+            resp = requests.post(link, data=data, params={'uploadType': 'media', 'name': blob_name},
+                                 headers=headers, auth=AuthBearer(oauth_token))
+        else:
+            # metadata can't be passed with a media upload
+            body, content_type = _multipart_body({
+                'name': blob_name,
+                'contentType': 'application/json',
+                'contentEncoding': content_encoding
+            }, data)
+            headers['Content-Type'] = content_type
+            resp = requests.post(link, data=body, params={'uploadType': 'multipart'},
+                                 headers=headers, auth=AuthBearer(oauth_token))
 
         if resp.status_code == 200:
             return True, None
@@ -137,20 +313,292 @@ class StorageGCS(StorageBase):
         else:
             return False, resp
 
-    def upload(self, bucket, key, file):
+    def upload(self, bucket, key, file, md5: Optional[str] = None, crc32c: Optional[str] = None):
         """
-        Upload file into bucket and key
+        Upload file into bucket and key.
+
+        Files larger than COMPOSITE_UPLOAD_THRESHOLD are uploaded by parts in parallel and composed
+        by GCS, which needs google-crc32c to verify the result. Otherwise the file is uploaded by one stream.
+
         :param bucket: bucket
         :param key: key
-        :param file: file
-        :return:
+        :param file: path of a file or binary stream opened for reading
+        :param md5: base64 encoded md5 of the file, the uploaded object is verified against it if given
+        :param crc32c: base64 encoded crc32c of the file, computed while uploading parts if not given
+        :raises IOError: if the uploaded object doesn't match the file
+        """
+        self._check_bucket()
+        blob: 'storage.Blob' = self._storage_client.bucket(bucket).blob(key)
+
+        path = _local_path(file)
+        size = path.stat().st_size if path is not None else None
+        if size is not None and 0 < COMPOSITE_UPLOAD_THRESHOLD < size and _new_crc32c() is not None:
+            self._upload_composite(bucket, key, path, size, md5, crc32c)
+            return
+
+        if not hasattr(file, 'read'):
+            blob.upload_from_filename(filename=str(file))
+        else:
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+            file.seek(0)
+            # the same content type as upload_from_filename guesses, in-memory streams have no name
+            content_type, _ = mimetypes.guess_type(str(getattr(file, 'name', '')))
+            blob.upload_from_file(file, size=size, content_type=content_type)
+
+        if md5 is not None and blob.md5_hash != md5:
+            raise IOError(f"md5 of uploaded gs://{bucket}/{key} [{blob.md5_hash}] doesn't match {md5}")
+
+    def _upload_composite(self, bucket, key, path: Path, size: int, md5: Optional[str], crc32c: Optional[str]):
+        """
+        Upload parts of the file concurrently into temp objects, every part is retried on its own,
+        then compose them into `key` and verify its crc32c. Composite objects have no md5 hash,
+        so the md5 is kept in the metadata for `fetch_md5s`.
+        """
+        gs_bucket = self._storage_client.bucket(bucket)
+        parts = split_parts(size, COMPOSITE_PART_SIZE)
+        # left by an interrupted upload, temp parts are unreferenced and deleted by `builds gc`
+        parts_prefix = f'{key}.parts-{uuid.uuid4().hex[:8]}'
+        part_blobs = [gs_bucket.blob(f'{parts_prefix}/{i:02d}') for i in range(len(parts))]
+
+        def _upload_part(i: int):
+            offset, length = parts[i]
+            for attempt in range(1, UPLOAD_PART_ATTEMPTS + 1):
+                try:
+                    with FileSlice(path, offset, length) as part:
+                        part_blobs[i].upload_from_file(part, size=length)
+                    return
+                except Exception as e:
+                    if attempt == UPLOAD_PART_ATTEMPTS:
+                        raise
+                    delay = backoff_delay(attempt)
+                    LOGGER.warning("Uploading part %d of %s failed (%s), retry in %.1fs", i, key, e, delay)
+                    time.sleep(delay)
+
+        LOGGER.info("Uploading gs://%s/%s by %d parts", bucket, key, len(parts))
+        try:
+            with ThreadPoolExecutor(max_workers=min(COMPOSITE_PARALLELISM, len(parts)) + 1) as pool:
+                local_crc32c = pool.submit(_calc_crc32c_, path) if crc32c is None else None
+                for _ in pool.map(_upload_part, range(len(parts))):
+                    pass
+                crc32c = crc32c or local_crc32c.result()
+
+            blob: 'storage.Blob' = gs_bucket.blob(key)
+            blob.content_type, _ = mimetypes.guess_type(str(path))
+            if md5 is not None:
+                blob.metadata = {COMPOSITE_MD5_KEY: md5}
+            blob.compose(part_blobs)
+        finally:
+            self.delete_objects(bucket, [b.name for b in part_blobs])
+
+        actual = blob.crc32c
+        if actual != crc32c:
+            blob.delete()
+            raise IOError(f"crc32c of composed gs://{bucket}/{key} [{actual}] doesn't match {crc32c}")
+
+    def download(self, bucket, key, file, start=0):
+        """
+        Download object into file.
+        With `start` > 0 the download is resumed, bytes from `start` offset are appended to the file.
+        """
+        from google.api_core.exceptions import RequestRangeNotSatisfiable
+        from google.resumable_media import DataCorruption
+
+        blob: 'storage.Blob' = self._storage_client.bucket(bucket).blob(key)
+        with open(str(file), 'ab' if start else 'wb') as f:
+            try:
+                blob.download_to_file(f, start=start or None)
+            except RequestRangeNotSatisfiable:
+                # the file has been downloaded completely already
+                LOGGER.debug("nothing to resume for gs://%s/%s from %d", bucket, key, start)
+            except DataCorruption:
+                if not start:
+                    raise
+                # md5 of the whole object is compared with the range by the client, the tail is written already
+                # and the whole file is verified by `Manifest.download`
+                LOGGER.debug("resumed gs://%s/%s from %d, md5 is checked for the whole file", bucket, key, start)
+
+    def fetch_md5s(self, bucket, keys: Iterable[str]) -> Dict[str, str]:
         """
-        blob: storage.client.Blob = self._storage_client.bucket(bucket).blob(key)
-        blob.upload_from_filename(filename=str(file))
+        Fetch metadata of objects by GCS batch requests, one HTTP round-trip per batch.
+
+        :param bucket: bucket
+        :param keys: object keys
+        :return: key -> base64 encoded md5 for every existing object
+        """
+        from google.api_core.exceptions import GoogleAPICallError
+
+        gs_bucket = self._storage_client.bucket(bucket)
+        keys = list(keys)
+        md5s = dict()
+
+        for i in range(0, len(keys), _GCS_BATCH_SIZE):
+            blobs = [gs_bucket.blob(key) for key in keys[i:i + _GCS_BATCH_SIZE]]
+            try:
+                with self._storage_client.batch():
+                    for blob in blobs:
+                        blob.reload()
+            except GoogleAPICallError as e:
+                # missing objects fail their sub-requests, responses of the rest are applied anyway
+                LOGGER.debug("batch metadata request: %s", e)
+
+            for blob in blobs:
+                # properties of failed sub-requests stay unresolved futures
+                if isinstance(blob._properties, dict):
+                    md5 = blob.md5_hash or (blob.metadata or {}).get(COMPOSITE_MD5_KEY)
+                    if md5:
+                        md5s[blob.name] = md5
+
+        return md5s
+
+    def touch_objects(self, bucket, keys: List[str]) -> List[str]:
+        """
+        Patch custom metadata of objects by GCS batch requests, which updates their `updated` time.
+        Other metadata (md5 of composite objects) is kept, a patch merges metadata keys.
+        """
+        from google.api_core.exceptions import GoogleAPICallError
+
+        gs_bucket = self._storage_client.bucket(bucket)
+        touched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        missing = []
 
-    def download(self, bucket, key, file):
-        blob: storage.Blob = self._storage_client.bucket(bucket).blob(key)
-        blob.download_to_filename(str(file))
+        for i in range(0, len(keys), _GCS_BATCH_SIZE):
+            blobs = [gs_bucket.blob(key) for key in keys[i:i + _GCS_BATCH_SIZE]]
+            try:
+                with self._storage_client.batch():
+                    for blob in blobs:
+                        blob.metadata = {TOUCHED_KEY: touched_at}
+                        blob.patch()
+            except GoogleAPICallError as e:
+                # missing objects fail their sub-requests, the rest is patched anyway
+                LOGGER.debug("batch patch request: %s", e)
+
+            # properties of failed sub-requests stay unresolved futures
+            missing.extend(blob.name for blob in blobs if not isinstance(blob._properties, dict))
+
+        return missing
+
+    def list_objects(self, bucket, prefix: str) -> Iterator[StoredObject]:
+        """
+        Objects under the prefix. Pages of up to 1000 objects are requested lazily, only the fields
+        of `StoredObject` are fetched.
+        """
+        blobs = self._storage_client.list_blobs(bucket, prefix=prefix,
+                                                fields='items(name,size,updated),nextPageToken')
+        for blob in blobs:
+            yield StoredObject(blob.name, blob.size or 0, blob.updated)
+
+    def delete_objects(self, bucket, keys: List[str]):
+        """
+        Delete objects by GCS batch requests, one HTTP round-trip per batch.
+        Batches are bound to the calling thread, so several threads can delete concurrently.
+        Objects deleted meanwhile are ignored, any other failure is raised.
+        """
+        from google.api_core.exceptions import NotFound
+
+        gs_bucket = self._storage_client.bucket(bucket)
+
+        for i in range(0, len(keys), _GCS_BATCH_SIZE):
+            chunk = keys[i:i + _GCS_BATCH_SIZE]
+            try:
+                with self._storage_client.batch():
+                    for key in chunk:
+                        gs_bucket.delete_blob(key)
+            except NotFound as e:
+                # a batch raises only its first failed sub-request, which may hide failures of other
+                # keys: delete the chunk again key by key, the ones already deleted are NotFound
+                LOGGER.debug("batch delete request: %s", e)
+                for key in chunk:
+                    try:
+                        gs_bucket.delete_blob(key)
+                    except NotFound:
+                        pass
+
+
+def _versioning_disabled_message(bucket_name: str) -> str:
+    return f"Object Versioning for bucket [ {bucket_name} ] is not enabled. " \
+        "This can lead to a potential loss of updates while being published by multiple clients. " \
+        "Please enable it for further usage. \n" \
+        f"Simplest way is to fix it -- gsutil versioning set on gs://{bucket_name} \n" \
+        "More information - https://cloud.google.com/storage/docs/gsutil/addlhelp/ObjectVersioningandConcurrencyControl"
+
+
+def create_storage(bucket: str, semantic_name: str, cache: Optional[ManifestCache] = None,
+                   engine: str = ENGINE_THREADS, parallelism: int = DEFAULT_PARALLELISM) -> StorageBase:
+    """
+    Storage of the bucket: a local directory for `file:///path/to/root`, a GCS bucket by name otherwise.
+
+    :param engine: ENGINE_ASYNC serves a GCS bucket from one event loop (mf.aio), local directories
+                   are always served by threads
+    :param parallelism: max number of connections of the async engine
+    """
+    if urlparse(bucket).scheme == 'file':
+        from mf.local import StorageLocal
+        return StorageLocal(bucket, semantic_name)
+    if engine == ENGINE_ASYNC:
+        from mf.aio import AsyncStorageGCS
+        return AsyncStorageGCS(bucket, semantic_name, cache=cache, pool_size=parallelism)
+    return StorageGCS(bucket, semantic_name, cache=cache)
+
+
+def object_url(bucket: str, key: str) -> str:
+    """
+    URL of an object referenced by manifests, `gs://{bucket}/{key}` or `file:///path/to/root/{key}`.
+    """
+    if '://' in bucket:
+        return f"{bucket.rstrip('/')}/{key}"
+    return f'gs://{bucket}/{key}'
+
+
+def _local_path(file) -> Optional[Path]:
+    """
+    Path of a local file given as is or by a stream opened from it, None for in-memory streams.
+    """
+    if not hasattr(file, 'read'):
+        return Path(file)
+    name = getattr(file, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return Path(name)
+    return None
+
+
+def _multipart_body(metadata: dict, data: bytes) -> Tuple[bytes, str]:
+    """
+    Body of a multipart upload of GCS JSON API: object metadata and its content.
+
+    :return: (body, content type header)
+    """
+    boundary = f'mf-{uuid.uuid4().hex}'
+    body = b''.join([
+        f'--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n'.encode('utf-8'),
+        serialization.dumps(metadata),
+        f'\r\n--{boundary}\r\nContent-Type: {metadata.get("contentType", "application/octet-stream")}\r\n\r\n'
+        .encode('utf-8'),
+        data,
+        f'\r\n--{boundary}--\r\n'.encode('utf-8'),
+    ])
+    return body, f'multipart/related; boundary={boundary}'
+
+
+class _DownloadTarget:
+    """
+    State of one download between `Manifest._prepare_download` and `Manifest._complete_download`.
+    """
+
+    def __init__(self, url: str, bucket: str, key: str, file: Path, md5: Optional[str]):
+        self.url = url
+        self.bucket = bucket
+        self.key = key
+        self.file = file
+        self.part = file.with_name(file.name + '.part')
+        self.md5 = md5
+        self.offset = 0
+        self.from_cache = False
+        self.done = False
+
+    @property
+    def pending(self) -> bool:
+        return not self.done and not self.from_cache
 
 
 class Manifest(object):
@@ -163,8 +611,14 @@ class Manifest(object):
         if 'storage' in kwargs:
             self._storage: StorageBase = kwargs['storage']
         else:
-            self._storage: StorageBase = StorageGCS(bucket, repo_name)
+            self._storage: StorageBase = create_storage(bucket, repo_name, cache=kwargs.get('manifest_cache'),
+                                                        engine=kwargs.get('engine') or ENGINE_THREADS,
+                                                        parallelism=kwargs.get('parallelism') or DEFAULT_PARALLELISM)
 
+        # content encoding of written manifests, see MANIFEST_COMPRESSION_*
+        self._compression = kwargs.get('compression') or MANIFEST_COMPRESSION_NONE
+
+        self.update_stats = UpdateStats()
         self.__fetch_manifest()
 
     def __fetch_manifest(self):
@@ -173,144 +627,407 @@ class Manifest(object):
         self._original_content = content
         self._version = version
         self._blob_key = blob_name
+        self._index: Optional[ManifestIndex] = None
+        # sharded layout only, indexes of fetched shards by branch
+        self._shard_indexes: Dict[str, ManifestIndex] = dict()
+
+    @property
+    def content(self) -> ReadOnlyDict:
+        """
+        Read-only view of the fetched manifest, `content.to_dict()` makes a modifiable copy.
+        """
+        return ReadOnlyDict(self._original_content)
+
+    @property
+    def layout(self) -> str:
+        return self._original_content.get('@layout', MANIFEST_LAYOUT_SINGLE)
+
+    @property
+    def branches(self) -> List[str]:
+        if self.layout == MANIFEST_LAYOUT_SHARDED:
+            return sorted(self._original_content.get('@branches', {}))
+        return sorted(self._original_content.get('@ns', {}))
 
     @property
-    def content(self):
-        return copy.deepcopy(self._original_content)
+    def storage(self) -> StorageBase:
+        return self._storage
 
-    def download(self, binary: dict, dest):
-        path = binary['url'].replace('gs://', '')
+    @property
+    def bucket(self) -> str:
+        return self._bucket
+
+    @property
+    def repo_name(self) -> str:
+        return self._repo_name
 
-        path_parts = path.split('/')
-        bucket = path_parts[0]
-        key = "/".join(path_parts[1:])
-        filename = path_parts[len(path_parts) - 1]
+    def references(self) -> Set[str]:
+        """
+        Keys of objects in the bucket referenced by any branch, shards are fetched concurrently.
+        """
+        if self.layout != MANIFEST_LAYOUT_SHARDED:
+            contents = [self._original_content]
+        else:
+            branches = self.branches
+            with ThreadPoolExecutor(max_workers=max(1, min(DEFAULT_PARALLELISM, len(branches)))) as pool:
+                contents = [content for _, _, content in pool.map(self._fetch_shard, branches)]
+
+        root = object_url(self._bucket, '')
+        keys = set()
+        for content in contents:
+            for url in _iter_refs(content):
+                if url.startswith(root):
+                    keys.add(url[len(root):])
+        return keys
+
+    def _fetch_shard(self, branch: str) -> Tuple[str, int, dict]:
+        entry = self._original_content.get('@branches', {}).get(branch, {})
+        key, generation, content = self._storage.fetch_manifest(entry.get('@manifest', shard_name(branch)),
+                                                                create=False)
+        return key, generation, content if content is not None else {"@spec": 1, "@ns": {}}
+
+    def _cas(self, key: str, generation: int, content: dict) -> bool:
+        """
+        :return: True if written, False on conflict
+        """
+        data = serialization.dumps(content)
+        if self._compression == MANIFEST_COMPRESSION_GZIP:
+            ok, err_resp = self._storage.cas_blob(data=serialization.gzip_compress(data), generation=generation,
+                                                  bucket_name=self._bucket, blob_name=key, content_encoding='gzip')
+        else:
+            ok, err_resp = self._storage.cas_blob(data=data, generation=generation,
+                                                  bucket_name=self._bucket, blob_name=key)
+        if err_resp is not None:
+            LOGGER.error("update failed [%s] %s", err_resp.status_code, err_resp.text)
+            raise Exception('GoogleStorage update failed')
+
+        if ok:
+            LOGGER.debug("new updated %s \n%s", key, data)
+        return ok
+
+    def download(self, binary: dict, dest, cache: Optional[ArtifactCache] = None) -> Path:
+        """
+        Download a binary found by `search(..., with_md5=True)` into `dest/{branch}/{app}/{filename}`.
+
+        The file is written under a temp name and atomically renamed once its md5 is verified.
+        A partially downloaded file left by a failed run is resumed, a file with the same md5
+        is not downloaded again.
+
+        :param cache: shared local cache, checked before downloading and filled after
+        """
+        target = self._prepare_download(binary, dest, cache)
+        if target.pending:
+            self._storage.download(target.bucket, target.key, target.part, start=target.offset)
+        return self._complete_download(target, cache)
+
+    async def download_async(self, binary: dict, dest, cache: Optional[ArtifactCache] = None) -> Path:
+        """
+        `download` by the async engine (see `mf.aio`): the transfer runs on the event loop,
+        hashing and the cache run in the default executor.
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        target = await loop.run_in_executor(None, self._prepare_download, binary, dest, cache)
+        if target.pending:
+            await self._storage.download_async(target.bucket, target.key, target.part, start=target.offset)
+        return await loop.run_in_executor(None, self._complete_download, target, cache)
+
+    def _prepare_download(self, binary: dict, dest, cache: Optional[ArtifactCache]) -> '_DownloadTarget':
+        bucket, key = self._split_url(binary['url'])
+        # content addressed blobs keep the original name in the manifest only
+        # the name comes from the manifest, it must not point out of the destination
+        filename = Path(binary.get('filename') or key.split('/')[-1]).name
+        if filename in ('', '.', '..'):
+            raise ValueError(f"invalid file name of {binary['url']} [{binary.get('filename')}]")
 
         folders = Path(dest) / binary['branch'] / binary['app']
         if not folders.exists():
-            folders.mkdir(parents=True)
+            folders.mkdir(parents=True, exist_ok=True)
 
-        file = folders / filename
+        target = _DownloadTarget(binary['url'], bucket, key, folders / filename, binary.get('md5'))
 
-        self._storage.download(bucket, key, file)
+        if target.md5 and target.file.exists() and _calc_md5_(target.file)[0] == target.md5:
+            LOGGER.info("Already downloaded %s", target.file)
+            target.done = True
+            return target
 
-    def search(self, branch_name=None, app_name=None):
-        from jsonpath_ng.jsonpath import Fields, Slice
+        # download into a temp name and resume it if it's left by a failed run
+        target.from_cache = cache is not None and target.md5 and cache.fetch(target.md5, target.part)
 
-        if branch_name is None:
-            branch_name = '*'
+        if target.from_cache:
+            LOGGER.info("Taken from the cache %s", target.url)
         else:
-            branch_name = slugify(branch_name)
+            target.offset = target.part.stat().st_size if target.part.exists() else 0
+            if target.offset:
+                LOGGER.info("Resuming %s from %d bytes", target.url, target.offset)
+        return target
 
-        if app_name is None: app_name = '*'
+    def _complete_download(self, target: '_DownloadTarget', cache: Optional[ArtifactCache]) -> Path:
+        if target.done:
+            return target.file
 
-        acc = []
-        for branch in parse(f'$.@ns.{branch_name}').find(self._original_content):
-            for build in Fields('@last_success').find(branch.value):
-                for app in Fields(f'@include').child(Fields(app_name)).find(build.value):
-                    acc.extend([
-                        {
-                            'branch': str(branch.path),
-                            'app': str(app.path),
-                            'built_at': str(build.value['@built_at']),
-                            'commit': str(build.value['@rev']),
-                            'url': str(bin['@ref']),
-                        } for bin in app.value.get('@binaries', []) if '@ref' in bin
-                    ])
-
-        sorted(acc, key=lambda d: (d['branch'], d['app']))
+        if target.md5 and _calc_md5_(target.part)[0] != target.md5:
+            target.part.unlink()
+            if target.from_cache:
+                cache.discard(target.md5)
+            raise IOError(f"md5 of downloaded {target.url} doesn't match {target.md5}")
+
+        if cache is not None and target.md5 and not target.from_cache:
+            cache.store(target.md5, target.part)
+
+        os.replace(str(target.part), str(target.file))
+        return target.file
 
+    def _split_url(self, url: str) -> Tuple[str, str]:
+        """
+        :return: (bucket, key) of a referenced object
+        """
+        root = object_url(self._bucket, '')
+        if url.startswith(root):
+            return self._bucket, url[len(root):]
+
+        parsed = urlparse(url)
+        if parsed.scheme == 'file':
+            # the root of a foreign local bucket is unknown, the key is relative to the file system root
+            return 'file:///', parsed.path.lstrip('/')
+        return parsed.netloc, parsed.path.lstrip('/')
+
+    def search(self, branch_name=None, app_name=None, with_md5=False):
+        """
+        Binaries of the last successful builds sorted by branch and app.
+        With the sharded layout only shards of matching branches are fetched.
+
+        :param branch_name: branch name or pattern (`feature-*`, `release-?.?`), all branches if None
+        :param app_name: app name or pattern, all apps if None
+        :param with_md5: include md5 of binaries, `download` verifies files and uses the cache by it
+        """
+        if branch_name is not None:
+            branch_name = slugify_pattern(branch_name)
+
+        if self.layout != MANIFEST_LAYOUT_SHARDED:
+            if self._index is None:
+                self._index = ManifestIndex(self._original_content)
+            return self._index.lookup(branch_name, app_name, with_md5)
+
+        branches = select(branch_name, self.branches)
+        missing = [b for b in branches if b not in self._shard_indexes]
+        with ThreadPoolExecutor(max_workers=max(1, min(DEFAULT_PARALLELISM, len(missing)))) as pool:
+            for branch, (_, _, content) in zip(missing, pool.map(self._fetch_shard, missing)):
+                self._shard_indexes[branch] = ManifestIndex(content)
+
+        acc = []
+        for branch in branches:
+            acc.extend(self._shard_indexes[branch].lookup(branch, app_name, with_md5))
         return acc
 
-    def update(self, build: BuildInfo, project_obj: Project, upload: bool = True):
+    def _is_sharded(self, project_obj: Project) -> bool:
         """
-        Compare and update blob by generation.
-        Trying until success.
+        Layout of the existing manifest wins, the configured one is used for a new repository only.
+        """
+        if self.layout == MANIFEST_LAYOUT_SHARDED:
+            return True
+        if project_obj.manifest_layout != MANIFEST_LAYOUT_SHARDED:
+            return False
+        if self._original_content.get('@ns'):
+            raise RuntimeError(f'{self._blob_key} has {MANIFEST_LAYOUT_SINGLE} layout, '
+                               f'convert it first -- mfutil manifest migrate')
+        return True
+
+    def _on_conflict(self, attempt: int, max_attempts: int, key: str):
+        """
+        Count the conflict and wait before the next attempt, exponential backoff with jitter
+        keeps builds finished at the same moment from retrying in lockstep.
+        """
+        self.update_stats.conflicts += 1
+        if attempt >= max_attempts:
+            raise ManifestConflictError(f'{key} has been modified concurrently, gave up after {attempt} attempts')
+
+        delay = backoff_delay(attempt)
+        self.update_stats.backoff_sec += delay
+        LOGGER.warning("%s have already been modified, retry in %.1fs...", key, delay)
+        time.sleep(delay)
+
+    def _register_branch(self, branch: str, project_obj: Project, max_attempts: int):
+        """
+        Add a branch into the root index of the sharded layout, the root is written for new branches only.
+        """
+        for attempt in range(1, max_attempts + 1):
+            if not self._is_sharded(project_obj):
+                return
+
+            branches = self._original_content.get('@branches', {})
+            if self.layout == MANIFEST_LAYOUT_SHARDED and branch in branches:
+                return
+
+            root = {"@spec": 1, "@layout": MANIFEST_LAYOUT_SHARDED, "@branches": dict(branches)}
+            root["@branches"][branch] = {"@manifest": shard_name(branch)}
+
+            self.update_stats.attempts += 1
+            if self._cas(self._blob_key, self._version, root):
+                self.__fetch_manifest()
+                return
+
+            self._on_conflict(attempt, max_attempts, self._blob_key)
+            self.__fetch_manifest()
+
+    def update(self, build: BuildInfo, project_obj: Project, upload: bool = True,
+               parallelism: int = DEFAULT_PARALLELISM, max_attempts: int = CAS_ATTEMPTS,
+               snapshot: Optional[BuildSnapshot] = None):
+        """
+        Compare and update blob by generation. With the sharded layout only the shard of the branch is updated.
+
+        The entry of the branch is built once from the snapshot, on a conflict it's applied to the freshly
+        fetched manifest again after a backoff, assets are never discovered, hashed or uploaded twice.
+        Counters of attempts are kept in `update_stats`.
 
         :param build: build info
         :param upload: to do uploading of a content, (for debug)
         :param project_obj:
+        :param parallelism: max number of concurrent uploads
+        :param max_attempts: max number of compare-and-set attempts
+        :param snapshot: assets of the build, captured from the project if None
+        :raises TransferError: if any asset upload failed, the manifest stays untouched
+        :raises ManifestConflictError: if the manifest was modified concurrently on every attempt
         """
 
-        refs_upload_done = False
+        sharded = self._is_sharded(project_obj)
+        branch = build.git_branch
+        if snapshot is None:
+            snapshot = BuildSnapshot.capture(project_obj)
+        entry, assets = _build_branch_entry(build, project_obj, snapshot)
 
-        while True:
-            current_manifest, assets = _merge_new_manifest(self._original_content, build, project_obj)
+        if not upload:
+            base = self._fetch_shard(branch)[2] if sharded else self._original_content
+            return _apply_branch_entry(base, branch, entry)
 
-            if not upload:
+        # Upload assets first and update manifest only after every upload has succeeded.
+        upload_assets(self._storage, project_obj.bucket, assets, parallelism=parallelism)
+
+        for attempt in range(1, max_attempts + 1):
+            if sharded and self.layout != MANIFEST_LAYOUT_SHARDED:
+                # a new repository, a concurrent writer may have published the single layout meanwhile
+                self.__fetch_manifest()
+                self._is_sharded(project_obj)
+            if sharded:
+                blob_key, version, base = self._fetch_shard(branch)
+            else:
+                blob_key, version, base = self._blob_key, self._version, self._original_content
+
+            current_manifest = _apply_branch_entry(base, branch, entry)
+
+            self.update_stats.attempts += 1
+            if self._cas(blob_key, version, current_manifest):
+                if sharded:
+                    try:
+                        self._register_branch(branch, project_obj, max_attempts)
+                    except RuntimeError:
+                        # the root is not sharded, don't leave behind a shard created by this call
+                        if version == 0:
+                            self._storage.delete_objects(self._bucket, [blob_key])
+                        raise
                 return current_manifest
 
-            # Upload assets first and update manifest only after it.
-            if not refs_upload_done:
-                refs_upload_done = True
+            self._on_conflict(attempt, max_attempts, blob_key)
+            if not sharded:
+                self.__fetch_manifest()
 
-                for key, file in assets.items():
-                    LOGGER.info("Uploading %s [%s]", file, key)
-                    self._storage.upload(project_obj.bucket, key, file.absolute())
+    def migrate(self) -> int:
+        """
+        Convert the single manifest into the sharded layout.
 
-                LOGGER.info("Uploading done for %d objects", len(assets))
+        Every branch is written into its own shard first, then the root is replaced by the index
+        of branches. The root is compare-and-set, so builds published meanwhile are migrated on retry.
 
-            manifest_json = json.dumps(current_manifest).encode('utf-8')
-            ok, err_resp = self._storage.cas_blob(data=manifest_json,
-                                                  generation=self._version,
-                                                  bucket_name=self._bucket,
-                                                  blob_name=self._blob_key)
-            if ok:
-                LOGGER.debug("new updated manifest.json \n%s", manifest_json)
-                return current_manifest
-            elif err_resp is None:
-                # TODO any logic to resolve conflict in the content ?
-                LOGGER.warning("manifest have already been modified, retry...")
+        :return: number of migrated branches, 0 if the manifest is sharded already
+        """
+        while self.layout != MANIFEST_LAYOUT_SHARDED:
+            ns = self._original_content.get('@ns', {})
+
+            for branch, value in ns.items():
+                key, generation, _ = self._storage.fetch_manifest(shard_name(branch), create=False)
+                if not self._cas(key, generation, {"@spec": 1, "@ns": {branch: value}}):
+                    raise RuntimeError(f'{key} has been modified while migrating')
+
+            root = {
+                "@spec": 1,
+                "@layout": MANIFEST_LAYOUT_SHARDED,
+                "@branches": dict((branch, {"@manifest": shard_name(branch)}) for branch in ns)
+            }
+            if self._cas(self._blob_key, self._version, root):
+                LOGGER.info("%d branches of %s migrated", len(ns), self._blob_key)
                 self.__fetch_manifest()
+                return len(ns)
+
+            LOGGER.warning("%s have already been modified, retry...", self._blob_key)
+            self.__fetch_manifest()
+
+        return 0
+
+
+def _iter_refs(value) -> Iterator[str]:
+    """
+    Every `@ref` of the manifest, wherever it's nested.
+    """
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k == '@ref' and isinstance(v, str):
+                yield v
             else:
-                LOGGER.error("update failed [%s] %s", err_resp.status_code, err_resp.text)
-                raise Exception('GoogleStorage update failed')
+                yield from _iter_refs(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _iter_refs(v)
+
+
+def shard_name(branch: str) -> str:
+    return f'{SHARDS_DIR}/{branch}.json'
 
 
-def _merge_new_manifest(original_manifest: dict, build: BuildInfo, mf_file: Project) \
-        -> Tuple[dict, Dict[str, Path]]:
+def _build_branch_entry(build: BuildInfo, mf_file: Project, snapshot: BuildSnapshot) \
+        -> Tuple[dict, Dict[str, AssetBase]]:
     """
-    Merge generated manifest about branch into fetched from remote.
+    Generate the manifest entry of the branch. It doesn't depend on the fetched manifest,
+    so it's built once and applied again on every compare-and-set attempt.
 
-    :param original_manifest: original manifest content
     :param build: build info
     :param mf_file: config file
-    :return: resulting whole manifest and assets
+    :param snapshot: assets of the build
+    :return: entry of the branch and assets by object key
     """
 
-    current_manifest = copy.deepcopy(original_manifest)
-    ns_key = '@ns'
-
-    if ns_key not in current_manifest:
-        current_manifest[ns_key] = {}
-
-    ns = current_manifest[ns_key]
-
-    assets: Dict[str, Path] = dict()
+    assets: Dict[str, AssetBase] = dict()
 
     def ref(component_name, asset: AssetBase):
-        key = f'{mf_file.repository}/{build.git_branch}/{build.git_sha}/{component_name}/{asset.filename}'
-        url = f'gs://{mf_file.bucket}/{key}'
-        path = asset.path
+        if mf_file.blob_layout == BLOB_LAYOUT_CAS:
+            key = f'{mf_file.repository}/cas/{asset.md5_hex}'
+        else:
+            key = f'{mf_file.repository}/{build.git_branch}/{build.git_sha}/{component_name}/{asset.filename}'
+        url = object_url(mf_file.bucket, key)
 
-        LOGGER.debug("[%s] discovering asset %s", component_name, path)
+        LOGGER.debug("[%s] discovering asset %s", component_name, asset.filename)
         if key not in assets:
-            assets[key] = asset.path
+            assets[key] = asset
 
         return url
 
+    def binary(component_name, asset: AssetBase):
+        entry = {
+            "@md5": asset.md5,
+            "@ref": ref(component_name, asset)
+        }
+        if mf_file.blob_layout == BLOB_LAYOUT_CAS:
+            entry["@filename"] = asset.filename
+        return entry
+
     component_dict = dict(
         [(component.name, {
             "@type": component.type,
             "@metadata": {},
-            "@binaries": [{
-                "@md5": asset.md5,
-                "@ref": ref(component.name, asset)
-            } for asset in component.assets]
-        }) for component in mf_file.components]
+            "@binaries": [binary(component.name, asset) for asset in component.assets]
+        }) for component in snapshot.components]
     )
 
-    ns[build.git_branch] = {
+    entry = {
         "@last_success": {
             "@built_at": build.date.replace(tzinfo=datetime.timezone.utc).isoformat(),
             "@rev": build.git_sha,
@@ -319,4 +1036,26 @@ def _merge_new_manifest(original_manifest: dict, build: BuildInfo, mf_file: Proj
         }
     }
 
-    return current_manifest, assets
+    return entry, assets
+
+
+def _apply_branch_entry(original_manifest: dict, branch: str, entry: dict) -> dict:
+    """
+    Merge the entry of the branch into fetched from remote manifest.
+
+    Copy-on-write: only the top level and `@ns` mapping are copied, entries of other branches
+    and the new entry are shared with the inputs, so the result must not be modified in place.
+
+    :param original_manifest: original manifest content, stays untouched
+    :param branch: branch name
+    :param entry: entry built by `_build_branch_entry`
+    :return: resulting whole manifest
+    """
+
+    ns_key = '@ns'
+
+    current_manifest = dict(original_manifest)
+    current_manifest[ns_key] = dict(original_manifest.get(ns_key, {}))
+    current_manifest[ns_key][branch] = entry
+
+    return current_manifest
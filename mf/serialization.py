@@ -0,0 +1,91 @@
+# coding: utf-8
+
+import gzip
+import io
+import json
+import os
+
+from typing import Any, BinaryIO, Iterable, Union
+
+#
+# JSON codec: `orjson` if it's installed (pip install mfutil[fast]), stdlib `json` otherwise.
+# MF_JSON_CODEC=json env variable forces the stdlib one.
+#
+CODEC_ORJSON = 'orjson'
+CODEC_JSON = 'json'
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# rows of listings encoded and written in one chunk
+_LINES_BATCH = 1024
+
+_orjson = None
+
+
+def codec() -> str:
+    """
+    Name of the codec in use. orjson is imported on first use, not at startup.
+    """
+    global _orjson
+
+    if os.environ.get('MF_JSON_CODEC') == CODEC_JSON:
+        return CODEC_JSON
+
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+
+    return CODEC_ORJSON if _orjson else CODEC_JSON
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Compact UTF-8 JSON. Both codecs give the same bytes for manifests (str keys, no floats).
+    """
+    if codec() == CODEC_ORJSON:
+        return _orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if codec() == CODEC_ORJSON:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+def gzip_compress(data: bytes, level: int = 6) -> bytes:
+    """
+    gzip without a timestamp, the same data always gives the same bytes.
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def gunzip_if_compressed(data: bytes) -> bytes:
+    """
+    Decompress gzip data, anything else (JSON never starts with the gzip magic) is returned as is.
+    """
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    return data
+
+
+def write_json_lines(rows: Iterable[Any], out: BinaryIO):
+    """
+    Write every row as a line of JSON. Rows are encoded by batches and written by large chunks
+    instead of a write and flush per row.
+    """
+    batch = []
+    for row in rows:
+        batch.append(dumps(row))
+        if len(batch) >= _LINES_BATCH:
+            out.write(b'\n'.join(batch) + b'\n')
+            batch = []
+    if batch:
+        out.write(b'\n'.join(batch) + b'\n')
+    out.flush()
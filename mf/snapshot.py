@@ -0,0 +1,183 @@
+# coding: utf-8
+
+import json
+import os
+import shutil
+
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+from mf.assets import AssetBase, RawAsset, compute_digests
+from mf.log import LOGGER
+
+#
+# Version of the serialized snapshot, snapshots of other versions are rejected.
+#
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotAsset(AssetBase):
+    """
+    Immutable record of an asset: digests, size and the file it's read from.
+
+    Files of the workspace are referenced by path and checked for changes (size and mtime) before they are read.
+    Archives built in memory keep their source asset until the snapshot is written out.
+    """
+
+    def __init__(self, filename: str, md5: str, md5_hex: str, size: int, crc32c: Optional[str] = None,
+                 path: Optional[str] = None, mtime_ns: Optional[int] = None, source: Optional[AssetBase] = None):
+        super().__init__()
+        self._filename = filename
+        self._md5 = md5
+        self._md5_hex = md5_hex
+        self._size = size
+        self._crc32c = crc32c
+        self._path = path
+        self._mtime_ns = mtime_ns
+        self._source = source
+
+    @classmethod
+    def of(cls, asset: AssetBase) -> 'SnapshotAsset':
+        if isinstance(asset, RawAsset):
+            st = asset.path.stat()
+            return cls(asset.filename, asset.md5, asset.md5_hex, st.st_size, asset.crc32c,
+                       path=str(asset.path.absolute()), mtime_ns=st.st_mtime_ns)
+        # archives may live in memory only, their content is taken from the source
+        return cls(asset.filename, asset.md5, asset.md5_hex, asset.size, asset.crc32c, source=asset)
+
+    @property
+    def md5(self) -> str:
+        return self._md5
+
+    @property
+    def md5_hex(self) -> str:
+        return self._md5_hex
+
+    @property
+    def filename(self) -> str:
+        return self._filename
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def crc32c(self) -> Optional[str]:
+        return self._crc32c
+
+    @property
+    def path(self) -> Path:
+        return Path(self._path) if self._source is None else self._source.path
+
+    def open(self) -> BinaryIO:
+        if self._source is not None:
+            return self._source.open()
+
+        f = open(self._path, 'rb')
+        st = os.fstat(f.fileno())
+        if st.st_size != self._size or (self._mtime_ns is not None and st.st_mtime_ns != self._mtime_ns):
+            f.close()
+            raise RuntimeError(f'{self._path} has been changed since the snapshot')
+        return f
+
+    def _materialize(self, directory: Path) -> 'SnapshotAsset':
+        """
+        Copy of the record which refers to a file, archives are written into the directory.
+        """
+        if self._source is None:
+            return self
+
+        target = directory / self._filename
+        with self._source.open() as src, open(str(target), 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        st = target.stat()
+        return SnapshotAsset(self._filename, self._md5, self._md5_hex, st.st_size, self._crc32c,
+                             path=str(target.absolute()), mtime_ns=st.st_mtime_ns)
+
+    def to_json(self) -> dict:
+        return {
+            'filename': self._filename,
+            'md5': self._md5,
+            'md5_hex': self._md5_hex,
+            'size': self._size,
+            'crc32c': self._crc32c,
+            'path': self._path,
+            'mtime_ns': self._mtime_ns,
+        }
+
+    @classmethod
+    def from_json(cls, json_: dict) -> 'SnapshotAsset':
+        return cls(json_['filename'], json_['md5'], json_['md5_hex'], json_['size'], json_.get('crc32c'),
+                   path=json_['path'], mtime_ns=json_.get('mtime_ns'))
+
+
+class SnapshotComponent:
+
+    def __init__(self, name: str, type_: str, assets: Iterable[SnapshotAsset]):
+        self.name = name
+        self.type = type_
+        self.assets: Tuple[SnapshotAsset, ...] = tuple(assets)
+
+
+class BuildSnapshot:
+    """
+    Assets of all components with their digests, captured once per `builds put`.
+
+    Every compare-and-set attempt and the upload use the same snapshot, so files are discovered, hashed
+    and archived once. A snapshot can be written out (`put --no-upload --snapshot`) and uploaded
+    later by another step (`put --from-snapshot`) without discovering the assets again.
+    """
+
+    def __init__(self, components: Iterable[SnapshotComponent]):
+        self._components: Tuple[SnapshotComponent, ...] = tuple(components)
+
+    @property
+    def components(self) -> Tuple[SnapshotComponent, ...]:
+        return self._components
+
+    @classmethod
+    def capture(cls, project) -> 'BuildSnapshot':
+        """
+        Discover and hash assets of all components of the project.
+
+        :param project: mf.config.Project
+        """
+        components = [(component, list(component.assets)) for component in project.components]
+        compute_digests(asset for _, component_assets in components for asset in component_assets)
+
+        return cls(SnapshotComponent(component.name, component.type, [SnapshotAsset.of(a) for a in component_assets])
+                   for component, component_assets in components)
+
+    def dump(self, file: Path):
+        """
+        Write the snapshot as JSON. Archives built in memory are written next to it, so the snapshot
+        outlives temp files of the process.
+        """
+        file.parent.mkdir(parents=True, exist_ok=True)
+
+        components: List[SnapshotComponent] = [
+            SnapshotComponent(c.name, c.type, [a._materialize(file.parent) for a in c.assets])
+            for c in self._components
+        ]
+        json_ = {
+            '@version': SNAPSHOT_VERSION,
+            'components': [{
+                'name': c.name,
+                'type': c.type,
+                'assets': [a.to_json() for a in c.assets]
+            } for c in components]
+        }
+
+        tmp = file.with_name(file.name + '.tmp')
+        tmp.write_text(json.dumps(json_, indent=2), encoding='utf-8')
+        os.replace(str(tmp), str(file))
+        LOGGER.info("Snapshot of %d assets written into %s", sum(len(c.assets) for c in components), file)
+
+    @classmethod
+    def load(cls, file: Path) -> 'BuildSnapshot':
+        json_ = json.loads(file.read_text(encoding='utf-8'))
+        if json_.get('@version') != SNAPSHOT_VERSION:
+            raise ValueError(f'{file} has unsupported snapshot version {json_.get("@version")}')
+
+        return cls(SnapshotComponent(c['name'], c['type'], [SnapshotAsset.from_json(a) for a in c['assets']])
+                   for c in json_['components'])
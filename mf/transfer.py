@@ -0,0 +1,258 @@
+# coding: utf-8
+
+import os
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple
+
+from mf.assets import AssetBase
+from mf.log import LOGGER
+
+#
+# Default number of concurrent transfers.
+# Can be overridden by --parallelism option or MF_PARALLELISM env variable.
+#
+DEFAULT_PARALLELISM = 8
+
+#
+# Attempts to download a file, every next attempt resumes the partially downloaded file.
+#
+DOWNLOAD_ATTEMPTS = 3
+
+#
+# Files larger than this are uploaded by parts in parallel and composed into one object by GCS.
+# Can be overridden by MF_COMPOSITE_UPLOAD_THRESHOLD env variable, 0 disables composite uploads.
+#
+COMPOSITE_UPLOAD_THRESHOLD = int(os.environ.get('MF_COMPOSITE_UPLOAD_THRESHOLD', 150 * 1024 * 1024))
+
+#
+# Size of one part of a composite upload, increased for files which don't fit into COMPOSITE_MAX_PARTS.
+#
+COMPOSITE_PART_SIZE = 64 * 1024 * 1024
+
+#
+# Max number of sources of one GCS compose request.
+# see: https://cloud.google.com/storage/docs/composite-objects
+#
+COMPOSITE_MAX_PARTS = 32
+
+#
+# Number of parts of one file uploaded concurrently.
+#
+COMPOSITE_PARALLELISM = 4
+
+#
+# Attempts to upload one part of a composite upload, only the failed part is uploaded again.
+#
+UPLOAD_PART_ATTEMPTS = 3
+
+
+class TransferError(Exception):
+    """
+    One or more transfers failed. Keeps every per-file error as (key, exception) pairs.
+    """
+
+    def __init__(self, errors: List[Tuple[str, Exception]]):
+        self.errors = errors
+        super().__init__('%d transfer(s) failed: %s' % (len(errors), ', '.join(key for key, _ in errors)))
+
+
+def upload_assets(storage, bucket: str, assets: Dict[str, AssetBase], parallelism: int = DEFAULT_PARALLELISM):
+    """
+    Upload assets by a bounded pool of workers.
+
+    Assets which already exist by the same key with the same md5 are skipped, their objects are touched
+    so `builds gc` doesn't delete them before the manifest references them.
+    The largest files are scheduled first, so the longest transfer doesn't start last.
+    A failed upload doesn't stop others, all errors are collected and raised at the end.
+
+    :param storage: storage to upload into
+    :param bucket: target bucket
+    :param assets: key -> asset
+    :param parallelism: max number of concurrent uploads
+    :raises TransferError: if any upload failed
+    """
+    remote_md5s = storage.fetch_md5s(bucket, assets.keys())
+    pending = dict((key, asset) for key, asset in assets.items() if remote_md5s.get(key) != asset.md5)
+
+    if len(pending) < len(assets):
+        LOGGER.info("Skipping %d objects, already uploaded with the same md5", len(assets) - len(pending))
+        for key in storage.touch_objects(bucket, [key for key in assets if key not in pending]):
+            LOGGER.warning("%s has been deleted meanwhile, uploading again", key)
+            pending[key] = assets[key]
+
+    ordered = sorted(pending.items(), key=lambda kv: kv[1].size, reverse=True)
+
+    def _upload(key, asset: AssetBase):
+        LOGGER.info("Uploading %s [%s]", asset.filename, key)
+        with asset.open() as source:
+            storage.upload(bucket, key, source, md5=asset.md5, crc32c=asset.crc32c)
+
+    async def _upload_async(key, asset: AssetBase):
+        LOGGER.info("Uploading %s [%s]", asset.filename, key)
+        with asset.open() as source:
+            await storage.upload_async(bucket, key, source, md5=asset.md5, crc32c=asset.crc32c)
+
+    if getattr(storage, 'is_async', False):
+        storage.run(_run_all_async(ordered, _upload_async, parallelism, 'Uploading'))
+    else:
+        _run_all(ordered, _upload, parallelism, 'Uploading')
+    LOGGER.info("Uploading done for %d objects", len(pending))
+
+
+def download_binaries(manifest, binaries: List[dict], dest, parallelism: int = DEFAULT_PARALLELISM,
+                      attempts: int = DOWNLOAD_ATTEMPTS, cache=None):
+    """
+    Download binaries found by `Manifest.search` by a bounded pool of workers.
+
+    Every download is retried with a backoff, each retry resumes the partially downloaded file.
+    A failed download doesn't stop others, all errors are collected and raised at the end.
+
+    :param manifest: manifest to download with
+    :param binaries: rows of `Manifest.search`
+    :param dest: destination directory
+    :param parallelism: max number of concurrent downloads
+    :param attempts: max number of attempts for one file
+    :param cache: optional shared local cache, see `mf.cache.ArtifactCache`
+    :raises TransferError: if any download failed
+    """
+    # one writer per destination file
+    targets = dict()
+    for binary in binaries:
+        targets.setdefault((binary['branch'], binary['app'], binary.get('filename') or binary['url']), binary)
+
+    def _download(url, binary):
+        for attempt in range(1, attempts + 1):
+            try:
+                LOGGER.info("Downloading... %s", url)
+                return manifest.download(binary, dest=dest, cache=cache)
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                LOGGER.warning("Downloading %s failed (%s), retry in %.1fs", url, e, delay)
+                time.sleep(delay)
+
+    async def _download_async(url, binary):
+        import asyncio
+
+        for attempt in range(1, attempts + 1):
+            try:
+                LOGGER.info("Downloading... %s", url)
+                return await manifest.download_async(binary, dest=dest, cache=cache)
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                LOGGER.warning("Downloading %s failed (%s), retry in %.1fs", url, e, delay)
+                await asyncio.sleep(delay)
+
+    jobs = [(b['url'], b) for b in targets.values()]
+    try:
+        if getattr(manifest.storage, 'is_async', False):
+            manifest.storage.run(_run_all_async(jobs, _download_async, parallelism, 'Downloading'))
+        else:
+            _run_all(jobs, _download, parallelism, 'Downloading')
+    finally:
+        if cache is not None:
+            cache.evict()
+    LOGGER.info("Downloading done for %d objects", len(targets))
+
+
+def split_parts(size: int, part_size: int = COMPOSITE_PART_SIZE,
+                max_parts: int = COMPOSITE_MAX_PARTS) -> List[Tuple[int, int]]:
+    """
+    Split a file into (offset, length) parts of `part_size` bytes, at most `max_parts` of them.
+    """
+    part_size = max(part_size, -(-size // max_parts), 1)
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+
+class FileSlice:
+    """
+    Read-only seekable stream of `length` bytes of a file from `offset`, a part of a composite upload.
+    Every part opens its own file, so parts are read concurrently.
+    """
+
+    def __init__(self, path, offset: int, length: int):
+        self._fp = open(str(path), 'rb')
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+        self._fp.seek(offset)
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._length - self._pos
+        data = self._fp.read(remaining if size is None or size < 0 else min(size, remaining))
+        self._pos += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self._length
+        self._pos = max(0, min(pos, self._length))
+        self._fp.seek(self._offset + self._pos)
+        return self._pos
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Exponential backoff with full jitter for the given attempt (starting from 1).
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _run_all(jobs: List[Tuple[str, object]], fn: Callable, parallelism: int, action: str):
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as pool:
+        futures = dict((pool.submit(fn, key, item), key) for key, item in jobs)
+
+        for future in as_completed(futures):
+            key = futures[future]
+            error = future.exception()
+            if error is not None:
+                LOGGER.error("%s failed [%s] %s", action, key, error)
+                errors.append((key, error))
+
+    if errors:
+        raise TransferError(errors)
+
+
+async def _run_all_async(jobs: List[Tuple[str, object]], fn: Callable, parallelism: int, action: str):
+    """
+    `_run_all` for coroutines: every job is a task of the running event loop, at most `parallelism` run at once.
+    """
+    import asyncio
+
+    slots = asyncio.Semaphore(max(1, parallelism))
+
+    async def _run(key, item):
+        async with slots:
+            return await fn(key, item)
+
+    results = await asyncio.gather(*[_run(key, item) for key, item in jobs], return_exceptions=True)
+
+    errors = []
+    for (key, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            LOGGER.error("%s failed [%s] %s", action, key, result)
+            errors.append((key, result))
+
+    if errors:
+        raise TransferError(errors)
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+from collections.abc import Mapping, Sequence
+
+
+def read_only(value):
+    """
+    Read-only view of a JSON value. Nested dicts and lists are wrapped lazily on access,
+    so a view of a manifest of any size costs O(1) and shares the data with it.
+    """
+    if isinstance(value, dict):
+        return ReadOnlyDict(value)
+    if isinstance(value, list):
+        return ReadOnlyList(value)
+    return value
+
+
+class ReadOnlyDict(Mapping):
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        return read_only(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'ReadOnlyDict({self._data!r})'
+
+    def to_dict(self) -> dict:
+        """
+        Deep copy as plain dict, e.g. to modify or to serialize it.
+        """
+        return _copy(self._data)
+
+
+class ReadOnlyList(Sequence):
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: list):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self._data[index])
+        return read_only(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ReadOnlyList)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f'ReadOnlyList({self._data!r})'
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return dict((k, _copy(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
@@ -46,8 +46,13 @@ setup(
         'python-slugify',
         'requests',
         'click==7.0',
-        'jsonpath-ng==1.4.3'
     ],
+    extras_require={
+        'crc32c': ['google-crc32c'],
+        'zstd': ['zstandard>=0.15'],
+        'fast': ['orjson'],
+        'async': ['aiohttp>=3.6'],
+    },
     entry_points={
         "console_scripts": [
             "mfutil=mf.main:main"
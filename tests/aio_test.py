@@ -0,0 +1,264 @@
+# coding: utf-8
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import tempfile
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+from mf.config import BuildInfo, Project
+from mf.manifest import Manifest, TOUCHED_KEY
+from mf.transfer import download_binaries
+
+try:
+    from aiohttp import web
+    from mf.aio import AsyncStorageGCS
+except ImportError:  # optional, pip install mfutil[async]
+    web = None
+
+
+class GCSServerMock:
+    """
+    Subset of GCS JSON API: bucket metadata, object metadata, media, patches and deletes, listing by pages of
+    `page_size`, media and multipart uploads with `x-goog-if-generation-match`.
+    Every response is delayed as by a network round-trip.
+    """
+
+    page_size = 1000
+
+    def __init__(self):
+        self.objects = dict()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.patched = []
+
+    def app(self) -> 'web.Application':
+        app = web.Application()
+        app.router.add_get('/storage/v1/b/{bucket}', self._counted(self._bucket))
+        app.router.add_get('/storage/v1/b/{bucket}/o', self._counted(self._list))
+        app.router.add_get('/storage/v1/b/{bucket}/o/{key:.+}', self._counted(self._get))
+        app.router.add_delete('/storage/v1/b/{bucket}/o/{key:.+}', self._counted(self._delete))
+        app.router.add_patch('/storage/v1/b/{bucket}/o/{key:.+}', self._counted(self._patch))
+        app.router.add_post('/upload/storage/v1/b/{bucket}/o', self._counted(self._upload))
+        return app
+
+    def _counted(self, handler):
+        async def _handle(request):
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(0.01)
+                return await handler(request)
+            finally:
+                self.in_flight -= 1
+        return _handle
+
+    async def _bucket(self, request):
+        return web.json_response({'name': request.match_info['bucket'], 'versioning': {'enabled': True}})
+
+    async def _get(self, request):
+        key = request.match_info['key']
+        if key not in self.objects:
+            return web.json_response({}, status=404)
+        generation, data = self.objects[key]
+
+        if request.query.get('alt') != 'media':
+            return web.json_response({'generation': str(generation),
+                                      'md5Hash': base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')})
+
+        if 'Range' in request.headers:
+            start = int(request.headers['Range'][len('bytes='):-1])
+            if start >= len(data):
+                return web.Response(status=416)
+            return web.Response(body=data[start:], status=206)
+        return web.Response(body=data)
+
+    async def _list(self, request):
+        keys = sorted(k for k in self.objects if k.startswith(request.query.get('prefix', '')))
+        start = int(request.query.get('pageToken', 0))
+        page = {'items': [{'name': k, 'size': str(len(self.objects[k][1])), 'updated': '2020-01-10T05:01:01.123Z'}
+                          for k in keys[start:start + self.page_size]]}
+        if start + self.page_size < len(keys):
+            page['nextPageToken'] = str(start + self.page_size)
+        return web.json_response(page)
+
+    async def _delete(self, request):
+        key = request.match_info['key']
+        if key.endswith('forbidden'):
+            return web.json_response({}, status=403)
+        if self.objects.pop(key, None) is None:
+            return web.json_response({}, status=404)
+        return web.Response(status=204)
+
+    async def _patch(self, request):
+        key = request.match_info['key']
+        if key not in self.objects:
+            return web.json_response({}, status=404)
+        self.patched.append((key, await request.json()))
+        return web.json_response({'name': key})
+
+    async def _upload(self, request):
+        body = await request.read()
+        if request.query['uploadType'] == 'multipart':
+            boundary = request.headers['Content-Type'].split('boundary=')[1].encode('utf-8')
+            meta_part, data_part = body.split(b'--' + boundary)[1:3]
+            key = json.loads(meta_part.split(b'\r\n\r\n', 1)[1])['name']
+            data = data_part.split(b'\r\n\r\n', 1)[1][:-2]
+        else:
+            key, data = request.query['name'], body
+
+        expected = request.headers.get('x-goog-if-generation-match')
+        generation = self.objects.get(key, (0, None))[0]
+        if expected is not None and int(expected) != generation:
+            return web.json_response({}, status=412)
+
+        self.objects[key] = (generation + 1, data)
+        return web.json_response({'name': key, 'generation': str(generation + 1),
+                                  'md5Hash': base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')})
+
+
+@unittest.skipIf(web is None, 'async engine needs aiohttp')
+class TestAsyncStorageGCS(unittest.TestCase):
+
+    def setUp(self):
+        self.server = GCSServerMock()
+        # the server runs on the loop of the storage
+        self.storage = AsyncStorageGCS('bucket', 'repo', pool_size=64, endpoint='http://placeholder')
+        self.storage._credentials = mock.Mock(token='token', valid=True)
+        self.runner = web.AppRunner(self.server.app())
+        self.storage.run(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.storage.run(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.storage._endpoint = f'http://127.0.0.1:{port}'
+
+    def tearDown(self):
+        self.storage.run(self.runner.cleanup())
+        self.storage.close()
+
+    def test_cas_blob(self):
+        key, generation, content = self.storage.fetch_manifest()
+        self.assertEqual(('repo/manifest.json', 1, {'@spec': 1, '@ns': {}}), (key, generation, content))
+
+        self.assertEqual((True, None), self.storage.cas_blob(b'{"@ns": {}}', 1, 'bucket', key))
+        self.assertEqual((False, None), self.storage.cas_blob(b'{"@ns": {}}', 1, 'bucket', key))
+
+        ok, _ = self.storage.cas_blob(b'\x1f\x8b', 2, 'bucket', key, content_encoding='gzip')
+        self.assertTrue(ok)
+        self.assertEqual(b'\x1f\x8b', self.server.objects[key][1])
+
+    def test_put_and_get(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for i in range(200):
+                (root / 'src' / f'file-{i:03d}.bin').parent.mkdir(exist_ok=True)
+                (root / 'src' / f'file-{i:03d}.bin').write_bytes(f'content {i}'.encode('utf-8') * 100)
+
+            p = Project({
+                'bucket': 'bucket',
+                'repository': 'repo',
+                'components': {'app': {'type': 'bin', 'assets': [{'glob': './src/*.bin'}]}}
+            }, root_dir=root)
+            b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                          build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+
+            Manifest('bucket', 'repo', storage=self.storage).update(b, p, parallelism=100)
+            self.assertEqual(201, len(self.server.objects))
+
+            m = Manifest('bucket', 'repo', storage=self.storage)
+            found = m.search(branch_name='dev', with_md5=True)
+            self.assertEqual(200, len(found))
+
+            # a partial file left by a failed run is resumed
+            part = root / 'out' / 'dev' / 'app' / 'file-000.bin.part'
+            part.parent.mkdir(parents=True)
+            part.write_bytes(b'content 0')
+
+            download_binaries(m, found, root / 'out', parallelism=100)
+            for i in range(200):
+                self.assertEqual(f'content {i}'.encode('utf-8') * 100,
+                                 (root / 'out' / 'dev' / 'app' / f'file-{i:03d}.bin').read_bytes())
+
+        # more transfers in flight than threads of the sync engine
+        self.assertGreater(self.server.max_in_flight, 8)
+
+    def test_upload_md5_mismatch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            f = Path(tmp) / 'a.bin'
+            f.write_bytes(b'data')
+            self.assertRaises(IOError, self.storage.upload, 'bucket', 'repo/a.bin', f, md5='AAAA==')
+
+        self.assertEqual({'repo/a.bin': 'jXd/OF09/siBXSD3SWAm3A=='},
+                         self.storage.fetch_md5s('bucket', ['repo/a.bin', 'repo/missing.bin']))
+
+    def test_touch_objects(self):
+        self.storage.upload('bucket', 'repo/a.bin', io.BytesIO(b'data'))
+
+        self.assertEqual(['repo/missing.bin'], self.storage.touch_objects('bucket', ['repo/a.bin', 'repo/missing.bin']))
+        self.assertEqual(['repo/a.bin'], [key for key, _ in self.server.patched])
+        self.assertIn(TOUCHED_KEY, self.server.patched[0][1]['metadata'])
+
+    def test_list_delete(self):
+        self.server.page_size = 2
+        for key in ['repo/b/2', 'repo/a/1', 'repo/c/3', 'other/x']:
+            self.server.objects[key] = (1, b'data')
+
+        listed = list(self.storage.list_objects('bucket', 'repo/'))
+        self.assertEqual(['repo/a/1', 'repo/b/2', 'repo/c/3'], [o.key for o in listed])
+        self.assertEqual((4, datetime(2020, 1, 10, 5, 1, 1, 123000, tzinfo=timezone.utc)),
+                         (listed[0].size, listed[0].updated))
+
+        self.storage.delete_objects('bucket', ['repo/a/1', 'repo/missing'])
+        self.assertEqual(['other/x', 'repo/b/2', 'repo/c/3'], sorted(self.server.objects))
+        self.assertRaises(IOError, self.storage.delete_objects, 'bucket', ['repo/b/2', 'repo/forbidden'])
+        self.assertNotIn('repo/b/2', self.server.objects)
+
+    def test_sharded_root_mismatch(self):
+        p = Project({'bucket': 'bucket', 'repository': 'repo', 'manifest': {'layout': 'sharded'}, 'components': {}})
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+        m = Manifest('bucket', 'repo', storage=self.storage)
+        cas_blob = self.storage.cas_blob
+
+        def _cas_blob(data, generation, bucket_name, blob_name, content_encoding=None):
+            # a concurrent writer publishes the single layout while the shard is written
+            self.server.objects['repo/manifest.json'] = (2, b'{"@spec": 1, "@ns": {"master": {}}}')
+            return cas_blob(data, generation, bucket_name, blob_name, content_encoding)
+
+        with mock.patch.object(self.storage, 'cas_blob', side_effect=_cas_blob):
+            self.assertRaises(RuntimeError, m.update, b, p)
+
+        # the shard written by the failed update is deleted
+        self.assertEqual(['repo/manifest.json'], list(self.server.objects))
+
+    def test_download_writes_off_loop(self):
+        writes = []
+
+        class _Executor(ThreadPoolExecutor):
+            def submit(self, fn, *args, **kwargs):
+                writes.append(getattr(fn, '__name__', fn))
+                return super().submit(fn, *args, **kwargs)
+
+        self.storage._loop.call_soon_threadsafe(self.storage._loop.set_default_executor, _Executor())
+        self.server.objects['repo/a.bin'] = (1, b'x' * (3 * 1024 * 1024))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            f = Path(tmp) / 'a.bin'
+            self.storage.download('bucket', 'repo/a.bin', f)
+            self.assertEqual(3 * 1024 * 1024, f.stat().st_size)
+
+        self.assertEqual(['open', 'close'], [writes[0], writes[-1]])
+        self.assertIn('write', writes)
+
+
+if __name__ == '__main__':
+    unittest.main()
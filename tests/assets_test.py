@@ -1,10 +1,19 @@
 # coding: utf-8
 
+import io
+import struct
+import tarfile
 import unittest
+import zipfile
+import zlib
 
 
 from pathlib import Path
-from mf.assets import ComponentBase
+from unittest import mock
+
+import mf.assets
+from mf.archive import write_archive
+from mf.assets import ComponentBase, RawAsset, ZipAsset, compute_digests, cleanup_temp_files, _calc_md5_
 
 class TestComponentBase(unittest.TestCase):
 
@@ -62,8 +71,103 @@ class TestComponentBase(unittest.TestCase):
 
         asset = assets[0]
 
-        self.assertEqual('eca250db839ef52ec31316c987c439ff.zip', asset.filename)
-        self.assertEqual('7KJQ24Oe9S7DExbJh8Q5/w==', asset.md5)
+        # archives are reproducible: the digest doesn't depend on timestamps or permissions of files
+        self.assertEqual('3d65e6e5f5be6775bd6e2ec51b40df4a.zip', asset.filename)
+        self.assertEqual('PWXm5fW+Z3W9bi7FG0DfSg==', asset.md5)
+
+    def test_assets_zip_digests_written(self):
+        c = ComponentBase('spark-app', {
+            'type': 'someType',
+            'assets': [{'glob': './**/test_dir/**/*.ini', 'zip': True}]
+        }, Path('.').absolute())
+
+        asset = list(c.assets)[0]
+
+        self.assertEqual(_calc_md5_(asset.path), (asset.md5, asset.md5_hex))
+        self.assertEqual(f'{asset.md5_hex}.zip', asset.filename)
+
+    def test_assets_archive_formats(self):
+        dir = Path(__file__).absolute().parent
+
+        for archive, suffix in [('zip-deflate', '.zip'), ('tar.gz', '.tar.gz')]:
+            c = ComponentBase('spark-app', {
+                'type': 'someType',
+                'assets': [{'glob': './test_dir/**/*.*', 'archive': archive, 'level': 9}]
+            }, dir)
+
+            asset = list(c.assets)[0]
+            self.assertEqual(f'{asset.md5_hex}{suffix}', asset.filename)
+
+            if archive == 'tar.gz':
+                with tarfile.open(asset.path) as tar:
+                    names = tar.getnames()
+            else:
+                with zipfile.ZipFile(asset.path) as zf:
+                    self.assertIsNone(zf.testzip())
+                    names = zf.namelist()
+
+            self.assertEqual(['baz.ini', 'file_a.txt', 'file_b.txt', 'file_q.txt',
+                              'sub-dir-1/foo.ini', 'sub-dir-2/bar.ini', 'test_file.cfg'], names)
+
+    def test_archive_level_out_of_range(self):
+        out = io.BytesIO()
+        members = [('a.txt', Path(__file__).absolute().parent / 'test_dir' / 'file_a.txt')]
+        self.assertRaises(ValueError, write_archive, 'zip-deflate', members, out, level=15)
+        self.assertRaises(ValueError, write_archive, 'tar.gz', [], out, level=-1)
+        self.assertEqual(b'', out.getvalue())
+
+    def test_zip_stored_large_members(self):
+        dir = Path(__file__).absolute().parent / 'test_dir'
+        members = [(p.name, p) for p in sorted(dir.glob('*.txt'))]
+
+        for spool_max_size in [1024, 0]:
+            out = io.BytesIO()
+            # members larger than the spool are not read ahead into memory
+            with mock.patch('mf.archive._SPOOL_MAX_SIZE', spool_max_size):
+                write_archive('zip-stored', members, out)
+
+            # read as a streaming reader does: sizes and CRC come from local headers, no data descriptors
+            data = out.getvalue()
+            offset, read = 0, []
+            while data[offset:offset + 4] == b'PK\003\004':
+                _, _, _, flags, method, _, _, crc, compressed_size, size, name_len, extra_len = \
+                    struct.unpack('<4s2B4HL2L2H', data[offset:offset + 30])
+                self.assertEqual((0, 0), (flags & 0x08, method))
+                offset += 30 + name_len + extra_len
+                content = data[offset:offset + compressed_size]
+                self.assertEqual((size, crc), (len(content), zlib.crc32(content)))
+                read.append(content)
+                offset += compressed_size
+
+            self.assertEqual([p.read_bytes() for _, p in members], read)
+
+    def test_zip_spool(self):
+        files = list((Path(__file__).absolute().parent / 'test_dir').glob('*.txt'))
+
+        small = ZipAsset(files)
+        with small.open() as f:
+            self.assertEqual(small.size, len(f.read()))
+        self.assertIsNone(small.__tarball__._path, 'small archive has to stay in memory')
+
+        with mock.patch.object(mf.assets, 'SPOOL_MAX_SIZE', 10):
+            large = ZipAsset(files)
+            self.assertEqual(small.md5, large.md5)
+
+        path = large.__tarball__._path
+        self.assertTrue(path.exists())
+        with large.open() as f:
+            self.assertEqual(path.read_bytes(), f.read())
+
+        cleanup_temp_files()
+        self.assertFalse(path.exists())
+
+    def test_compute_digests(self):
+        files = sorted((Path(__file__).absolute().parent / 'test_dir').glob('**/*.*'))
+        assets = [RawAsset(f) for f in files]
+
+        compute_digests(assets, workers=4)
+
+        self.assertEqual([_calc_md5_(f, chunk_size=1) for f in files], [(a.md5, a.md5_hex) for a in assets])
 
 
 if __name__ == '__main__':
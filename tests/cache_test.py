@@ -0,0 +1,123 @@
+# coding: utf-8
+
+import os
+import tempfile
+import time
+import unittest
+
+from pathlib import Path
+
+from mf.assets import RawAsset, _calc_md5_
+from mf.cache import HashCache, ArtifactCache, ManifestCache
+
+
+class TestHashCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmp.name)
+        self.file = self.dir / 'app.jar'
+        self.file.write_bytes(b'content')
+        # the file has to look old enough to be cached
+        past = time.time() - 60
+        os.utime(str(self.file), (past, past))
+
+        self.calls = []
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _compute(self, path):
+        self.calls.append(path)
+        return _calc_md5_(path)
+
+    def test_hit(self):
+        with HashCache(self.dir / 'cache') as cache:
+            first = cache.digests(self.file, self._compute)
+
+        with HashCache(self.dir / 'cache') as cache:
+            second = cache.digests(self.file, self._compute)
+            self.assertEqual(second, RawAsset(self.file, hash_cache=cache)._md5_)
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(self.calls))
+
+    def test_changed_file(self):
+        with HashCache(self.dir / 'cache') as cache:
+            cache.digests(self.file, self._compute)
+
+            self.file.write_bytes(b'another content')
+            digests = cache.digests(self.file, self._compute)
+
+        self.assertEqual(_calc_md5_(self.file), digests)
+        self.assertEqual(2, len(self.calls))
+
+    def test_eviction(self):
+        with HashCache(self.dir / 'cache') as cache:
+            cache.digests(self.file, self._compute)
+
+        with HashCache(self.dir / 'cache', max_age=-1):
+            pass
+
+        with HashCache(self.dir / 'cache') as cache:
+            cache.digests(self.file, self._compute)
+
+        self.assertEqual(2, len(self.calls))
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    def test_store_fetch_evict(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            cache = ArtifactCache(tmp / 'cache', max_size=15)
+
+            files = []
+            for i, name in enumerate(['a', 'b']):
+                f = tmp / name
+                f.write_bytes(name.encode() * 10)
+                md5 = _calc_md5_(f)[0]
+                # make 'a' the least recently used one
+                cache.store(md5, f)
+                os.utime(str(cache._used_path(md5)), (i, i))
+                files.append((f, md5))
+
+            # nothing is evicted by store, both files are used by the current download
+            self.assertTrue(cache._path(files[0][1]).exists())
+            cache.evict()
+
+            self.assertFalse(cache.fetch(files[0][1], tmp / 'a.restored'))
+            self.assertFalse(cache._used_path(files[0][1]).exists())
+
+            # recency is recorded by the sidecar, linked destinations keep their mtime
+            mtime = os.stat(str(files[1][0])).st_mtime_ns
+            os.utime(str(files[1][0]), ns=(mtime - 10 ** 9, mtime - 10 ** 9))
+            self.assertTrue(cache.fetch(files[1][1], tmp / 'b.restored'))
+            self.assertEqual(b'b' * 10, (tmp / 'b.restored').read_bytes())
+            self.assertEqual(mtime - 10 ** 9, os.stat(str(files[1][0])).st_mtime_ns)
+
+
+class TestManifestCache(unittest.TestCase):
+
+    def test_generation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            content = {'@spec': 1, '@ns': {'dev': {'@last_success': {'@rev': '111111'}}}}
+            ManifestCache(Path(tmp)).put('bucket', 'repo/manifest.json', 5, content)
+
+            # a new instance reads the file, not the in-memory copy
+            cache = ManifestCache(Path(tmp))
+            self.assertEqual(content, cache.get('bucket', 'repo/manifest.json', 5))
+            self.assertIsNone(cache.get('bucket', 'repo/manifest.json', 6))
+            self.assertIsNone(cache.get('bucket', 'other/manifest.json', 5))
+
+    def test_broken_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ManifestCache(Path(tmp)).put('bucket', 'repo/manifest.json', 5, {'@ns': {}})
+            for f in Path(tmp).iterdir():
+                f.write_bytes(f.read_bytes()[:3])
+
+            self.assertIsNone(ManifestCache(Path(tmp)).get('bucket', 'repo/manifest.json', 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -61,6 +61,23 @@ class TestComponentBase(unittest.TestCase):
 
             self.assertEqual(len(p.components), 1)
 
+    def test_read_manifest_level_of_format(self):
+        def _config(archive, level):
+            return json.dumps({
+                'bucket': 'a_bucket',
+                'repository': 'a_repo',
+                'components': {
+                    'app': {'type': 'a_type', 'assets': [{'glob': '*.txt', 'archive': archive, 'level': level}]}
+                }
+            })
+
+        read_config(root=None, mf_file=_config('tar.zst', 22))
+        read_config(root=None, mf_file=_config('zip-deflate', 9))
+
+        with self.assertRaises(jsonschema.exceptions.ValidationError) as ctx:
+            read_config(root=None, mf_file=_config('zip-deflate', 15))
+        self.assertIn('component app, asset *.txt', str(ctx.exception))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,56 @@
+# coding: utf-8
+
+import tempfile
+import unittest
+import warnings
+
+from pathlib import Path
+
+from mf.discovery import discover
+
+TEST_ROOT = Path(__file__).absolute().parent
+
+
+class TestDiscover(unittest.TestCase):
+
+    def test_same_as_glob(self):
+        patterns = ['./**/test_dir/*.txt', './test_dir/**/*.ini', 'test_dir/sub-dir-?/*', './**/file_[!a]*']
+
+        found = discover(TEST_ROOT, [(p, []) for p in patterns])
+
+        for pattern, files in zip(patterns, found):
+            self.assertEqual(sorted(TEST_ROOT.glob(pattern)), files, pattern)
+
+    def test_literal(self):
+        found = discover(TEST_ROOT, [('./test_dir/file_q.txt', []), ('./test_dir/missing.txt', [])])
+
+        self.assertEqual([[TEST_ROOT / 'test_dir' / 'file_q.txt'], []], found)
+
+    def test_exclude_and_ignore_dirs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for f in ['app/main.js', 'app/main.test.js', 'node_modules/lib/index.js', '.git/hooks/x.js']:
+                (root / f).parent.mkdir(parents=True, exist_ok=True)
+                (root / f).write_text(f)
+
+            found = discover(root, [('**/*.js', ['**/*.test.js']), ('**/*.js', [])], ignore_dirs=['node_modules'])
+
+            self.assertEqual([[root / 'app' / 'main.js'],
+                              [root / 'app' / 'main.js', root / 'app' / 'main.test.js']], found)
+
+    def test_brackets_in_class(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for f in ['[x].txt', 'x.txt', '&.txt', '|.txt', 'a.txt']:
+                (root / f).write_text(f)
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                found = discover(root, [('[[]x].txt', []), ('[&|].txt', []), ('[!&|[].txt', [])])
+
+            self.assertEqual([[root / '[x].txt'], [root / '&.txt', root / '|.txt'], [root / 'a.txt', root / 'x.txt']],
+                             found)
+
+
+if __name__ == '__main__':
+    unittest.main()
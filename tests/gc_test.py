@@ -0,0 +1,140 @@
+# coding: utf-8
+
+import datetime
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+from mf.assets import RawAsset
+from mf.gc import collect_garbage
+from mf.local import StorageLocal
+from mf.manifest import Manifest, StorageBase, StoredObject, MANIFEST_NAME
+from mf.transfer import TransferError, upload_assets
+
+NOW = datetime.datetime(2020, 1, 10, tzinfo=datetime.timezone.utc)
+OLD = NOW - datetime.timedelta(days=30)
+
+
+def _branch(*keys):
+    return {'@last_success': {'@include': {'app': {'@binaries': [
+        {'@md5': 'AAAA==', '@ref': f'gs://bucket/{key}'} for key in keys
+    ]}}}}
+
+
+class BucketStorageMock(StorageBase):
+    """
+    Manifests by name and a flat listing of objects, deletions are recorded by call.
+    """
+
+    def __init__(self, manifests, objects, failing=()):
+        self.manifests = manifests
+        self.objects = objects
+        self.failing = set(failing)
+        self.deleted = []
+
+    def fetch_manifest(self, name=MANIFEST_NAME, create=True):
+        return f'repo/{name}', 1, self.manifests.get(name, {'@spec': 1, '@ns': {}})
+
+    def list_objects(self, bucket, prefix):
+        for key, size, updated in self.objects:
+            if key.startswith(prefix):
+                yield StoredObject(key, size, updated)
+
+    def delete_objects(self, bucket, keys):
+        if self.failing.intersection(keys):
+            raise IOError('delete failed')
+        self.deleted.append(keys)
+
+
+class TestCollectGarbage(unittest.TestCase):
+    MANIFEST = {'@spec': 1, '@ns': {
+        'dev': _branch('repo/dev/222/app/app.jar', 'repo/cas/aaaa'),
+        'master': _branch('repo/master/111/app/app.jar', 'other/master/app.jar'),
+    }}
+    OBJECTS = [
+        ('repo/manifest.json', 10, OLD),
+        ('repo/cas/aaaa', 100, OLD),
+        ('repo/cas/bbbb', 200, OLD),
+        ('repo/dev/111/app/app.jar', 300, OLD),
+        ('repo/dev/222/app/app.jar', 400, OLD),
+        ('repo/dev/333/app/app.jar', 500, NOW - datetime.timedelta(hours=1)),
+        ('repo/master/111/app/app.jar', 600, OLD),
+        ('other/master/app.jar', 700, OLD),
+    ]
+
+    def _gc(self, storage, **kwargs):
+        manifest = Manifest(bucket='bucket', repo_name='repo', storage=storage)
+        return collect_garbage(manifest, now=NOW, **kwargs)
+
+    def test_dry_run(self):
+        storage = BucketStorageMock({MANIFEST_NAME: self.MANIFEST}, self.OBJECTS)
+
+        stats = self._gc(storage, dry_run=True)
+
+        self.assertEqual([], storage.deleted)
+        self.assertEqual((7, 4, 1, 2, 500), (stats.listed, stats.referenced, stats.recent,
+                                             stats.deleted, stats.deleted_bytes))
+
+    def test_delete_chunks(self):
+        objects = [(f'repo/dev/{i:04d}/app.jar', 1, OLD) for i in range(25)]
+        storage = BucketStorageMock({MANIFEST_NAME: self.MANIFEST}, self.OBJECTS + objects)
+
+        with mock.patch('mf.gc.GC_DELETE_CHUNK', 10):
+            stats = self._gc(storage, parallelism=2)
+
+        deleted = sorted(key for chunk in storage.deleted for key in chunk)
+        self.assertEqual(sorted(['repo/cas/bbbb', 'repo/dev/111/app/app.jar'] + [k for k, _, _ in objects]), deleted)
+        self.assertEqual([10, 10, 7], sorted((len(c) for c in storage.deleted), reverse=True))
+        self.assertEqual(27, stats.deleted)
+
+    def test_sharded_references(self):
+        storage = BucketStorageMock({
+            MANIFEST_NAME: {'@spec': 1, '@layout': 'sharded', '@branches': {
+                'dev': {'@manifest': 'manifests/dev.json'},
+                'master': {'@manifest': 'manifests/master.json'}
+            }},
+            'manifests/dev.json': {'@spec': 1, '@ns': {'dev': self.MANIFEST['@ns']['dev']}},
+            'manifests/master.json': {'@spec': 1, '@ns': {'master': self.MANIFEST['@ns']['master']}},
+        }, self.OBJECTS + [('repo/manifests/dev.json', 10, OLD)])
+
+        self._gc(storage)
+
+        self.assertEqual([['repo/cas/bbbb', 'repo/dev/111/app/app.jar']], storage.deleted)
+
+    def test_failed_chunk(self):
+        storage = BucketStorageMock({MANIFEST_NAME: self.MANIFEST}, self.OBJECTS, failing=['repo/cas/bbbb'])
+
+        self.assertRaises(TransferError, self._gc, storage)
+
+
+class TestReusedObjects(unittest.TestCase):
+
+    def test_skipped_upload_is_kept(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            bucket = f'file://{root}'
+            storage = StorageLocal(bucket, 'repo')
+
+            asset_file = root / 'app.jar'
+            asset_file.write_bytes(b'data')
+            for key in ['repo/cas/reused', 'repo/cas/unreferenced']:
+                storage.upload(bucket, key, io.BytesIO(b'data'))
+                month_ago = time.time() - 30 * 24 * 3600
+                os.utime(str(root / key), (month_ago, month_ago))
+
+            upload_assets(storage, bucket, {'repo/cas/reused': RawAsset(asset_file)})
+            # the build has not published the reused blob in the manifest yet
+            stats = collect_garbage(Manifest(bucket, 'repo', storage=storage))
+
+            self.assertEqual((1, 1), (stats.recent, stats.deleted))
+            self.assertTrue((root / 'repo' / 'cas' / 'reused').is_file())
+            self.assertFalse((root / 'repo' / 'cas' / 'unreferenced').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+import io
+import tempfile
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from mf.config import BuildInfo, Project
+from mf.local import StorageLocal
+from mf.manifest import Manifest, create_storage
+from mf.serialization import gzip_compress
+from mf.transfer import download_binaries
+
+
+class TestStorageLocal(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.bucket = f'file://{self.root}'
+        self.storage = StorageLocal(self.bucket, 'repo')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_create_storage(self):
+        self.assertIsInstance(create_storage(self.bucket, 'repo'), StorageLocal)
+        self.assertNotIsInstance(create_storage('bucket', 'repo'), StorageLocal)
+
+    def test_cas_blob(self):
+        key, generation, content = self.storage.fetch_manifest()
+        self.assertEqual(('repo/manifest.json', {'@spec': 1, '@ns': {}}), (key, content))
+
+        self.assertEqual((True, None), self.storage.cas_blob(b'{"@ns": {"a": {}}}', generation, self.bucket, key))
+        # the generation is outdated
+        self.assertEqual((False, None), self.storage.cas_blob(b'{"@ns": {"b": {}}}', generation, self.bucket, key))
+        self.assertEqual((False, None), self.storage.cas_blob(b'{}', 0, self.bucket, key))
+
+        _, new_generation, content = self.storage.fetch_manifest()
+        self.assertGreater(new_generation, generation)
+        self.assertEqual({'@ns': {'a': {}}}, content)
+
+        self.storage.cas_blob(gzip_compress(b'{"@ns": {}}'), new_generation, self.bucket, key, content_encoding='gzip')
+        self.assertEqual({'@ns': {}}, self.storage.fetch_manifest()[2])
+
+    def test_concurrent_cas(self):
+        key, generation, _ = self.storage.fetch_manifest()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda i: self.storage.cas_blob(b'{}', generation, self.bucket, key)[0],
+                                    range(16)))
+
+        self.assertEqual(1, results.count(True))
+
+    def test_missing_root(self):
+        storage = StorageLocal(f'file://{self.root}/missing', 'repo')
+        self.assertRaises(RuntimeError, storage.cas_blob, b'{}', 0, f'file://{self.root}/missing', 'repo/x')
+
+    def test_upload_download(self):
+        self.storage.upload(self.bucket, 'repo/dev/app.jar', io.BytesIO(b'0123456789'))
+        md5s = self.storage.fetch_md5s(self.bucket, ['repo/dev/app.jar', 'repo/dev/missing.jar'])
+        self.assertEqual(['repo/dev/app.jar'], list(md5s))
+
+        self.assertRaises(IOError, self.storage.upload, self.bucket, 'repo/dev/app.jar', io.BytesIO(b'x'),
+                          md5=md5s['repo/dev/app.jar'])
+        # no temp files of the object or its metadata are left behind
+        self.assertEqual(['app.jar.json'], [p.name for p in (self.root / '.mf-meta/repo/dev').iterdir()])
+
+        # replaced by other means, metadata of the previous content is not trusted
+        (self.root / 'repo/dev/app.jar').write_bytes(b'x')
+        self.assertEqual({'repo/dev/app.jar': 'ndTkYSaMgDT1yFZOFVxnpg=='},
+                         self.storage.fetch_md5s(self.bucket, ['repo/dev/app.jar']))
+        self.storage.upload(self.bucket, 'repo/dev/app.jar', io.BytesIO(b'0123456789'))
+
+        dest = self.root / 'app.jar'
+        dest.write_bytes(b'x')
+        self.storage.download(self.bucket, 'repo/dev/app.jar', dest, start=1)
+        self.assertEqual(b'x123456789', dest.read_bytes())
+
+    def test_list_delete(self):
+        for key in ['repo/b/2', 'repo/a/1', 'repo-other/x', 'repo/manifest.json']:
+            self.storage.upload(self.bucket, key, io.BytesIO(b'data'))
+
+        listed = [o.key for o in self.storage.list_objects(self.bucket, 'repo/')]
+        self.assertEqual(['repo/a/1', 'repo/b/2', 'repo/manifest.json'], listed)
+        self.assertEqual(['repo/a/1'], [o.key for o in self.storage.list_objects(self.bucket, 'repo/a')])
+
+        self.storage.delete_objects(self.bucket, ['repo/a/1', 'repo/missing'])
+        self.assertEqual(['repo/b/2', 'repo/manifest.json'],
+                         [o.key for o in self.storage.list_objects(self.bucket, 'repo/')])
+        # nothing is left of deleted objects, one lock file serves the whole bucket
+        self.assertEqual(['.lock', 'repo-other/x.json', 'repo/b/2.json', 'repo/manifest.json.json'],
+                         sorted(p.relative_to(self.root / '.mf-meta').as_posix()
+                                for p in (self.root / '.mf-meta').rglob('*') if p.is_file()))
+
+    def test_put_and_get(self):
+        p = Project({
+            'bucket': self.bucket,
+            'repository': 'repo',
+            'components': {'spark': {'type': 'some', 'assets': [{'glob': './**/test_dir/test_file.cfg'}]}}
+        })
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+
+        Manifest(self.bucket, 'repo').update(b, p)
+
+        m = Manifest(self.bucket, 'repo')
+        found = m.search(branch_name='dev', with_md5=True)
+        self.assertEqual([f'{self.bucket}/repo/dev/431refrqewr/spark/test_file.cfg'], [r['url'] for r in found])
+        self.assertEqual({'repo/dev/431refrqewr/spark/test_file.cfg'}, m.references())
+
+        download_binaries(m, found, self.root / 'out')
+        self.assertTrue((self.root / 'out' / 'dev' / 'spark' / 'test_file.cfg').is_file())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,29 @@
 # coding: utf-8
 
+import base64
+import hashlib
+import io
+import json
+import tempfile
+import uuid
 import unittest
+from contextlib import contextmanager
+from unittest import mock
 import requests
+from pathlib import Path
 from datetime import datetime, time
 from typing import Tuple, Optional
 
-from mf.manifest import Manifest, StorageBase
+from mf.cache import ManifestCache
+from mf.manifest import Manifest, StorageBase, StorageGCS, MANIFEST_NAME, ManifestConflictError, \
+    _apply_branch_entry
 from mf.config import BuildInfo, Project
+from mf.serialization import gunzip_if_compressed, gzip_compress
+
+try:
+    import google_crc32c
+except ImportError:  # optional, pip install mfutil[crc32c]
+    google_crc32c = None
 
 
 class StorageMock(StorageBase):
@@ -14,6 +31,7 @@ class StorageMock(StorageBase):
     # noinspection PyDefaultArgument
     def __init__(self, content={'@ns': {}}):
         self.content = content
+        self.downloaded = []
 
     def fetch_manifest(self) -> Tuple[str, int, dict]:
         return 'some/key/here', 100, self.content
@@ -22,8 +40,153 @@ class StorageMock(StorageBase):
         bool, Optional[requests.Response]]:
         return super().cas_blob(data, generation, bucket_name, blob_name)
 
-    def upload(self, bucket, key, file):
-        return super().upload(bucket, key, file)
+    def upload(self, bucket, key, file, md5=None, crc32c=None):
+        return super().upload(bucket, key, file, md5, crc32c)
+
+    def download(self, bucket, key, file, start=0):
+        self.downloaded.append((bucket, key, file, start))
+        Path(file).touch()
+
+
+class ObjectsStorageMock(StorageBase):
+    """
+    Manifest objects with generations, cas_blob acts as GCS if-generation-match.
+    """
+
+    def __init__(self, root=None):
+        self.objects = dict()
+        self.encodings = dict()
+        self.fetched = []
+        if root is not None:
+            self.objects[f'repo/{MANIFEST_NAME}'] = (1, root)
+
+    def fetch_manifest(self, name=MANIFEST_NAME, create=True):
+        key = f'repo/{name}'
+        self.fetched.append(key)
+        if key not in self.objects:
+            if not create:
+                return key, 0, None
+            self.objects[key] = (1, {'@spec': 1, '@ns': {}})
+        generation, content = self.objects[key]
+        return key, generation, json.loads(json.dumps(content))
+
+    def cas_blob(self, data, generation, bucket_name, blob_name, content_encoding=None):
+        if self.objects.get(blob_name, (0, None))[0] != generation:
+            return False, None
+        self.encodings[blob_name] = content_encoding
+        self.objects[blob_name] = (generation + 1, json.loads(gunzip_if_compressed(data)))
+        return True, None
+
+    def upload(self, bucket, key, file, md5=None, crc32c=None):
+        pass
+
+    def delete_objects(self, bucket, keys):
+        for key in keys:
+            self.objects.pop(key, None)
+
+
+class ConcurrentStorageMock(ObjectsStorageMock):
+    """
+    Another build publishes its branch right before each of the first `conflicts` writes.
+    """
+
+    def __init__(self, conflicts):
+        super().__init__()
+        self.conflicts = conflicts
+
+    def cas_blob(self, data, generation, bucket_name, blob_name, content_encoding=None):
+        if self.conflicts > 0:
+            other = json.dumps({'@spec': 1, '@ns': {f'other-{self.conflicts}': {}}}).encode('utf-8')
+            self.conflicts -= 1
+            super().cas_blob(other, generation, bucket_name, blob_name)
+        return super().cas_blob(data, generation, bucket_name, blob_name, content_encoding)
+
+
+class GCSClientMock:
+    """
+    Bucket with one manifest object, counts downloads of its body.
+    """
+
+    def __init__(self, content: bytes, generation: int):
+        self.name = 'bucket'
+        self.content = content
+        self.generation = generation
+        self.downloads = 0
+
+    def bucket(self, name):
+        return self
+
+    def get_blob(self, key):
+        client = self
+
+        class Blob:
+            name = key
+            bucket = client
+            generation = client.generation
+
+            def download_as_string(self, raw_download=False):
+                client.downloads += 1
+                return client.content
+
+        return Blob()
+
+
+class UploadClientMock:
+    """
+    Bucket of in-memory objects for uploads, the first upload of `flaky` keys fails.
+    """
+
+    def __init__(self, flaky=()):
+        self.objects = dict()
+        self.uploads = []
+        self.flaky = set(flaky)
+
+    def bucket(self, name):
+        return self
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def delete_blob(self, key):
+        self.objects.pop(key, None)
+
+    def blob(self, key):
+        client = self
+
+        class Blob:
+            name = key
+            metadata = None
+            content_type = None
+
+            @property
+            def crc32c(self):
+                checksum = google_crc32c.Checksum(client.objects[key])
+                return base64.b64encode(checksum.digest()).decode('utf-8')
+
+            @property
+            def md5_hash(self):
+                return base64.b64encode(hashlib.md5(client.objects[key]).digest()).decode('utf-8')
+
+            def upload_from_file(self, file, size=None, content_type=None):
+                client.uploads.append(key)
+                data = file.read(size)
+                if key in client.flaky:
+                    client.flaky.remove(key)
+                    raise IOError('connection reset')
+                client.objects[key] = data
+
+            def upload_from_filename(self, filename):
+                with open(filename, 'rb') as f:
+                    self.upload_from_file(f)
+
+            def compose(self, sources):
+                client.objects[key] = b''.join(client.objects[s.name] for s in sources)
+
+            def delete(self):
+                client.delete_blob(key)
+
+        return Blob()
 
 
 class TestComponentBase(unittest.TestCase):
@@ -136,15 +299,62 @@ class TestComponentBase(unittest.TestCase):
 
         self.assertEqual(expected, content)
 
+    def test_generate_manifest_cas_layout(self):
+        m = Manifest(bucket='BUCKET', repo_name='ARepo', storage=StorageMock())
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+
+        p = Project({
+            'bucket': 'BUCKET',
+            'repository': 'ARepo',
+            'blob_layout': 'cas',
+            'components': {
+                'spark': {
+                    'type': 'some',
+                    'assets': [
+                        {
+                            'glob': './**/test_dir/test_file.cfg'
+                        }
+                    ]
+                }
+            }
+        })
+
+        content = m.update(b, p, False)
+        binaries = content['@ns']['dev']['@last_success']['@include']['spark']['@binaries']
+
+        self.assertEqual([{
+            '@md5': '1B2M2Y8AsgTpgAmY7PhCfg==',
+            '@ref': 'gs://BUCKET/ARepo/cas/d41d8cd98f00b204e9800998ecf8427e',
+            '@filename': 'test_file.cfg'
+        }], binaries)
+
+        storage = StorageMock(content)
+        found = Manifest(bucket='BUCKET', repo_name='ARepo', storage=storage).search(branch_name='dev')
+        self.assertEqual('test_file.cfg', found[0]['filename'])
+
+        with tempfile.TemporaryDirectory() as dest:
+            Manifest(bucket='BUCKET', repo_name='ARepo', storage=storage).download(found[0], dest=dest)
+            self.assertEqual([('BUCKET', 'ARepo/cas/d41d8cd98f00b204e9800998ecf8427e',
+                               Path(dest) / 'dev' / 'spark' / 'test_file.cfg.part', 0)], storage.downloaded)
+            self.assertTrue((Path(dest) / 'dev' / 'spark' / 'test_file.cfg').exists())
+
+            # names from the manifest never point out of the destination
+            m = Manifest(bucket='BUCKET', repo_name='ARepo', storage=storage)
+            m.download(dict(found[0], filename='../../escaped.cfg'), dest=dest)
+            self.assertTrue((Path(dest) / 'dev' / 'spark' / 'escaped.cfg').exists())
+            for name in ['..', '/', 'dir/..']:
+                self.assertRaises(ValueError, m.download, dict(found[0], filename=name), dest=dest)
+
     def test_search_all(self):
 
         m = Manifest(bucket='bucket', repo_name='repo', storage=StorageMock(self.SEARCH_DATA))
         found = m.search()
         expected = [
             {'app': 'spark', 'branch': 'dev', 'commit': '111111', 'built_at': '2018-11-01T05:01:01.000001+00:00', 'url': 'gs://test_file.cfg'},
+            {'app': 'pyspark', 'branch': 'master', 'commit': '222222', 'built_at': '2019-12-01T05:01:01.000001+00:00', 'url': 'gs://main.py'},
             {'app': 'spark', 'branch': 'master', 'commit': '222222', 'built_at': '2019-12-01T05:01:01.000001+00:00', 'url': 'gs://app.jar'},
             {'app': 'spark', 'branch': 'master', 'commit': '222222', 'built_at': '2019-12-01T05:01:01.000001+00:00', 'url': 'gs://app.cfg'},
-            {'app': 'pyspark', 'branch': 'master', 'commit': '222222', 'built_at': '2019-12-01T05:01:01.000001+00:00', 'url': 'gs://main.py'},
         ]
         self.assertEqual(expected, found)
 
@@ -184,6 +394,314 @@ class TestComponentBase(unittest.TestCase):
         expected = []
         self.assertEqual(expected, found)
 
+    def test_search_patterns(self):
+
+        m = Manifest(bucket='bucket', repo_name='repo', storage=StorageMock(self.SEARCH_DATA))
+
+        self.assertEqual(['gs://main.py', 'gs://app.jar', 'gs://app.cfg'],
+                         [b['url'] for b in m.search(branch_name='ma*')])
+        self.assertEqual(['gs://main.py'], [b['url'] for b in m.search(app_name='py*')])
+        self.assertEqual(['gs://test_file.cfg', 'gs://app.jar', 'gs://app.cfg'],
+                         [b['url'] for b in m.search(app_name='?park')])
+        self.assertEqual([], m.search(branch_name='Feature/*'))
+
+        # md5 is not a listed field, downloads ask for it
+        self.assertNotIn('md5', m.search()[0])
+        self.assertEqual('AAAA==', m.search(branch_name='dev', with_md5=True)[0]['md5'])
+
+        # rows are copies, the index is not affected by callers
+        m.search()[0]['url'] = 'changed'
+        self.assertEqual('gs://test_file.cfg', m.search()[0]['url'])
+
+    def test_manifest_cache(self):
+        client = GCSClientMock(b'{"@spec": 1, "@ns": {}}', generation=1)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for generation in [1, 1, 2, 2]:
+                client.generation = generation
+                storage = StorageGCS('bucket', 'repo', cache=ManifestCache(Path(tmp)))
+                storage._client = client
+
+                m = Manifest(bucket='bucket', repo_name='repo', storage=storage)
+                self.assertEqual({"@spec": 1, "@ns": {}}, m.content)
+
+        # downloaded once per generation
+        self.assertEqual(2, client.downloads)
+
+    def test_gzip_manifest(self):
+        storage = ObjectsStorageMock()
+        p = Project({
+            'bucket': 'bucket',
+            'repository': 'repo',
+            'manifest': {'compression': 'gzip'},
+            'components': {'spark': {'type': 'some', 'assets': [{'glob': './**/test_dir/test_file.cfg'}]}}
+        })
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+
+        Manifest(bucket='bucket', repo_name='repo', storage=storage,
+                 compression=p.manifest_compression).update(b, p)
+
+        self.assertEqual('gzip', storage.encodings['repo/manifest.json'])
+        self.assertEqual(['dev'], list(storage.objects['repo/manifest.json'][1]['@ns']))
+
+    def test_read_gzip_manifest(self):
+        for body in [b'{"@spec": 1, "@ns": {}}', gzip_compress(b'{"@spec": 1, "@ns": {}}')]:
+            storage = StorageGCS('bucket', 'repo')
+            storage._client = GCSClientMock(body, generation=1)
+
+            self.assertEqual({"@spec": 1, "@ns": {}}, Manifest(bucket='bucket', repo_name='repo', storage=storage).content)
+
+    def test_resume_ranged_download(self):
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import storage as gcs
+        from google.resumable_media import DataCorruption
+        from urllib3.response import HTTPResponse
+
+        data = b'0123456789'
+        served = {'body': data}
+
+        def _get(method, url, headers=None, **kwargs):
+            start = int(headers['range'][len('bytes='):-1]) if 'range' in headers else 0
+            response = requests.Response()
+            response.status_code = 206 if start else 200
+            # GCS sends the hash of the whole object with a range too
+            response.headers['X-Goog-Hash'] = f'md5={base64.b64encode(hashlib.md5(data).digest()).decode()}'
+            response.raw = HTTPResponse(body=io.BytesIO(served['body'][start:]), preload_content=False)
+            return response
+
+        storage = StorageGCS('bucket', 'repo')
+        storage._client = gcs.Client(project='project', credentials=AnonymousCredentials(),
+                                     _http=mock.Mock(request=_get))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            f = Path(tmp) / 'app.jar'
+            f.write_bytes(b'0123')
+            storage.download('bucket', 'repo/app.jar', f, start=4)
+            self.assertEqual(data, f.read_bytes())
+
+            # a full download is still verified by the client
+            served['body'] = b'corrupted!'
+            self.assertRaises(DataCorruption, storage.download, 'bucket', 'repo/app.jar', f)
+
+    def test_cas_blob_gzip(self):
+        storage = StorageGCS('bucket', 'repo')
+        storage._credentials = mock.Mock(token='token', valid=True)
+        storage._bucket_checked = True
+        data = gzip_compress(b'{"@spec":1}')
+
+        with mock.patch('requests.post') as post:
+            post.return_value.status_code = 200
+            ok, _ = storage.cas_blob(data, 5, 'bucket', 'repo/manifest.json', content_encoding='gzip')
+
+        self.assertTrue(ok)
+        _, kwargs = post.call_args
+        self.assertEqual({'uploadType': 'multipart'}, kwargs['params'])
+        self.assertEqual('5', kwargs['headers']['x-goog-if-generation-match'])
+        self.assertTrue(kwargs['headers']['Content-Type'].startswith('multipart/related; boundary='))
+        self.assertIn(b'"contentEncoding":"gzip"', kwargs['data'])
+        self.assertIn(data, kwargs['data'])
+
+    @unittest.skipIf(google_crc32c is None, 'composite uploads need google-crc32c')
+    def test_composite_upload(self):
+        client = UploadClientMock(flaky=['repo/app.jar.parts-00000000/01'])
+        storage = StorageGCS('bucket', 'repo')
+        storage._client = client
+        storage._bucket_checked = True
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch('mf.manifest.COMPOSITE_UPLOAD_THRESHOLD', 10), \
+                mock.patch('mf.manifest.COMPOSITE_PART_SIZE', 4), \
+                mock.patch('mf.manifest.backoff_delay', return_value=0), \
+                mock.patch('uuid.uuid4', return_value=uuid.UUID(int=0)):
+            f = Path(tmp) / 'app.jar'
+            f.write_bytes(b'0123456789ab')
+            md5 = base64.b64encode(hashlib.md5(f.read_bytes()).digest()).decode('utf-8')
+
+            with open(f, 'rb') as source:
+                storage.upload('bucket', 'repo/app.jar', source, md5=md5)
+
+            # temp parts are deleted, only the failed part is uploaded again
+            self.assertEqual({'repo/app.jar': b'0123456789ab'}, client.objects)
+            self.assertEqual(4, len(client.uploads))
+            self.assertEqual(2, client.uploads.count('repo/app.jar.parts-00000000/01'))
+
+            with mock.patch('mf.manifest._calc_crc32c_', return_value='AAAAAA=='):
+                self.assertRaises(IOError, storage.upload, 'bucket', 'repo/app.jar', f)
+                # a corrupt object is not left behind
+                self.assertEqual({}, client.objects)
+
+            # small files are uploaded by one stream and verified by md5
+            self.assertRaises(IOError, storage.upload, 'bucket', 'repo/small.txt', io.BytesIO(b'xx'), md5=md5)
+
+    def test_delete_objects_batch_not_found(self):
+        from google.api_core.exceptions import Forbidden, NotFound
+
+        class BatchClientMock:
+            """
+            Like a GCS batch, a failed batch raises its first failed sub-request only.
+            """
+
+            def __init__(self):
+                self.objects = {'repo/a', 'repo/forbidden'}
+                self.batched = None
+
+            def bucket(self, name):
+                return self
+
+            @contextmanager
+            def batch(self):
+                self.batched = []
+                yield
+                errors = [e for e in map(self._delete, self.batched) if e]
+                self.batched = None
+                if errors:
+                    raise errors[0]
+
+            def delete_blob(self, key):
+                if self.batched is not None:
+                    self.batched.append(key)
+                    return
+                error = self._delete(key)
+                if error:
+                    raise error
+
+            def _delete(self, key):
+                if key == 'repo/forbidden':
+                    return Forbidden(key)
+                if key not in self.objects:
+                    return NotFound(key)
+                self.objects.remove(key)
+
+        storage = StorageGCS('bucket', 'repo')
+        storage._client = client = BatchClientMock()
+
+        # NotFound of the batch doesn't hide a failure of another key
+        self.assertRaises(Forbidden, storage.delete_objects, 'bucket', ['repo/missing', 'repo/a', 'repo/forbidden'])
+        self.assertEqual({'repo/forbidden'}, client.objects)
+
+        # objects deleted meanwhile are ignored
+        storage.delete_objects('bucket', ['repo/missing', 'repo/a'])
+
+    def test_sharded_update(self):
+        storage = ObjectsStorageMock()
+        p = Project({
+            'bucket': 'bucket',
+            'repository': 'repo',
+            'manifest': {'layout': 'sharded'},
+            'components': {'spark': {'type': 'some', 'assets': [{'glob': './**/test_dir/test_file.cfg'}]}}
+        })
+
+        for branch in ['dev', 'master', 'dev']:
+            b = BuildInfo(git_sha='431refrqewr', git_branch=branch,
+                          build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+            Manifest(bucket='bucket', repo_name='repo', storage=storage).update(b, p)
+
+        root_generation, root = storage.objects['repo/manifest.json']
+        self.assertEqual({'@spec': 1, '@layout': 'sharded', '@branches': {
+            'dev': {'@manifest': 'manifests/dev.json'},
+            'master': {'@manifest': 'manifests/master.json'}
+        }}, root)
+        # the root is written for new branches only (created, dev, master)
+        self.assertEqual(3, root_generation)
+        self.assertEqual(2, storage.objects['repo/manifests/dev.json'][0])
+        self.assertEqual(['dev'], list(storage.objects['repo/manifests/dev.json'][1]['@ns']))
+
+        storage.fetched = []
+        found = Manifest(bucket='bucket', repo_name='repo', storage=storage).search(branch_name='master')
+        self.assertEqual(['master'], [b['branch'] for b in found])
+        self.assertEqual(['repo/manifest.json', 'repo/manifests/master.json'], storage.fetched)
+
+    def test_sharded_requires_migration(self):
+        p = Project({'bucket': 'bucket', 'repository': 'repo', 'manifest': {'layout': 'sharded'}, 'components': {}})
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+
+        m = Manifest(bucket='bucket', repo_name='repo', storage=ObjectsStorageMock(self.SEARCH_DATA))
+        self.assertRaises(RuntimeError, m.update, b, p)
+
+    def test_sharded_concurrent_single_layout(self):
+        p = Project({'bucket': 'bucket', 'repository': 'repo', 'manifest': {'layout': 'sharded'}, 'components': {}})
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+        single = {'@spec': 1, '@ns': {'master': {}}}
+
+        # published before the shard is written
+        storage = ObjectsStorageMock()
+        m = Manifest(bucket='bucket', repo_name='repo', storage=storage)
+        storage.objects['repo/manifest.json'] = (2, single)
+        self.assertRaises(RuntimeError, m.update, b, p)
+        self.assertEqual(['repo/manifest.json'], list(storage.objects))
+
+        # published while the shard is written, the shard is deleted
+        class RacingStorageMock(ObjectsStorageMock):
+            def cas_blob(self, data, generation, bucket_name, blob_name, content_encoding=None):
+                self.objects['repo/manifest.json'] = (2, single)
+                return super().cas_blob(data, generation, bucket_name, blob_name, content_encoding)
+
+        storage = RacingStorageMock()
+        m = Manifest(bucket='bucket', repo_name='repo', storage=storage)
+        self.assertRaises(RuntimeError, m.update, b, p)
+        self.assertEqual(['repo/manifest.json'], list(storage.objects))
+
+    def test_migrate(self):
+        storage = ObjectsStorageMock(self.SEARCH_DATA)
+        expected = Manifest(bucket='bucket', repo_name='repo', storage=storage).search()
+
+        self.assertEqual(2, Manifest(bucket='bucket', repo_name='repo', storage=storage).migrate())
+        self.assertEqual(0, Manifest(bucket='bucket', repo_name='repo', storage=storage).migrate())
+
+        m = Manifest(bucket='bucket', repo_name='repo', storage=storage)
+        self.assertEqual('sharded', m.layout)
+        self.assertEqual(['dev', 'master'], m.branches)
+        self.assertEqual(expected, m.search())
+
+    def test_update_conflicts(self):
+        p = Project({
+            'bucket': 'bucket',
+            'repository': 'repo',
+            'components': {'spark': {'type': 'some', 'assets': [{'glob': './**/test_dir/test_file.cfg'}]}}
+        })
+        b = BuildInfo(git_sha='431refrqewr', git_branch='dev',
+                      build_id='aaaa-bbb-ccc', date=datetime(2018, 11, 1, 5, 1, 1, 1))
+
+        with mock.patch('mf.manifest.backoff_delay', return_value=0), \
+                mock.patch('mf.snapshot.compute_digests') as compute_digests:
+            storage = ConcurrentStorageMock(conflicts=2)
+            m = Manifest(bucket='bucket', repo_name='repo', storage=storage)
+            m.update(b, p)
+
+            # the entry of the branch is built once and applied on top of the concurrent change
+            self.assertEqual(1, compute_digests.call_count)
+            self.assertEqual(['dev', 'other-1'], sorted(storage.objects['repo/manifest.json'][1]['@ns']))
+            self.assertEqual((3, 2), (m.update_stats.attempts, m.update_stats.conflicts))
+
+            m = Manifest(bucket='bucket', repo_name='repo', storage=ConcurrentStorageMock(conflicts=5))
+            self.assertRaises(ManifestConflictError, m.update, b, p, max_attempts=3)
+            self.assertEqual(3, m.update_stats.conflicts)
+
+    def test_read_only_content(self):
+        m = Manifest(bucket='bucket', repo_name='repo', storage=StorageMock(self.SEARCH_DATA))
+        content = m.content
+
+        self.assertEqual(self.SEARCH_DATA, content)
+        self.assertEqual('AAAA==', content['@ns']['dev']['@last_success']['@include']['spark']['@binaries'][0]['@md5'])
+        with self.assertRaises(TypeError):
+            content['@ns']['dev'] = {}
+        with self.assertRaises(TypeError):
+            content['@ns']['master']['@last_success']['@include']['spark']['@binaries'][0] = {}
+
+        copied = content.to_dict()
+        copied['@ns'].clear()
+        self.assertEqual(['dev', 'master'], sorted(m.content['@ns']))
+
+    def test_apply_branch_entry(self):
+        entry = {'@last_success': {'@rev': '333333'}}
+        merged = _apply_branch_entry(self.SEARCH_DATA, 'dev', entry)
+
+        self.assertIs(entry, merged['@ns']['dev'])
+        self.assertIs(self.SEARCH_DATA['@ns']['master'], merged['@ns']['master'])
+        self.assertEqual('111111', self.SEARCH_DATA['@ns']['dev']['@last_success']['@rev'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,57 @@
+# coding: utf-8
+
+import io
+import os
+import unittest
+
+from unittest import mock
+
+from mf import serialization
+
+MANIFEST = {
+    '@spec': 1,
+    '@ns': {
+        'feature-ünïcode': {
+            '@last_success': {
+                '@built_at': '2019-12-01T05:01:01.000001+00:00',
+                '@rev': '222222',
+                '@include': {'spark': {'@binaries': [{'@md5': 'BBBB==', '@ref': 'gs://bucket/"quoted"\tapp.jar'}]}}
+            }
+        }
+    }
+}
+
+
+class TestSerialization(unittest.TestCase):
+
+    def test_codecs_agree(self):
+        encoded = serialization.dumps(MANIFEST)
+
+        with mock.patch.dict(os.environ, {'MF_JSON_CODEC': 'json'}):
+            self.assertEqual('json', serialization.codec())
+            self.assertEqual(encoded, serialization.dumps(MANIFEST))
+            self.assertEqual(MANIFEST, serialization.loads(encoded))
+
+        self.assertEqual(MANIFEST, serialization.loads(encoded))
+        self.assertEqual(MANIFEST, serialization.loads(encoded.decode('utf-8')))
+
+    def test_gzip(self):
+        encoded = serialization.dumps(MANIFEST)
+        compressed = serialization.gzip_compress(encoded)
+
+        self.assertEqual(compressed, serialization.gzip_compress(encoded))
+        self.assertEqual(encoded, serialization.gunzip_if_compressed(compressed))
+        self.assertEqual(encoded, serialization.gunzip_if_compressed(encoded))
+
+    def test_json_lines(self):
+        out = io.BytesIO()
+        rows = [{'branch': 'dev', 'n': i} for i in range(2500)]
+
+        serialization.write_json_lines(rows, out)
+
+        lines = out.getvalue().decode('utf-8').splitlines()
+        self.assertEqual(rows, [serialization.loads(line) for line in lines])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# coding: utf-8
+
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mf.config import Project
+from mf.snapshot import BuildSnapshot
+
+TEST_ROOT = Path(__file__).absolute().parent
+
+
+class TestBuildSnapshot(unittest.TestCase):
+
+    def _project(self, root: Path) -> Project:
+        return Project({
+            'bucket': 'bucket',
+            'repository': 'repo',
+            'components': {
+                'spark': {'type': 'some', 'assets': [{'glob': './test_dir/*.txt'}]},
+                'configs': {'type': 'some', 'assets': [{'glob': './test_dir/**/*.ini', 'zip': True}]}
+            }
+        }, root)
+
+    def test_dump_load(self):
+        snapshot = BuildSnapshot.capture(self._project(TEST_ROOT))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file = Path(tmp) / 'snapshot.json'
+            snapshot.dump(file)
+            loaded = BuildSnapshot.load(file)
+
+            for captured, restored in zip(snapshot.components, loaded.components):
+                self.assertEqual(captured.name, restored.name)
+                self.assertEqual([(a.filename, a.md5, a.size) for a in captured.assets],
+                                 [(a.filename, a.md5, a.size) for a in restored.assets])
+
+            # the archive is materialized next to the snapshot
+            archive = loaded.components[1].assets[0]
+            self.assertEqual(Path(tmp) / archive.filename, archive.path)
+            with archive.open() as f, snapshot.components[1].assets[0].open() as expected:
+                self.assertEqual(expected.read(), f.read())
+
+    def test_changed_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / 'test_dir').mkdir()
+            file = Path(tmp) / 'test_dir' / 'app.txt'
+            file.write_bytes(b'content')
+
+            snapshot = BuildSnapshot.capture(self._project(Path(tmp)))
+
+            file.write_bytes(b'another content')
+            os.utime(str(file), ns=(0, 0))
+
+            self.assertRaises(RuntimeError, snapshot.components[0].assets[0].open)
+
+
+if __name__ == '__main__':
+    unittest.main()
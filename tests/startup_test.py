@@ -0,0 +1,37 @@
+# coding: utf-8
+
+import subprocess
+import sys
+import unittest
+
+from pathlib import Path
+
+from mf.manifest import StorageGCS
+
+ROOT = Path(__file__).absolute().parent.parent
+
+#
+# Modules which are imported on first use only, they dominate the startup time of the CLI.
+#
+HEAVY_MODULES = ['google.cloud.storage', 'google.auth', 'requests', 'jsonschema', 'zstandard', 'google_crc32c',
+                 'orjson', 'aiohttp', 'asyncio']
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_no_heavy_imports(self):
+        code = 'import sys, mf.main; print(",".join(m for m in sys.argv[1:] if m in sys.modules))'
+        out = subprocess.run([sys.executable, '-c', code] + HEAVY_MODULES, cwd=str(ROOT),
+                             stdout=subprocess.PIPE, check=True)
+
+        self.assertEqual('', out.stdout.decode('utf-8').strip())
+
+    def test_lazy_storage_client(self):
+        storage = StorageGCS('bucket', 'repo')
+
+        self.assertIsNone(storage._client)
+        self.assertFalse(storage._bucket_checked)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# coding: utf-8
+
+import base64
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from pathlib import Path
+
+from unittest import mock
+
+from mf.assets import RawAsset
+from mf.cache import ArtifactCache
+from mf.manifest import Manifest, StorageBase
+from mf.transfer import upload_assets, download_binaries, split_parts, FileSlice, TransferError
+
+TEST_DIR = Path(__file__).absolute().parent / 'test_dir'
+
+
+class StorageMock:
+
+    def __init__(self, failing=(), remote_md5s=None, deleted=()):
+        self.uploaded = []
+        self.touched = []
+        self.failing = set(failing)
+        self.remote_md5s = remote_md5s or {}
+        self.deleted = set(deleted)
+        self._lock = threading.Lock()
+
+    def fetch_md5s(self, bucket, keys):
+        return dict((k, self.remote_md5s[k]) for k in keys if k in self.remote_md5s)
+
+    def touch_objects(self, bucket, keys):
+        self.touched.extend(keys)
+        return [k for k in keys if k in self.deleted]
+
+    def upload(self, bucket, key, file, md5=None, crc32c=None):
+        if key in self.failing:
+            raise IOError(f'can not upload {key}')
+        with self._lock:
+            self.uploaded.append(key)
+
+
+class FlakyStorage(StorageBase):
+    """
+    Every first download of an object breaks in the middle.
+    """
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.calls = []
+
+    def fetch_manifest(self):
+        return 'repo/manifest.json', 1, {'@ns': {}}
+
+    def download(self, bucket, key, file, start=0):
+        data = self.blobs[key]
+        first = all(k != key for k, _ in self.calls)
+        self.calls.append((key, start))
+
+        with open(file, 'ab' if start else 'wb') as f:
+            if first:
+                f.write(data[start:len(data) // 2])
+                raise IOError('connection reset')
+            f.write(data[start:])
+
+
+class TestDownloadBinaries(unittest.TestCase):
+
+    def test_resume(self):
+        blobs = {'repo/a.jar': b'a' * 1000, 'repo/b.jar': b'b' * 10}
+        storage = FlakyStorage(blobs)
+        binaries = [{
+            'branch': 'dev', 'app': 'spark', 'url': f'gs://bucket/{key}', 'filename': key.split('/')[-1],
+            'md5': base64.b64encode(hashlib.md5(data).digest()).decode()
+        } for key, data in blobs.items()]
+
+        with tempfile.TemporaryDirectory() as dest, mock.patch('mf.transfer.backoff_delay', return_value=0):
+            download_binaries(Manifest('bucket', 'repo', storage=storage), binaries, dest)
+
+            self.assertEqual(blobs['repo/a.jar'], (Path(dest) / 'dev' / 'spark' / 'a.jar').read_bytes())
+            self.assertEqual(blobs['repo/b.jar'], (Path(dest) / 'dev' / 'spark' / 'b.jar').read_bytes())
+            self.assertEqual([], list(Path(dest).glob('**/*.part')))
+
+        self.assertIn(('repo/a.jar', 500), storage.calls)
+
+    def test_shared_cache(self):
+        data = b'a' * 100
+        storage = FlakyStorage({'repo/a.jar': data})
+        binary = {'branch': 'dev', 'app': 'spark', 'url': 'gs://bucket/repo/a.jar', 'filename': 'a.jar',
+                  'md5': base64.b64encode(hashlib.md5(data).digest()).decode()}
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch('mf.transfer.backoff_delay', return_value=0):
+            cache = ArtifactCache(Path(tmp) / 'cache')
+            manifest = Manifest('bucket', 'repo', storage=storage)
+
+            for dest in ['first', 'second']:
+                download_binaries(manifest, [binary], Path(tmp) / dest, cache=cache)
+                self.assertEqual(data, (Path(tmp) / dest / 'dev' / 'spark' / 'a.jar').read_bytes())
+
+        # the broken first attempt and its resume, the second destination is served by the cache
+        self.assertEqual([('repo/a.jar', 0), ('repo/a.jar', 50)], storage.calls)
+
+    def test_md5_mismatch(self):
+        storage = FlakyStorage({'repo/a.jar': b'a' * 10})
+        binary = {'branch': 'dev', 'app': 'spark', 'url': 'gs://bucket/repo/a.jar', 'filename': 'a.jar',
+                  'md5': 'AAAA=='}
+
+        with tempfile.TemporaryDirectory() as dest, mock.patch('mf.transfer.backoff_delay', return_value=0):
+            with self.assertRaises(TransferError):
+                download_binaries(Manifest('bucket', 'repo', storage=storage), [binary], dest, attempts=2)
+
+            self.assertEqual([], list(Path(dest).glob('**/a.jar*')))
+
+
+class TestUploadAssets(unittest.TestCase):
+
+    def test_largest_first(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            assets = {}
+            for name, size in [('small', 10), ('large', 1000), ('medium', 100)]:
+                f = Path(tmp) / name
+                f.write_bytes(b'x' * size)
+                assets[name] = RawAsset(f)
+
+            storage = StorageMock()
+            upload_assets(storage, 'bucket', assets, parallelism=1)
+
+        self.assertEqual(['large', 'medium', 'small'], storage.uploaded)
+
+    def test_errors_collected(self):
+        assets = dict((f.name, RawAsset(f)) for f in TEST_DIR.glob('*.txt'))
+
+        storage = StorageMock(failing=['file_a.txt', 'file_b.txt'])
+        with self.assertRaises(TransferError) as ctx:
+            upload_assets(storage, 'bucket', assets, parallelism=4)
+
+        self.assertEqual({'file_a.txt', 'file_b.txt'}, set(k for k, _ in ctx.exception.errors))
+        self.assertEqual(['file_q.txt'], storage.uploaded)
+
+    def test_skip_same_md5(self):
+        a, b, q = [RawAsset(TEST_DIR / f'file_{x}.txt') for x in 'abq']
+        assets = {'a': a, 'b': b, 'q': q}
+
+        storage = StorageMock(remote_md5s={'a': a.md5, 'b': q.md5})
+        upload_assets(storage, 'bucket', assets)
+
+        self.assertEqual({'b', 'q'}, set(storage.uploaded))
+        self.assertEqual(['a'], storage.touched)
+
+    def test_skipped_deleted_meanwhile(self):
+        a, q = [RawAsset(TEST_DIR / f'file_{x}.txt') for x in 'aq']
+
+        storage = StorageMock(remote_md5s={'a': a.md5, 'q': q.md5}, deleted=['a'])
+        upload_assets(storage, 'bucket', {'a': a, 'q': q})
+
+        self.assertEqual(['a'], storage.uploaded)
+
+
+class TestCompositeParts(unittest.TestCase):
+
+    def test_split_parts(self):
+        self.assertEqual([(0, 4), (4, 4), (8, 2)], split_parts(10, part_size=4))
+        # parts grow to fit into max_parts
+        self.assertEqual([(0, 5), (5, 5)], split_parts(10, part_size=2, max_parts=2))
+        self.assertEqual([], split_parts(0, part_size=4))
+
+    def test_file_slice(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            f = Path(tmp) / 'data'
+            f.write_bytes(b'0123456789')
+
+            with FileSlice(f, 3, 4) as part:
+                self.assertEqual(b'34', part.read(2))
+                self.assertEqual(b'56', part.read())
+                self.assertEqual(b'', part.read())
+                self.assertEqual(4, part.seek(0, 2))
+                self.assertEqual(1, part.seek(1))
+                self.assertEqual(b'456', part.read(100))
+
+
+if __name__ == '__main__':
+    unittest.main()